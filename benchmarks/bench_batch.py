@@ -0,0 +1,43 @@
+import tempfile
+
+from benchmarks.plans import synthetic_household
+from src.batch import BatchRunner
+from src.plan import plan_from_dict
+from src.writers import ParquetWriter
+
+# Many household plans (see synthetic_household), one process. asv style:
+# `params` are the number of plans. OneByOne is the same work done plan by
+# plan with VectorizedSimulation, without writing results.
+PLANS = [100, 1_000, 10_000]
+
+
+class BatchRun:
+    params = PLANS
+    param_names = ["plans"]
+
+    def setup(self, plans):
+        self.plans = [synthetic_household(seed) for seed in range(plans)]
+        self.writer = ParquetWriter(tempfile.mkdtemp(prefix="batch-"))
+
+    def time_run(self, plans):
+        BatchRunner(self.plans, self.writer, max_workers=1).run()
+
+
+class OneByOne:
+    params = PLANS
+    param_names = ["plans"]
+
+    def setup(self, plans):
+        if plans > 1_000:
+            # About 40s
+            raise NotImplementedError
+        self.plans = [synthetic_household(seed) for seed in range(plans)]
+
+    def time_run(self, plans):
+        for plan in self.plans:
+            simulation = plan_from_dict(plan).simulation()
+            try:
+                simulation.run()
+            except ValueError:
+                continue
+            simulation.build_results_dataframe()
@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLAN = os.path.join(ROOT, "plans", "example.yaml")
+
+# Cold start of a fresh interpreter: what a user waits for on every command
+# line run. `budget` is an absolute limit in seconds checked by run.py, on
+# top of the comparison with the baseline.
+
+
+def _python(*args, cwd=ROOT):
+    subprocess.run(
+        [sys.executable, *args],
+        cwd=cwd,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+class Import:
+    params = []
+    param_names = []
+    budget = 1.0
+
+    def time_import(self):
+        _python("-c", "import src.cli, src.plan, src.writers")
+
+
+class ColdStart:
+    params = ["npz", "csv"]
+    param_names = ["format"]
+    budget = 1.5
+
+    def setup(self, format):
+        self.out = tempfile.mkdtemp(prefix="financial-planner-")
+
+    def time_cli_run(self, format):
+        _python(
+            "-m",
+            "src.cli",
+            "run",
+            PLAN,
+            "--months",
+            "120",
+            "--out",
+            self.out,
+            "--format",
+            format,
+        )
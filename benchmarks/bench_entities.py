@@ -0,0 +1,62 @@
+import random
+
+from benchmarks.plans import synthetic_real_estate
+from src.entity import Entity, Loan
+from src.utils import month_range
+
+# Entity methods evaluated once per month of the horizon, like Simulation
+# does. asv style: `params` are the horizons in years.
+
+
+class EntityFutureValue:
+    params = [10, 40, 100]
+    param_names = ["years"]
+
+    def setup(self, years):
+        self.dates = month_range("2023-10-01", 12 * years)
+        self.entity = Entity(
+            name="Salary",
+            amount=8_000,
+            annual_inflation_rate=4,
+            start_date="2023-10-01",
+        )
+
+    def time_calculate_future_value(self, years):
+        for date in self.dates:
+            self.entity.calculate_future_value(date)
+
+
+class LoanQueries:
+    params = [10, 40, 100]
+    param_names = ["years"]
+
+    def setup(self, years):
+        self.dates = month_range("2023-10-01", 12 * years)
+        self.loan = Loan(
+            name="Loan",
+            amount=800_000,
+            annual_interest_rate=6.5,
+            term_in_year=30,
+            start_date="2023-12-01",
+        )
+
+    def time_calculate_interest_paid_by(self, years):
+        for date in self.dates:
+            self.loan.calculate_interest_paid_by(date)
+
+    def time_calculate_remaining_balance_by(self, years):
+        for date in self.dates:
+            self.loan.calculate_remaining_balance_by(date)
+
+
+class RealEstateCashFlow:
+    params = [10, 40, 100]
+    param_names = ["years"]
+
+    def setup(self, years):
+        self.dates = month_range("2023-10-01", 12 * years)
+        self.real_estate = synthetic_real_estate(random.Random(0), 1, "2023-10-01", 1)
+
+    def time_calculate_monthly_cash_flow(self, years):
+        for date in self.dates:
+            self.real_estate.calculate_monthly_cash_flow(date)
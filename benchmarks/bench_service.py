@@ -0,0 +1,46 @@
+import asyncio
+import threading
+
+from benchmarks.plans import synthetic_household
+from src.service import SimulationClient, SimulationService
+
+# Concurrent users of the local service (src.service), each sending
+# REQUESTS plans one after the other on its own connection. The service
+# runs in a background thread with one worker process. `budget` is an
+# absolute limit in seconds checked by run.py.
+REQUESTS = 5
+
+
+class ConcurrentUsers:
+    params = [20, 200]
+    param_names = ["users"]
+    budget = 5.0
+
+    def setup(self, users):
+        self.plans = [synthetic_household(seed) for seed in range(users * REQUESTS)]
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.service = SimulationService(port=0, max_workers=1)
+        asyncio.run_coroutine_threadsafe(self.service.start(), self.loop).result()
+
+    def teardown(self, users):
+        asyncio.run_coroutine_threadsafe(self.service.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    async def _user(self, user):
+        async with SimulationClient(port=self.service.port) as client:
+            first, last = user * REQUESTS, (user + 1) * REQUESTS
+            for plan in self.plans[first:last]:
+                try:
+                    await client.simulate(plan)
+                except ValueError:
+                    # Negative bank account
+                    pass
+
+    async def _users(self, users):
+        await asyncio.gather(*(self._user(user) for user in range(users)))
+
+    def time_requests(self, users):
+        asyncio.run(self._users(users))
@@ -0,0 +1,75 @@
+from benchmarks.plans import synthetic_simulation_inputs
+from src.allocation import CashAllocation
+from src.entity import BankAccount, Stock
+from src.simulation import Simulation
+from src.utils import month_range
+from src.vectorized import VectorizedSimulation
+
+# asv style: `params` are the plan sizes (entities, nested ones included)
+# and the horizons in years. Simulations mutate their bank account, so
+# setup builds a fresh plan before every sample.
+ENTITIES = [10, 100, 1_000, 10_000]
+YEARS = [10, 40, 100]
+
+
+class Aggregation:
+    params = [ENTITIES, YEARS]
+    param_names = ["entities", "years"]
+
+    def setup(self, entities, years):
+        self.cashflow, self.balance = synthetic_simulation_inputs(entities, years=years)
+        self.dates = month_range("2023-10-01", 12 * years)
+
+    def time_cashflow(self, entities, years):
+        for date in self.dates:
+            self.cashflow.calculate_monthly_cash_flow(date)
+
+    def time_balance(self, entities, years):
+        for date in self.dates:
+            self.balance.calculate_net_worth(date)
+
+
+class SimulationRun:
+    params = [ENTITIES, YEARS]
+    param_names = ["entities", "years"]
+    engine = Simulation
+
+    def setup(self, entities, years):
+        cashflow, balance = synthetic_simulation_inputs(entities, years=years)
+        self.simulation = self.engine("2023-10-01", 12 * years, cashflow, balance)
+
+    def time_run(self, entities, years):
+        self.simulation.run()
+        self.simulation.get_results_dataframe()
+
+
+class VectorizedSimulationRun(SimulationRun):
+    engine = VectorizedSimulation
+
+
+class CashAccounts:
+    # The plan's cash flow routed between `accounts` cash accounts: the bank
+    # account, capped savings accounts and a stock taking what is left
+    params = [[1, 10], YEARS]
+    param_names = ["accounts", "years"]
+
+    def setup(self, accounts, years):
+        cashflow, balance = synthetic_simulation_inputs(100, years=years)
+        names = ["Bank Account"]
+        for index in range(1, accounts - 1):
+            names.append(f"Savings {index}")
+            balance.add_entity(
+                BankAccount(names[-1], 1_000 * index, 2, start_date="2023-10-01")
+            )
+        if accounts > 1:
+            names.append("ETF")
+            balance.add_entity(Stock("ETF", 10_000, 6, start_date="2023-10-01"))
+        surplus = [(name, 20_000 * (index + 1)) for index, name in enumerate(names)]
+        surplus[-1] = names[-1]
+        self.simulation = VectorizedSimulation(
+            "2023-10-01", 12 * years, cashflow, balance
+        )
+        self.simulation.set_allocation(CashAllocation(surplus, names))
+
+    def time_run(self, accounts, years):
+        self.simulation.run()
@@ -0,0 +1,252 @@
+import random
+
+from src.entity import BankAccount, Entity, Loan, RealEstate, Stock
+from src.sweep import plan_from_entities
+from src.utils import add_months, key_to_date
+
+# Budget lines of src/variables.py: (name, amount, annual inflation rate)
+INCOMES = [("Salary", 8_000, 4), ("Salary", 6_000, 4)]
+EXPENSES = [
+    ("Rent", -1_400, 5),
+    ("Amenities", -600, 4),
+    ("Transport", -500, 10),
+    ("Entertainment", -650, 4),
+    ("Travelling", -1_000, 4),
+    ("Food", -800, 4),
+    ("Other", -500, 2),
+]
+ACQUISITION_COSTS = [
+    ("Renovations", -12_000),
+    ("Welcome Taxe", -12_000),
+    ("Inspection", -1_200),
+    ("Notary", -1_200),
+    ("Moving", -1_200),
+]
+
+# A property with its loan and acquisition entities counts as this many
+# entities
+REAL_ESTATE_SIZE = 1 + 1 + 1 + len(ACQUISITION_COSTS) + 3
+
+
+def _date(start_date, months):
+    return key_to_date(add_months(start_date, months))
+
+
+def synthetic_real_estate(rng, index, start_date, years):
+    acquisition_date = _date(start_date, rng.randrange(max(1, 12 * years // 2)))
+    amount = rng.randrange(400, 1_200) * 1_000
+    cashdown = amount // 5
+    acquisition_entities = [
+        Entity(
+            name=f"Cashdown_{index}",
+            amount=-cashdown,
+            start_date=acquisition_date,
+            end_date=acquisition_date,
+        )
+    ]
+    for name, cost in ACQUISITION_COSTS:
+        acquisition_entities.append(
+            Entity(
+                name=f"{name}_{index}",
+                amount=cost,
+                start_date=acquisition_date,
+                end_date=acquisition_date,
+            )
+        )
+    acquisition_entities += [
+        Entity(
+            name=f"Taxes_{index}",
+            amount=-450,
+            annual_inflation_rate=4,
+            start_date=acquisition_date,
+        ),
+        Entity(
+            name=f"Recurring_Renovations_{index}",
+            amount=-650,
+            annual_inflation_rate=3,
+            start_date=acquisition_date,
+        ),
+        Entity(
+            name=f"Rents_{index}",
+            amount=rng.randrange(1, 4) * 1_300,
+            annual_inflation_rate=4,
+            start_date=acquisition_date,
+        ),
+    ]
+    return RealEstate(
+        name=f"Property_{index}",
+        amount=amount,
+        cashdown=cashdown,
+        annual_expected_return=rng.choice([3, 4]),
+        acquisition_entities=acquisition_entities,
+        loan=Loan(
+            name=f"Loan_{index}",
+            amount=amount - cashdown,
+            annual_interest_rate=rng.choice([5.5, 6.1, 6.5]),
+            term_in_year=rng.choice([25, 30]),
+            annual_inflation_rate=0,
+            start_date=acquisition_date,
+        ),
+        start_date=acquisition_date,
+    )
+
+
+def synthetic_plan(entities, start_date="2023-10-01", years=40, seed=0):
+    # A plan shaped like src/variables.py with about `entities` entities
+    # (nested ones included): salaries, expenses (some ending, some one-off),
+    # properties with a loan and acquisition costs, and stocks. The bank
+    # account is large enough to never go negative over `years`.
+    rng = random.Random(seed)
+    budget = []
+    assets_liabilities = [
+        BankAccount(
+            name="Bank Account",
+            amount=max(entities, 10) * 1_000_000,
+            annual_inflation_rate=6,
+            start_date=start_date,
+        )
+    ]
+    count = 1
+    index = 0
+    while count < entities:
+        index += 1
+        kind = rng.random()
+        if kind < 0.1 and entities - count >= REAL_ESTATE_SIZE:
+            assets_liabilities.append(
+                synthetic_real_estate(rng, index, start_date, years)
+            )
+            count += REAL_ESTATE_SIZE
+            continue
+        if kind < 0.15:
+            assets_liabilities.append(
+                Stock(
+                    name=f"Stock_{index}",
+                    amount=rng.randrange(10, 100) * 1_000,
+                    annual_expected_return=rng.choice([5, 6, 7]),
+                    start_date=_date(start_date, rng.randrange(12 * years)),
+                )
+            )
+        elif kind < 0.35:
+            name, amount, rate = rng.choice(INCOMES)
+            budget.append(
+                Entity(
+                    name=f"{name}_{index}",
+                    amount=amount,
+                    annual_inflation_rate=rate,
+                    start_date=start_date,
+                )
+            )
+        else:
+            name, amount, rate = rng.choice(EXPENSES)
+            start = rng.randrange(12 * years)
+            end = None
+            if rng.random() < 0.3:
+                # Ends after a while or happens once
+                end = _date(start_date, start + rng.randrange(12 * years - start))
+            budget.append(
+                Entity(
+                    name=f"{name}_{index}",
+                    amount=amount,
+                    annual_inflation_rate=rate,
+                    start_date=_date(start_date, start),
+                    end_date=end,
+                )
+            )
+        count += 1
+    return budget, assets_liabilities
+
+
+def synthetic_simulation_inputs(entities, start_date="2023-10-01", years=40, seed=0):
+    # (CashFlow, Balance) of a synthetic plan
+    return plan_from_entities(*synthetic_plan(entities, start_date, years, seed))
+
+
+def synthetic_household(seed, start_date="2023-10-01", years=30):
+    # Plan dict (see src.plan) of one household: one or two salaries, a few
+    # expenses, sometimes stocks and a property with its loan. Horizons and
+    # sizes vary from one seed to the next.
+    rng = random.Random(seed)
+    years = rng.randrange(5, years + 1)
+    entities = []
+    for index in range(rng.randrange(1, 3)):
+        name, amount, rate = INCOMES[index]
+        entities.append(
+            {
+                "name": f"{name} {index + 1}",
+                "amount": amount * rng.uniform(0.5, 1.5),
+                "annual_inflation_rate": rate,
+                "start_date": start_date,
+            }
+        )
+    for name, amount, rate in rng.sample(EXPENSES, rng.randrange(3, 8)):
+        entities.append(
+            {
+                "name": name,
+                "amount": amount * rng.uniform(0.5, 1.5),
+                "annual_inflation_rate": rate,
+                "start_date": _date(start_date, rng.randrange(12)),
+            }
+        )
+    assets_liabilities = [
+        {
+            "type": "BankAccount",
+            "name": "Bank Account",
+            "amount": rng.randrange(1_000, 3_000) * 1_000,
+            "annual_inflation_rate": rng.choice([0, 2, 4, 6]),
+            "start_date": start_date,
+        }
+    ]
+    for index in range(rng.randrange(3)):
+        assets_liabilities.append(
+            {
+                "type": "Stock",
+                "name": f"Stock {index + 1}",
+                "amount": rng.randrange(10, 100) * 1_000,
+                "annual_expected_return": rng.choice([5, 6, 7]),
+                "start_date": _date(start_date, rng.randrange(12 * years)),
+            }
+        )
+    if rng.random() < 0.5:
+        acquisition_date = _date(start_date, rng.randrange(12 * years))
+        amount = rng.randrange(300, 900) * 1_000
+        cashdown = amount // 5
+        acquisition_entities = [
+            {
+                "name": f"{name} House",
+                "amount": cost,
+                "start_date": acquisition_date,
+                "end_date": acquisition_date,
+            }
+            for name, cost in [("Cashdown", -cashdown)] + ACQUISITION_COSTS
+        ]
+        acquisition_entities.append(
+            {
+                "name": "Taxes House",
+                "amount": -450,
+                "annual_inflation_rate": 4,
+                "start_date": acquisition_date,
+            }
+        )
+        assets_liabilities.append(
+            {
+                "type": "RealEstate",
+                "name": "House",
+                "amount": amount,
+                "cashdown": cashdown,
+                "annual_expected_return": rng.choice([3, 4]),
+                "start_date": acquisition_date,
+                "loan": {
+                    "name": "House Loan",
+                    "amount": amount - cashdown,
+                    "annual_interest_rate": rng.choice([5.5, 6.1, 6.5]),
+                    "term_in_year": rng.choice([25, 30]),
+                    "start_date": acquisition_date,
+                },
+                "acquisition_entities": acquisition_entities,
+            }
+        )
+    return {
+        "simulation": {"start_date": start_date, "duration": 12 * years},
+        "entities": entities,
+        "assets_liabilities": assets_liabilities,
+    }
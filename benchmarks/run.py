@@ -0,0 +1,141 @@
+import argparse
+import importlib
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+
+from loguru import logger
+
+MODULES = [
+    "benchmarks.bench_entities",
+    "benchmarks.bench_simulation",
+    "benchmarks.bench_batch",
+    "benchmarks.bench_cli",
+    "benchmarks.bench_service",
+]
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def discover(modules=MODULES):
+    # asv conventions: classes with `params`/`param_names`, a `setup` (and
+    # `teardown`) taking the parameters and `time_*` methods
+    for module_name in modules:
+        module = importlib.import_module(module_name)
+        for cls in vars(module).values():
+            if not isinstance(cls, type) or cls.__module__ != module.__name__:
+                continue
+            methods = sorted(name for name in dir(cls) if name.startswith("time_"))
+            if len(cls.param_names) == 1:
+                combinations = [(value,) for value in cls.params]
+            else:
+                combinations = itertools.product(*cls.params)
+            for args in combinations:
+                label = ", ".join(f"{n}={v}" for n, v in zip(cls.param_names, args))
+                for method in methods:
+                    short = module_name.rsplit(".", 1)[-1]
+                    name = f"{short}.{cls.__name__}.{method}({label})"
+                    yield name, cls, method, dict(zip(cls.param_names, args))
+
+
+def measure(cls, method, params, repeat=5, max_time=2.0):
+    # Best of up to `repeat` samples, each after a fresh setup. Slow cases
+    # stop sampling once `max_time` seconds were spent.
+    samples = []
+    while len(samples) < repeat and sum(samples) < max_time:
+        instance = cls()
+        if hasattr(instance, "setup"):
+            try:
+                instance.setup(**params)
+            except NotImplementedError:
+                return None
+        start = time.perf_counter()
+        getattr(instance, method)(**params)
+        samples.append(time.perf_counter() - start)
+        if hasattr(instance, "teardown"):
+            instance.teardown(**params)
+    return min(samples)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the benchmark suite.")
+    parser.add_argument("-k", "--filter", default="", help="Run matching names")
+    parser.add_argument(
+        "--quick", action="store_true", help="At most 1,000 entities and 40 years"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument(
+        "--save", action="store_true", help="Store the timings as the baseline"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.5,
+        help="Fail when a case is this many times slower than the baseline",
+    )
+    args = parser.parse_args(argv)
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    regressions = []
+    for name, cls, method, params in discover():
+        if args.filter not in name:
+            continue
+        if args.quick and (
+            params.get("entities", 0) > 1_000 or params.get("years", 0) > 40
+        ):
+            continue
+        seconds = measure(cls, method, params, args.repeat)
+        if seconds is None:
+            continue
+        results[name] = seconds
+        line = f"{name:75} {seconds * 1000:12.2f} ms"
+        if name in baseline:
+            ratio = seconds / baseline[name]
+            line += f" {ratio:6.2f}x"
+            if ratio > args.threshold:
+                regressions.append(name)
+                line += " REGRESSION"
+        # Absolute limit in seconds, e.g. for the command line cold start
+        budget = getattr(cls, "budget", None)
+        if budget is not None and seconds > budget:
+            regressions.append(name)
+            line += f" OVER BUDGET ({budget}s)"
+        print(line, flush=True)
+
+    if args.save:
+        # Keeps the baseline of cases that were not run
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(
+                {
+                    "machine": platform.platform(),
+                    "python": platform.python_version(),
+                    "results": dict(sorted(baseline.items())),
+                },
+                f,
+                indent=2,
+            )
+        print(f"Baseline saved to {args.baseline}")
+
+    if regressions:
+        print(
+            f"{len(regressions)} regression(s) over {args.threshold}x the baseline"
+            " or over budget"
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
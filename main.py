@@ -1,34 +1,41 @@
+import os
 import sys
 
 from loguru import logger
 
-from src.balance import Balance
-from src.cashflow import CashFlow
-from src.simulation import Simulation
-from src.variables import ASSETS_LIAIBILITIES, ENTITIES
+from src.writers import CSVWriter
 
-import os 
 
-# CASHFLOW
-cashflow = CashFlow()
-for entity in ENTITIES + ASSETS_LIAIBILITIES:
-    cashflow.add_entity(entity)
+def build_simulation():
+    # The plan in src/variables.py is only built when the script runs
+    from src.balance import Balance
+    from src.cashflow import CashFlow
+    from src.simulation import Simulation
+    from src.variables import ASSETS_LIAIBILITIES, ENTITIES
 
-# BALANCE
-balance = Balance()
+    # CASHFLOW
+    cashflow = CashFlow()
+    for entity in ENTITIES + ASSETS_LIAIBILITIES:
+        cashflow.add_entity(entity)
 
-for entity in ASSETS_LIAIBILITIES:
-    balance.add_entity(entity)
+    # BALANCE
+    balance = Balance()
+
+    for entity in ASSETS_LIAIBILITIES:
+        balance.add_entity(entity)
+
+    return Simulation(
+        start_date="2023-10-01", duration=12 * 10, cashflow=cashflow, balance=balance
+    )
 
 
 if __name__ == "__main__":
     os.makedirs("results", exist_ok=True)
-    
+
     logger.remove()
-    logger.add(sys.stderr, level="DEBUG")
+    # LOG_LEVEL=DEBUG prints every entity, every month
+    logger.add(sys.stderr, level=os.environ.get("LOG_LEVEL", "INFO"))
 
-    simulation = Simulation(
-        start_date="2023-10-01", duration=12 * 10, cashflow=cashflow, balance=balance
-    )
+    simulation = build_simulation()
     simulation.run()
-    simulation.get_results_dataframe(save_to_excel=True)
+    simulation.save_results(CSVWriter("results"))
@@ -0,0 +1,324 @@
+import numpy as np
+from loguru import logger
+
+from src.entity import BankAccount, Stock
+from src.utils import key_to_date
+
+# Months evaluated at once before checking that the same accounts still take
+# the surplus and cover the deficits, doubled while they do
+WINDOW = 16
+
+
+class CashAllocation:
+    # Routes every month's net cash flow between cash accounts of the
+    # balance (BankAccount or Stock entities) instead of a single "Bank
+    # Account":
+    #
+    #   CashAllocation(
+    #       surplus=[("Chequing", 10_000), ("Savings", 50_000), "ETF"],
+    #       deficit=["Chequing", "Savings", "ETF"],
+    #   )
+    #
+    # A surplus fills the `surplus` accounts in order up to their cap (no cap
+    # when only a name is given) and the last active one takes what is left.
+    # A deficit is drawn from the `deficit` accounts in order down to zero,
+    # drawing from a Stock sells it. A BankAccount keeps growing at its rate
+    # and a Stock at its expected return on the allocated balance, except the
+    # "Bank Account" which holds its balance as it does without an allocation
+    # (its update() drops the rate). A single "Bank Account" taking every
+    # surplus and deficit gives the same results as no allocation. A deficit
+    # the accounts can not cover raises ValueError, like a negative bank
+    # account. The cash of events (BuyStock, SellStock, SellRealEstate) goes
+    # through the same rules on the event date, see step.
+    def __init__(self, surplus, deficit):
+        self.surplus = [
+            (rule, None) if isinstance(rule, str) else (rule[0], rule[1])
+            for rule in surplus
+        ]
+        self.deficit = list(deficit)
+        if not self.surplus:
+            raise ValueError("The allocation needs at least one surplus account.")
+        self.accounts = list(
+            dict.fromkeys([name for name, _ in self.surplus] + self.deficit)
+        )
+
+    @classmethod
+    def from_dict(cls, data):
+        # {"surplus": [name or {"account": name, "cap": cap}], "deficit": [name]}
+        surplus = [
+            rule if isinstance(rule, str) else (rule["account"], rule.get("cap"))
+            for rule in data.get("surplus") or []
+        ]
+        return cls(surplus, data.get("deficit") or [])
+
+    def to_dict(self):
+        return {
+            "surplus": [{"account": name, "cap": cap} for name, cap in self.surplus],
+            "deficit": list(self.deficit),
+        }
+
+    def entities(self, balance):
+        entities = []
+        for name in self.accounts:
+            entity = balance.entities.get(name)
+            if entity is None:
+                raise ValueError(f"Cash account {name} is not in the balance.")
+            if not isinstance(entity, (BankAccount, Stock)):
+                raise ValueError(f"Cash account {name} is not a BankAccount or Stock.")
+            entities.append(entity)
+        return entities
+
+    def _rules(self, entities):
+        # Monthly growth factors once allocated, caps and account numbers in
+        # rule order
+        growth = np.array(
+            [
+                1 if _holds(e) else 1 + np.float64(e.monthly_inflation_rate)
+                for e in entities
+            ],
+            dtype=np.float64,
+        )
+        caps = np.full(len(entities), np.inf)
+        for name, cap in self.surplus:
+            if cap is not None:
+                caps[self.accounts.index(name)] = cap
+        surplus = [self.accounts.index(name) for name, _ in self.surplus]
+        deficit = [self.accounts.index(name) for name in self.deficit]
+        return growth, caps, surplus, deficit
+
+    def _month(self, grown, active, cashflow, caps, surplus, deficit, date):
+        # One month: account values before the month's cash flow -> after
+        values = grown.copy()
+        if cashflow > 0:
+            takers = [i for i in surplus if active[i]]
+            if not takers:
+                raise ValueError(f"No cash account takes the surplus on {date}.")
+            remaining = cashflow
+            for i in takers:
+                room = caps[i] - grown[i]
+                if i == takers[-1]:
+                    deposit = remaining
+                elif room > 0:
+                    deposit = min(remaining, room)
+                else:
+                    continue
+                values[i] = grown[i] + deposit
+                remaining = remaining - deposit
+                if remaining <= 0:
+                    break
+        elif cashflow < 0:
+            need = -cashflow
+            for i in deficit:
+                if not active[i] or grown[i] <= 0:
+                    continue
+                take = min(need, grown[i])
+                values[i] = grown[i] - take
+                need = need - take
+                if need <= 0:
+                    break
+            if need > 0:
+                logger.error(
+                    "Cash accounts can not cover the deficit. "
+                    f"Date: {date}, Amount: {-need}"
+                )
+                raise ValueError("Cash accounts can not cover the deficit")
+        return values
+
+    def step(self, balance, date, cashflow):
+        # Month by month engine and event cash: allocates `cashflow` on
+        # `date` and leaves every account entity holding its new value from
+        # `date`. Returns the total of the BankAccount accounts.
+        entities = self.entities(balance)
+        _, caps, surplus, deficit = self._rules(entities)
+        active = [e.is_active_on(date) for e in entities]
+        grown = np.array([e.calculate_future_value(date) for e in entities], float)
+        values = self._month(grown, active, cashflow, caps, surplus, deficit, date)
+        cash = 0.0
+        for entity, value, is_active in zip(entities, values, active):
+            if is_active:
+                _hold(entity, value, date)
+                if isinstance(entity, BankAccount):
+                    cash = cash + value
+        return cash
+
+    def evaluate(self, balance, keys, cashflow, opening=None):
+        # Account values over the date keys `keys` for the total `cashflow`,
+        # as {name: values} and the total of the BankAccount accounts.
+        # `opening` are the values on keys[0] before its cash flow (see
+        # carry), by default the entities' values.
+        #
+        # Stretches of months where the same account takes every surplus and
+        # the same account covers every deficit are linear: the receiving
+        # accounts are a cumulative sum (a recurrence when they grow) and the
+        # others only grow. Such stretches are evaluated as arrays and only
+        # the months where the routing changes (a cap reached, an account
+        # emptied or refilled) go through the rules one by one. Values are
+        # the same as month by month.
+        entities = self.entities(balance)
+        growth, caps, surplus, deficit = self._rules(entities)
+        months = len(keys)
+        values = np.zeros((len(entities), months))
+        if months == 0:
+            return self._results(entities, values)
+        active = np.array([e.is_active_on_array(keys) for e in entities])
+        # Months where an account starts or stops
+        changes = np.flatnonzero((active[:, 1:] != active[:, :-1]).any(axis=0)) + 1
+        changes = np.append(changes, months)
+
+        grown = self._entry(entities, active[:, 0], keys[0], opening)
+        t, window = 0, WINDOW
+        while t < months:
+            end = min(changes[np.searchsorted(changes, t, side="right")], t + window)
+            accepted = self._stretch(
+                grown, active[:, t], cashflow[t:end], growth, caps, surplus, deficit
+            )
+            count = accepted.shape[1]
+            stop = t + count
+            values[:, t:stop] = accepted
+            t = stop
+            if t < end:
+                # The routing changes this month
+                if count:
+                    grown = self._grown(values, active, t, growth, entities, keys)
+                values[:, t] = self._month(
+                    grown,
+                    active[:, t],
+                    cashflow[t],
+                    caps,
+                    surplus,
+                    deficit,
+                    key_to_date(keys[t]),
+                )
+                t += 1
+                window = max(WINDOW, window // 2)
+            else:
+                window *= 2
+            if t < months:
+                grown = self._grown(values, active, t, growth, entities, keys)
+        return self._results(entities, values)
+
+    def _results(self, entities, values):
+        cash = np.zeros(values.shape[1])
+        for entity, account in zip(entities, values):
+            if isinstance(entity, BankAccount):
+                cash = cash + account
+        return dict(zip(self.accounts, values)), cash
+
+    def _entry(self, entities, active, key, opening):
+        grown = np.zeros(len(entities))
+        for i, entity in enumerate(entities):
+            if not active[i]:
+                continue
+            if opening is not None and not np.isnan(opening[i]):
+                grown[i] = opening[i]
+            else:
+                grown[i] = entity.calculate_future_value(key_to_date(key))
+        return grown
+
+    def _grown(self, values, active, t, growth, entities, keys):
+        # Values on month t before its cash flow
+        grown = values[:, t - 1] * growth
+        started = active[:, t] & ~active[:, t - 1]
+        for i in np.flatnonzero(started):
+            grown[i] = entities[i].calculate_future_value(key_to_date(keys[t]))
+        grown[~active[:, t]] = 0.0
+        return grown
+
+    def _stretch(self, grown, active, flows, growth, caps, surplus, deficit):
+        # Values of the leading months of `flows` that keep the routing of
+        # the first month, as an (accounts, months) array
+        months = len(flows)
+        takers = [i for i in surplus if active[i]]
+        taker = None
+        for i in takers:
+            if i == takers[-1] or caps[i] - grown[i] > 0:
+                taker = i
+                break
+        payer = next((i for i in deficit if active[i] and grown[i] > 0), None)
+
+        # Accounts outside the routing only grow, all at once
+        values = np.empty((len(grown), months))
+        values[:, 0] = grown
+        values[:, 1:] = growth[:, None]
+        np.cumprod(values, axis=1, out=values)
+        if taker is not None and taker == payer:
+            values[taker] = _recurrence(grown[taker], growth[taker], flows)
+        else:
+            if taker is not None:
+                received = np.maximum(flows, 0.0)
+                values[taker] = _recurrence(grown[taker], growth[taker], received)
+            if payer is not None:
+                received = np.minimum(flows, 0.0)
+                values[payer] = _recurrence(grown[payer], growth[payer], received)
+
+        # Values before each month's cash flow
+        before = np.empty_like(values)
+        before[:, 0] = grown
+        before[:, 1:] = values[:, :-1] * growth[:, None]
+        valid = np.ones(months, dtype=bool)
+        gains, losses = flows > 0, flows < 0
+        if taker is None:
+            valid &= ~gains
+        else:
+            if taker != takers[-1]:
+                valid &= ~gains | (flows <= caps[taker] - before[taker])
+            full = takers[: takers.index(taker)]
+            if full:
+                room = caps[full, None] - before[full]
+                valid &= ~gains | (room.max(axis=0) <= 0)
+        if payer is None:
+            valid &= ~losses
+        else:
+            valid &= ~losses | (-flows <= before[payer])
+            empty = [i for i in deficit[: deficit.index(payer)] if active[i]]
+            if empty:
+                valid &= ~losses | (before[empty].max(axis=0) <= 0)
+        accepted = months if valid.all() else int(np.argmin(valid))
+        return values[:, :accepted]
+
+    def carry(self, balance, values, last_date):
+        # Opening values for the month after `last_date` from the accounts'
+        # values {name: array} up to it, NaN for accounts inactive on it
+        opening = np.full(len(self.accounts), np.nan)
+        entities = self.entities(balance)
+        growth, _, _, _ = self._rules(entities)
+        for i, (name, entity) in enumerate(zip(self.accounts, entities)):
+            if entity.is_active_on(last_date):
+                opening[i] = values[name][-1] * growth[i]
+        return opening
+
+    def sync(self, balance, opening, date):
+        # Leaves the account entities holding the `opening` values on `date`,
+        # before events change them
+        for entity, value in zip(self.entities(balance), opening):
+            if not np.isnan(value):
+                _hold(entity, value, date)
+
+
+def _holds(entity):
+    # The "Bank Account" does not grow once allocated, as without an
+    # allocation
+    return isinstance(entity, BankAccount) and entity.name == "Bank Account"
+
+
+def _hold(entity, value, date):
+    # `value` on `date`, growing at the account's rate from then on (the end
+    # date is kept)
+    entity.amount = value
+    entity.start_date = date
+    if _holds(entity):
+        entity.annual_inflation_rate = 0
+
+
+def _recurrence(value, growth, received):
+    # v[0] = value + r[0], v[t] = v[t - 1] * growth + r[t], computed in the
+    # order the month by month engine does
+    if growth == 1:
+        carry = received.copy()
+        carry[0] = value + received[0]
+        return np.cumsum(carry)
+    values = np.empty(len(received))
+    for month in range(len(received)):
+        value = value * growth + received[month] if month else value + received[0]
+        values[month] = value
+    return values
@@ -2,25 +2,41 @@ import datetime as dt
 
 from loguru import logger
 
+from src.index import ActiveEntities
+from src.tracing import format_entity_values
+
 
 class Balance:
     def __init__(self):
         self.entities = {}
+        self.active = ActiveEntities(self.entities)
+        # SimulationMetrics set by a profiled Simulation.run
+        self.metrics = None
 
     def add_entity(self, entity):
         self.entities[entity.name] = entity
+        self.active.add(entity)
+
+    def remove_entity(self, name):
+        self.entities.pop(name)
+        self.active.remove(name)
 
     def calculate_net_worth(self, date: str):
-        logger.debug(f"Calculate Net Worth for {date}")
+        logger.debug("Calculate Net Worth for {}", date)
         monthly_net_worth = 0
         results = {}
-        for entity in self.entities.values():
-            net_worth = entity.calculate_future_value(date)
+        for entity in self.active.on(date):
+            if self.metrics is None:
+                net_worth = entity.calculate_future_value(date)
+            else:
+                net_worth = self.metrics.call_entity(
+                    "net_worth", entity, entity.calculate_future_value, date
+                )
             results[entity.name] = net_worth
-            entity_name = entity.name
-            logger.debug(f"{entity_name:15} : ${net_worth:,.0f}")
             monthly_net_worth += net_worth
-        logger.info(f"Total net worth: $ {monthly_net_worth:,.0f} \n\n")
+        # Messages are only formatted when a sink accepts their level
+        logger.opt(lazy=True).debug("{}", lambda: format_entity_values(results))
+        logger.info("Total net worth: $ {:,.0f} \n\n", monthly_net_worth)
         return monthly_net_worth, results
 
     def update(self, *arg, **kwarg):
@@ -0,0 +1,489 @@
+import os
+import time
+from typing import Optional
+
+import numpy as np
+from loguru import logger
+
+from src.plan import (
+    build,
+    concat_columns,
+    error_message,
+    flatten_plans,
+    layout_errors,
+    plan_errors,
+    read_plan,
+    simulation_error,
+)
+from src.table import CHUNK_ROWS, EntityTable, future_values
+from src.utils import date_key, key_to_date, month_range_keys, months_between_array
+from src.writers import ParquetWriter, ResultWriter
+
+# Top-level types evaluated for every plan of a batch at once, as EntityTable
+# rows (a BankAccount grows like an Entity). RealEstate and Loan rows are
+# built as entity objects, one plan at a time. Only the BankAccount named
+# "Bank Account" carries the cash flow, other ones are growing assets like in
+# VectorizedSimulation.
+TABLE_TYPES = {"Entity": "Entity", "BankAccount": "Entity", "Stock": "Stock"}
+
+# Dataset tables written by BatchRunner
+TABLES = {"totals": "batch_results", "entities": "batch_entity_results"}
+
+
+def _load(items, start_date=None, duration=None):
+    # Plan dicts and files -> one set of columns for all plans, with the plan
+    # number of each row. Returns (plan ids, columns, plan numbers, start keys,
+    # durations, failures); invalid plans are left out and listed in
+    # failures.
+    plan_ids, settings, parts, numbers = [], [], [], []
+    dicts, dict_numbers, failures = [], [], {}
+    for plan_id, plan in items:
+        if isinstance(plan, (str, os.PathLike)):
+            try:
+                columns, plan_settings = read_plan(os.fspath(plan))
+            except (ValueError, OSError) as error:
+                failures[plan_id] = str(error)
+                continue
+            parts.append(columns)
+            numbers.append(np.full(len(columns["type"]), len(plan_ids)))
+        else:
+            problems = layout_errors(plan)
+            if problems:
+                failures[plan_id] = error_message(
+                    None, [(None, problem) for problem in problems]
+                )
+                continue
+            dicts.append(plan)
+            dict_numbers.append(len(plan_ids))
+            plan_settings = plan.get("simulation") or {}
+        plan_ids.append(plan_id)
+        settings.append(plan_settings)
+    if dicts:
+        columns, plans = flatten_plans(dicts)
+        parts.append(columns)
+        numbers.append(np.array(dict_numbers, dtype=np.int64)[plans])
+    columns = concat_columns(parts)
+    plans = np.concatenate(numbers) if numbers else np.empty(0, dtype=np.int64)
+
+    errors = {}
+    start_keys = np.zeros(len(plan_ids), dtype=np.int64)
+    durations = np.zeros(len(plan_ids), dtype=np.int64)
+    for number, plan_settings in enumerate(settings):
+        error = simulation_error(plan_settings, start_date, duration)
+        if error is not None:
+            errors[number] = error
+        elif plan_settings.get("allocation"):
+            errors[number] = "Cash allocations are not supported in batches."
+        else:
+            plan_start = start_date or plan_settings.get("start_date")
+            start_keys[number] = date_key(str(plan_start)[:10])
+            durations[number] = int(duration or plan_settings.get("duration"))
+
+    # Rows of a plan are contiguous, errors number them from its first row
+    first = dict(zip(*np.unique(plans, return_index=True)))
+    by_plan = {}
+    for row, message in plan_errors(columns, plans):
+        by_plan.setdefault(plans[row], []).append((row, message))
+    for number, problems in by_plan.items():
+        errors[number] = error_message(columns, problems, first[number])
+    for number in set(range(len(plan_ids))) - set(first):
+        errors[number] = error_message(columns, [(None, "the plan is empty")])
+
+    for number, error in errors.items():
+        failures[plan_ids[number]] = error
+    valid = np.ones(len(plan_ids), dtype=bool)
+    valid[list(errors)] = False
+    rows = valid[plans]
+    renumber = np.cumsum(valid) - 1
+    return (
+        [plan_id for plan_id, ok in zip(plan_ids, valid) if ok],
+        {column: values[rows] for column, values in columns.items()},
+        renumber[plans[rows]],
+        start_keys[valid],
+        durations[valid],
+        failures,
+    )
+
+
+def _grid(start_key):
+    # Plans share a month grid when their start days match. Days past the
+    # 28th are clamped differently depending on the month, so such plans
+    # only share a grid with plans starting on the same date.
+    day = start_key % 32
+    return day if day <= 28 else start_key
+
+
+class BatchResult:
+    # One batch of plans on a shared month grid. Totals are (plans, months)
+    # arrays, `mask` marks the months inside each plan's horizon. Per-entity
+    # values are (plans, entities, months), padded with zeros past each
+    # plan's entity count.
+    def __init__(
+        self, batch, plan_ids, dates, mask, cashflow, bank_balance, net_worth, names
+    ):
+        self.batch = batch
+        self.plan_ids = plan_ids
+        self.dates = dates
+        self.mask = mask
+        self.cashflow = cashflow
+        self.bank_balance = bank_balance
+        self.net_worth = net_worth
+        # {"cashflow": [[names of plan 0], ...], "net_worth": [...]}
+        self.names = names
+        self.values = {}
+
+    @property
+    def plans(self):
+        return len(self.plan_ids)
+
+    def to_dataframe(self):
+        # Long format: one row per (plan, month) inside the plan's horizon
+        import pandas as pd
+
+        plans, months = np.nonzero(self.mask)
+        return pd.DataFrame(
+            {
+                "plan": np.asarray(self.plan_ids, dtype=object)[plans],
+                "Date": np.asarray(self.dates, dtype=object)[months],
+                "cashflow": self.cashflow[plans, months],
+                "bank_balance": self.bank_balance[plans, months],
+                "net_worth": self.net_worth[plans, months],
+            }
+        )
+
+    def entity_dataframe(self):
+        # Long format: one row per (plan, table, entity, month), like
+        # ScenarioSweep
+        import pandas as pd
+
+        frames = []
+        for table, values in self.values.items():
+            width = values.shape[1]
+            names = np.full((self.plans, width), None, dtype=object)
+            for plan, plan_names in enumerate(self.names[table]):
+                names[plan, : len(plan_names)] = plan_names
+            cells = (names != None)[:, :, None] & self.mask[:, None, :]  # noqa: E711
+            plans, entities, months = np.nonzero(cells)
+            frames.append(
+                pd.DataFrame(
+                    {
+                        "plan": np.asarray(self.plan_ids, dtype=object)[plans],
+                        "Date": np.asarray(self.dates, dtype=object)[months],
+                        "table": table,
+                        "entity": names[plans, entities],
+                        "value": values[plans, entities, months],
+                    }
+                )
+            )
+        return pd.concat(frames, ignore_index=True)
+
+
+def _evaluate(
+    batch, plan_ids, columns, plans, start_keys, durations, keep_entities=False
+):
+    # Stacks the plans into (plans, entities, months) arrays on one month
+    # grid. Values match VectorizedSimulation: same per-entity arrays, summed
+    # in the same order.
+    count = len(plan_ids)
+    offsets = months_between_array(start_keys, start_keys.min())
+    months = int((offsets + durations).max())
+    keys = month_range_keys(key_to_date(start_keys.min()), months)
+    grid = np.arange(months)
+    mask = (grid >= offsets[:, None]) & (grid < (offsets + durations)[:, None])
+
+    # Top-level entities in plan_from_entities order: entities, then
+    # assets_liabilities. Slots are their column in each plan's tables.
+    top = np.flatnonzero(columns["parent"] == None)  # noqa: E711
+    section = (columns["section"][top] != "entities").astype(np.int64)
+    order = top[np.lexsort((top, section, plans[top]))]
+    owner = plans[order]
+    types = columns["type"][order]
+    names = columns["name"][order]
+    cashflow_count = np.bincount(owner, minlength=count)
+    cashflow_first = np.cumsum(cashflow_count) - cashflow_count
+    cashflow_slot = np.arange(len(order)) - cashflow_first[owner]
+    assets = columns["section"][order] == "assets_liabilities"
+    net_worth_count = np.bincount(owner[assets], minlength=count)
+    net_worth_first = np.cumsum(net_worth_count) - net_worth_count
+    net_worth_slot = np.full(len(order), -1)
+    net_worth_slot[assets] = np.arange(assets.sum()) - net_worth_first[owner[assets]]
+
+    cashflow_values = np.zeros((count, cashflow_count.max(), months))
+    net_worth_values = np.zeros((count, net_worth_count.max(), months))
+
+    # Entity, Stock and BankAccount rows of every plan in one table
+    table = EntityTable("Batch", capacity=len(order))
+    carried = (types == "BankAccount") & (names == "Bank Account") & assets
+    table_rows = []
+    for kind in ("Entity", "Stock"):
+        selected = np.flatnonzero(
+            np.isin(types, [t for t, k in TABLE_TYPES.items() if k == kind])
+        )
+        if not len(selected):
+            continue
+        rows = order[selected]
+        table.extend(
+            kind,
+            names[selected].tolist(),
+            columns["amount"][rows].astype(np.float64),
+            annual_inflation_rate=_rates(columns["annual_inflation_rate"][rows]),
+            annual_expected_return=_rates(columns["annual_expected_return"][rows]),
+            start_date=_dates(columns["start_date"][rows]),
+            end_date=_dates(columns["end_date"][rows]),
+        )
+        table_rows.append(selected)
+    table_rows = np.concatenate(table_rows)
+    row_owner = owner[table_rows]
+    row_carried = carried[table_rows]
+    row_types = types[table_rows]
+    row_cashflow_slot = cashflow_slot[table_rows]
+    row_net_worth_slot = net_worth_slot[table_rows]
+
+    opening_balance = np.zeros(count)
+    for start in range(0, len(table), CHUNK_ROWS):
+        chunk = slice(start, min(start + CHUNK_ROWS, len(table)))
+        values = future_values(
+            table.amount[chunk],
+            table.annual_rate[chunk] / 1200,
+            table.start[chunk],
+            table.end[chunk],
+            keys,
+        )
+        plan, kind = row_owner[chunk], row_types[chunk]
+        # Stocks and bank accounts have no cash flow
+        cash = kind == "Entity"
+        cashflow_values[plan[cash], row_cashflow_slot[chunk][cash]] = values[cash]
+        bank = row_carried[chunk]
+        opening_balance[plan[bank]] = values[bank, offsets[plan[bank]]]
+        worth = (row_net_worth_slot[chunk] >= 0) & ~bank
+        net_worth_values[plan[worth], row_net_worth_slot[chunk][worth]] = values[worth]
+
+    # RealEstate and Loan rows (and the rows nested in them) are built as
+    # objects, one plan at a time
+    built = (columns["parent"] != None) | ~np.isin(  # noqa: E711
+        columns["type"], list(TABLE_TYPES)
+    )
+    built = np.flatnonzero(built)
+    for plan in np.unique(plans[built]):
+        rows = built[plans[built] == plan]
+        own = owner == plan
+        slots = dict(zip(names[own], zip(cashflow_slot[own], net_worth_slot[own])))
+        entities, assets_liabilities = build(
+            {column: values[rows] for column, values in columns.items()}
+        )
+        for entity in entities + assets_liabilities:
+            cashflow, net_worth = slots[entity.name]
+            cashflow_values[plan, cashflow] = entity.calculate_monthly_cash_flow_array(
+                keys
+            )
+            if net_worth >= 0:
+                net_worth_values[plan, net_worth] = entity.calculate_future_value_array(
+                    keys
+                )
+
+    # Entity columns are summed one at a time, padding adds zeros
+    cashflow = np.zeros((count, months))
+    for column in range(cashflow_values.shape[1]):
+        cashflow = cashflow + cashflow_values[:, column]
+    cashflow = np.where(mask, cashflow, 0.0)
+
+    # Bank account carry from each plan's first month
+    plan = np.arange(count)
+    carry = cashflow.copy()
+    carry[plan, offsets] = opening_balance + cashflow[plan, offsets]
+    bank_balance = np.cumsum(carry, axis=1)
+
+    bank = order[carried]
+    net_worth_values[plans[bank], net_worth_slot[carried]] = bank_balance[plans[bank]]
+    net_worth = np.zeros((count, months))
+    for column in range(net_worth_values.shape[1]):
+        net_worth = net_worth + net_worth_values[:, column]
+    net_worth = np.where(mask, net_worth, 0.0)
+
+    result = BatchResult(
+        batch,
+        plan_ids,
+        [key_to_date(key) for key in keys],
+        mask,
+        cashflow,
+        bank_balance,
+        net_worth,
+        {
+            "cashflow": [n.tolist() for n in np.split(names, cashflow_first[1:])],
+            "net_worth": [
+                n.tolist() for n in np.split(names[assets], net_worth_first[1:])
+            ],
+        },
+    )
+    if keep_entities:
+        result.values = {"cashflow": cashflow_values, "net_worth": net_worth_values}
+    return result
+
+
+def _rates(values):
+    return np.where(values == None, 0, values).astype(np.float64)  # noqa: E711
+
+
+def _dates(values):
+    return [None if value is None else str(value)[:10] for value in values]
+
+
+def _negative_bank_balance(result):
+    # {plan id: error} of plans whose bank account went negative
+    negative = (result.bank_balance < 0) & result.mask
+    failures = {}
+    for plan in np.flatnonzero(negative.any(axis=1)):
+        month = np.argmax(negative[plan])
+        failures[result.plan_ids[plan]] = (
+            "Bank Account has a negative balance. "
+            f"Date: {result.dates[month]}, Amount: {result.bank_balance[plan, month]}"
+        )
+    return failures
+
+
+def evaluate_plans(items, start_date=None, duration=None, entities=False, batch=0):
+    # Evaluates (plan id, plan) items, one BatchResult per month grid.
+    # Returns (results, {plan id: error}); plans whose bank account goes
+    # negative are masked out of the results.
+    plan_ids, columns, plans, start_keys, durations, failures = _load(
+        items, start_date, duration
+    )
+    grids = np.array([_grid(key) for key in start_keys], dtype=np.int64)
+
+    results = []
+    for grid in np.unique(grids):
+        numbers = np.flatnonzero(grids == grid)
+        rows = np.isin(plans, numbers)
+        result = _evaluate(
+            batch,
+            [plan_ids[number] for number in numbers],
+            {column: values[rows] for column, values in columns.items()},
+            np.searchsorted(numbers, plans[rows]),
+            start_keys[numbers],
+            durations[numbers],
+            entities,
+        )
+        failed = _negative_bank_balance(result)
+        failures.update(failed)
+        keep = np.array([plan_id not in failed for plan_id in result.plan_ids])
+        result.mask &= keep[:, None]
+        results.append(result)
+    return results, failures
+
+
+def _run_batch(task):
+    # Evaluates and writes one batch, in a worker process or not
+    batch, items, start_date, duration, writer, entities = task
+    results, failures = evaluate_plans(items, start_date, duration, entities, batch)
+
+    paths, succeeded = [], 0
+    for part, result in enumerate(results):
+        succeeded += int(result.mask.any(axis=1).sum())
+        partition = {"batch": batch, "part": part}
+        paths.append(
+            writer.write_table(TABLES["totals"], result.to_dataframe(), partition)
+        )
+        if entities:
+            paths.append(
+                writer.write_table(
+                    TABLES["entities"], result.entity_dataframe(), partition
+                )
+            )
+    return batch, paths, succeeded, failures
+
+
+class BatchRunner:
+    # Runs many independent plans (plan dicts or plan files, see src.plan)
+    # `batch_size` at a time: the Entity, Stock and BankAccount rows of a
+    # batch are evaluated together on a shared month grid and the plans'
+    # totals are summed as (plans, months) arrays, with a mask for plans of
+    # different horizons and padding for different entity counts. Every
+    # batch is written as `batch=<k>/part=<g>` partitions of one dataset,
+    # invalid plans and plans whose bank account goes negative are skipped
+    # and listed in `failures`. `plans` is a sequence or a {plan id: plan}
+    # mapping, start_date and duration override the plans' settings.
+    def __init__(
+        self,
+        plans,
+        writer: Optional[ResultWriter] = None,
+        batch_size: int = 1_000,
+        start_date: Optional[str] = None,
+        duration: Optional[int] = None,
+        entities: bool = False,
+        max_workers: Optional[int] = None,
+    ):
+        self.plans = plans
+        self.writer = writer or ParquetWriter("results")
+        self.batch_size = batch_size
+        self.start_date = start_date
+        self.duration = duration
+        # Also write every entity's cashflow and net worth
+        self.entities = entities
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.failures = {}
+        self.stats = {}
+
+    def _tasks(self):
+        items = (
+            self.plans.items()
+            if isinstance(self.plans, dict)
+            else enumerate(self.plans)
+        )
+        batch, chunk = 0, []
+        for item in items:
+            chunk.append(item)
+            if len(chunk) == self.batch_size:
+                yield self._task(batch, chunk)
+                batch, chunk = batch + 1, []
+        if chunk:
+            yield self._task(batch, chunk)
+
+    def _task(self, batch, chunk):
+        return (
+            batch,
+            chunk,
+            self.start_date,
+            self.duration,
+            self.writer,
+            self.entities,
+        )
+
+    def run(self):
+        started = time.perf_counter()
+        if self.max_workers == 1:
+            outputs = map(_run_batch, self._tasks())
+            return self._collect(outputs, started)
+
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            outputs = executor.map(_run_batch, self._tasks())
+            return self._collect(outputs, started)
+
+    def _collect(self, outputs, started):
+        self.failures = {}
+        paths, plans, batches = [], 0, 0
+        for batch, batch_paths, batch_plans, failures in outputs:
+            paths += batch_paths
+            plans += batch_plans
+            batches += 1
+            self.failures.update(failures)
+            for plan_id, error in failures.items():
+                logger.debug(f"Plan {plan_id} failed: {error}")
+        seconds = time.perf_counter() - started
+        self.stats = {
+            "plans": plans,
+            "failed": len(self.failures),
+            "batches": batches,
+            "seconds": seconds,
+            "plans_per_hour": 3600 * (plans + len(self.failures)) / seconds,
+        }
+        if self.failures:
+            logger.warning(
+                f"{len(self.failures)} plans failed, see BatchRunner.failures"
+            )
+        logger.info(
+            f"Batch run: {plans} plans, {len(self.failures)} failed, "
+            f"{self.stats['plans_per_hour']:,.0f} plans/hour"
+        )
+        return paths
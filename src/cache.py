@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+from loguru import logger
+
+from src.result import SimulationResult
+from src.table import EntityTable
+from src.utils import key_to_date, month_range_keys
+from src.vectorized import VectorizedSimulation
+
+# Part of every key, bump it when a change to the engines changes results
+CACHE_VERSION = 1
+
+
+def _number(value):
+    # 5 and 5.0 give the same plan
+    if isinstance(value, bool) or not isinstance(value, (int, float, np.number)):
+        return value
+    return float(value)
+
+
+def canonical_entity(entity):
+    # Every parameter of an entity (public scalar attributes and dates) and
+    # of the entities nested in it, as JSON-ready values
+    if isinstance(entity, EntityTable):
+        digest = hashlib.sha256()
+        for column in entity._columns():
+            digest.update(getattr(entity, column)[: entity.size].tobytes())
+        digest.update(json.dumps([entity.names, entity.parents]).encode())
+        return {"type": "EntityTable", "name": entity.name, "rows": digest.hexdigest()}
+    parameters = {
+        name: _number(value)
+        for name, value in vars(entity).items()
+        if not name.startswith("_")
+        and (value is None or isinstance(value, (int, float, str, np.number)))
+    }
+    parameters["start_date"] = entity.start_date
+    parameters["end_date"] = entity.end_date
+    nested = getattr(entity, "entities", {})
+    return {
+        "type": type(entity).__name__,
+        "parameters": parameters,
+        "entities": [canonical_entity(child) for child in nested.values()],
+    }
+
+
+def plan_key(simulation):
+    # Stable hash of the plan, start date and engine, the duration is left
+    # out so longer and shorter runs of a plan share one entry
+    plan = {
+        "version": CACHE_VERSION,
+        "engine": type(simulation).__name__,
+        "start_date": simulation.start_date,
+        "cashflow": [
+            canonical_entity(e) for e in simulation.cashflow.entities.values()
+        ],
+        "balance": [canonical_entity(e) for e in simulation.balance.entities.values()],
+    }
+    if simulation.allocation is not None:
+        plan["allocation"] = simulation.allocation.to_dict()
+    text = json.dumps(plan, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class ResultCache:
+    # Content-addressed store of simulation results on local disk: one .npz
+    # per plan (see plan_key) holding the cashflow and net worth arrays of the
+    # longest run so far. A shorter run is served from the stored prefix, a
+    # longer VectorizedSimulation run reuses it and only computes the extra
+    # months. Files are touched on every hit and the least recently used are
+    # deleted past `max_bytes`, so the bound holds across processes sharing
+    # the directory. Plans with scheduled events are not cached.
+    def __init__(self, directory=".cache/results", max_bytes=256 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def run(self, simulation, profile=False):
+        # Runs `simulation` through the cache and returns its result.
+        # `profile` is passed to the run on a miss or partial hit, a hit
+        # leaves simulation.metrics unset.
+        if len(simulation.events):
+            self.bypassed += 1
+            simulation.run(profile=profile)
+            return simulation.result
+
+        key = plan_key(simulation)
+        cached = self._load(key)
+        if cached is not None and cached.months >= simulation.duration:
+            self.hits += 1
+            self._serve(simulation, cached)
+            return simulation.result
+
+        if cached is not None and isinstance(simulation, VectorizedSimulation):
+            self.partial_hits += 1
+            simulation.run_from(cached, profile=profile)
+        else:
+            self.misses += 1
+            simulation.run(profile=profile)
+        self._store(key, simulation.result)
+        return simulation.result
+
+    def _serve(self, simulation, cached):
+        # Same result and end date as a run of `simulation.duration` months
+        months = simulation.duration
+        simulation.result = cached.head(months)
+        simulation.metrics = None
+        if isinstance(simulation, VectorizedSimulation):
+            # Entities are not compared again on the next run
+            simulation._state = None
+        keys = month_range_keys(simulation.start_date, months + 1)
+        simulation.date = key_to_date(keys[-1])
+
+    def _load(self, key):
+        path = self.path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                dates = data["dates"].tolist()
+                result = SimulationResult(
+                    dates,
+                    data["cashflow_names"].tolist(),
+                    data["net_worth_names"].tolist(),
+                )
+                result.values = {
+                    "cashflow": data["cashflow"],
+                    "net_worth": data["net_worth"],
+                }
+                result.months = len(dates)
+            os.utime(path)
+        except (FileNotFoundError, KeyError, ValueError, zipfile.BadZipFile):
+            return None
+        return result
+
+    def _store(self, key, result):
+        if result is None or result.months == 0:
+            return
+        months = result.months
+        # Written next to the entry then renamed, readers never see half a file
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(descriptor, "wb") as file:
+            np.savez(
+                file,
+                dates=np.array(result.dates[:months]),
+                cashflow_names=np.array(result.names["cashflow"], dtype=str),
+                net_worth_names=np.array(result.names["net_worth"], dtype=str),
+                cashflow=result.cashflow,
+                net_worth=result.net_worth,
+            )
+        os.replace(temporary, self.path(key))
+        self._evict()
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npz"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        size = sum(entry[1] for entry in entries)
+        # The newest entry is kept even when it is larger than the bound
+        while size > self.max_bytes and len(entries) > 1:
+            _, entry_size, path = entries.pop(0)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+            self.evictions += 1
+            logger.debug(f"Result cache: evicted {path}")
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.partial_hits + self.misses
+        return (self.hits + self.partial_hits) / lookups if lookups else 0.0
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            "hits": self.hits,
+            "partial_hits": self.partial_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+            "hit_rate": self.hit_rate,
+            "entries": len(entries),
+            "bytes": sum(entry[1] for entry in entries),
+        }
+
+    def clear(self):
+        for _, _, path in self._entries():
+            os.remove(path)
@@ -1,27 +1,42 @@
 import datetime as dt
 
-import pandas as pd
 from loguru import logger
 
+from src.index import ActiveEntities
+from src.tracing import format_entity_values
+
 
 class CashFlow:
     def __init__(self):
         self.entities = {}
+        self.active = ActiveEntities(self.entities)
+        # SimulationMetrics set by a profiled Simulation.run
+        self.metrics = None
 
     def add_entity(self, entity):
         self.entities[entity.name] = entity
+        self.active.add(entity)
+
+    def remove_entity(self, name):
+        self.entities.pop(name)
+        self.active.remove(name)
 
     def calculate_monthly_cash_flow(self, date):
-        logger.debug(f"Cashflow for: {date}")
+        logger.debug("Cashflow for: {}", date)
         results = {}
         monthly_cashflow = 0
-        for entity in self.entities.values():
-            cashflow = entity.calculate_monthly_cash_flow(date)
+        for entity in self.active.on(date):
+            if self.metrics is None:
+                cashflow = entity.calculate_monthly_cash_flow(date)
+            else:
+                cashflow = self.metrics.call_entity(
+                    "cashflow", entity, entity.calculate_monthly_cash_flow, date
+                )
             results[entity.name] = cashflow
-            entity_name = entity.name
-            logger.debug(f"{entity_name:15} : ${cashflow:,.0f}")
             monthly_cashflow += cashflow
-        logger.info(f"Total cashflow: ${monthly_cashflow:,.0f} \n\n")
+        # Messages are only formatted when a sink accepts their level
+        logger.opt(lazy=True).debug("{}", lambda: format_entity_values(results))
+        logger.info("Total cashflow: ${:,.0f} \n\n", monthly_cashflow)
         return monthly_cashflow, results
 
     def update(self, *arg, **kwarg):
@@ -0,0 +1,217 @@
+import argparse
+import os
+import sys
+import time
+
+from loguru import logger
+
+# Command line entry point:
+#
+#   python -m src.cli run plans/example.yaml --months 120 --out results/
+#   python -m src.cli batch households/*.yaml --out results/
+#   python -m src.cli serve --port 8765
+#
+# Only the simulation engine is imported up front. pandas, pyarrow and
+# openpyxl are imported by the writers that need them and matplotlib only
+# by Simulation.plot_results, so a headless run with --format npz stays on
+# NumPy.
+FORMATS = ("npz", "csv", "parquet", "feather", "excel")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="financial-planner", description="Run a financial plan simulation."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="simulate a plan file and save results")
+    run.add_argument("plan", help="plan file (.yaml, .json or .parquet)")
+    run.add_argument("--months", type=int, help="duration, overrides the plan")
+    run.add_argument("--start-date", help="first month, overrides the plan")
+    run.add_argument("--out", default="results", help="results directory")
+    run.add_argument("--format", choices=FORMATS, default="npz")
+    run.add_argument("--engine", choices=("vectorized", "loop"), default="vectorized")
+    run.add_argument(
+        "--as-table",
+        action="store_true",
+        default=None,
+        help="load Entity and Stock rows into entity tables",
+    )
+    run.add_argument("--profile", action="store_true", help="print phase timings")
+    stored = run.add_mutually_exclusive_group()
+    stored.add_argument("--cache", help="result cache directory, e.g. .cache/results")
+    stored.add_argument(
+        "--checkpoint",
+        help="checkpoint file, the same run resumes from it if it exists",
+    )
+    run.add_argument("--checkpoint-every", type=int, default=12, help="months")
+    run.add_argument("--log-level", default=os.environ.get("LOG_LEVEL", "WARNING"))
+
+    batch = commands.add_parser(
+        "batch", help="simulate many plan files into one partitioned dataset"
+    )
+    batch.add_argument("plans", nargs="+", help="plan files, one per household")
+    batch.add_argument("--months", type=int, help="duration, overrides the plans")
+    batch.add_argument("--start-date", help="first month, overrides the plans")
+    batch.add_argument("--out", default="results", help="dataset directory")
+    batch.add_argument(
+        "--format", choices=("parquet", "feather", "csv"), default="parquet"
+    )
+    batch.add_argument("--batch-size", type=int, default=1_000)
+    batch.add_argument("--workers", type=int, help="processes, all CPUs by default")
+    batch.add_argument(
+        "--entities", action="store_true", help="also write every entity's values"
+    )
+    batch.add_argument("--log-level", default=os.environ.get("LOG_LEVEL", "WARNING"))
+
+    serve = commands.add_parser("serve", help="answer plan JSON over local HTTP")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8765)
+    serve.add_argument("--socket", help="Unix socket path instead of TCP")
+    serve.add_argument(
+        "--window-ms", type=float, default=5.0, help="wait for requests to batch"
+    )
+    serve.add_argument("--max-batch", type=int, default=256)
+    serve.add_argument("--max-pending", type=int, default=2_000, help="then answer 503")
+    serve.add_argument("--workers", type=int, help="processes, all CPUs by default")
+    serve.add_argument("--log-level", default=os.environ.get("LOG_LEVEL", "INFO"))
+    return parser.parse_args(argv)
+
+
+def _engine(name):
+    if name == "loop":
+        from src.simulation import Simulation
+
+        return Simulation
+    from src.vectorized import VectorizedSimulation
+
+    return VectorizedSimulation
+
+
+def run(args):
+    from src.plan import load_plan
+    from src.writers import create_writer
+
+    started = time.perf_counter()
+    plan = load_plan(
+        args.plan,
+        as_table=args.as_table,
+        start_date=args.start_date,
+        duration=args.months,
+    )
+    simulation = plan.simulation(engine=_engine(args.engine))
+    if args.checkpoint:
+        from src.cache import plan_key
+        from src.simulation import Simulation
+
+        # The plan (entities, start date, engine) and duration of the run, a
+        # checkpoint of another run is refused instead of resumed
+        key = f"{plan_key(simulation)}:{simulation.duration}"
+        if os.path.exists(args.checkpoint):
+            try:
+                simulation = Simulation.resume(args.checkpoint, key=key)
+            except ValueError as error:
+                raise SystemExit(
+                    f"{error} Remove it or pass another --checkpoint path."
+                )
+            logger.info(f"Resuming from {args.checkpoint} on {simulation.date}")
+    if args.cache:
+        from src.cache import ResultCache
+
+        cache = ResultCache(args.cache)
+        cache.run(simulation, profile=args.profile)
+        logger.info(f"Result cache: {cache.stats()}")
+    else:
+        if args.checkpoint:
+            simulation.auto_checkpoint(args.checkpoint, args.checkpoint_every, key)
+        simulation.run(profile=args.profile)
+        if args.checkpoint and os.path.exists(args.checkpoint):
+            # Finished, the next run starts over
+            os.remove(args.checkpoint)
+    paths = simulation.save_results(create_writer(args.format, args.out))
+    if args.profile and simulation.metrics is not None:
+        print(simulation.metrics.report())
+    elif args.profile:
+        print("Served from the result cache, nothing to profile")
+    elapsed = time.perf_counter() - started
+    print(f"{simulation.duration} months simulated in {elapsed:.3f}s")
+    for path in paths:
+        print(path)
+    return paths
+
+
+def _plan_ids(paths):
+    # Plan ids are the file names without extension, a name seen before
+    # (a/plan.yaml and b/plan.yaml) gets a suffix: plan, plan-2, ...
+    plans, counts = {}, {}
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        plan_id = name
+        while plan_id in plans:
+            counts[name] = counts.get(name, 1) + 1
+            plan_id = f"{name}-{counts[name]}"
+        if plan_id != name:
+            logger.warning(f"Plan {path} is saved as {plan_id}, {name} is taken")
+        plans[plan_id] = path
+    return plans
+
+
+def batch(args):
+    from src.batch import BatchRunner
+    from src.writers import create_writer
+
+    plans = _plan_ids(args.plans)
+    runner = BatchRunner(
+        plans,
+        create_writer(args.format, args.out),
+        batch_size=args.batch_size,
+        start_date=args.start_date,
+        duration=args.months,
+        entities=args.entities,
+        max_workers=args.workers,
+    )
+    paths = runner.run()
+    stats = runner.stats
+    print(
+        f"{stats['plans']} plans simulated, {stats['failed']} failed in "
+        f"{stats['seconds']:.3f}s ({stats['plans_per_hour']:,.0f} plans/hour)"
+    )
+    for plan_id, error in runner.failures.items():
+        print(f"{plan_id}: {error}", file=sys.stderr)
+    return paths
+
+
+def serve(args):
+    import asyncio
+
+    from src.service import SimulationService
+
+    service = SimulationService(
+        host=args.host,
+        port=args.port,
+        path=args.socket,
+        window=args.window_ms / 1000,
+        max_batch=args.max_batch,
+        max_pending=args.max_pending,
+        max_workers=args.workers,
+    )
+    try:
+        asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+    if args.command == "run":
+        run(args)
+    elif args.command == "batch":
+        batch(args)
+    elif args.command == "serve":
+        serve(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,13 +2,26 @@ import datetime as dt
 from abc import ABC, abstractmethod
 from typing import List, Optional
 
+import numpy as np
 import numpy_financial as npf
 from loguru import logger
 
-from src.utils import relativedelta_in_months
+from src.growth import GROWTH_CACHE
+from src.index import ActiveEntities
+from src.utils import (
+    add_months,
+    date_key,
+    key_to_date,
+    months_between,
+    relativedelta_in_months_array,
+)
 
 
 class FinancialEntity(ABC):
+    # True when Simulation moves start_date to the current month (the bank
+    # account), such entities are never indexed by date
+    follows_clock = False
+
     def __init__(
         self,
         name,
@@ -27,6 +40,29 @@ class FinancialEntity(ABC):
         )
         self.end_date = end_date if end_date is not None else "2999-12-31"
 
+    # Dates are stored as ISO strings and as integer keys (see src.utils),
+    # the keys are what the calculations use.
+    @property
+    def start_date(self):
+        return self._start_date
+
+    @start_date.setter
+    def start_date(self, value):
+        self._start_key = date_key(value)
+        self._start_date = key_to_date(self._start_key)
+
+    @property
+    def end_date(self):
+        return self._end_date
+
+    @end_date.setter
+    def end_date(self, value):
+        self._end_key = date_key(value)
+        self._end_date = key_to_date(self._end_key)
+
+    def months_since_start(self, date):
+        return months_between(date_key(date), self._start_key)
+
     @abstractmethod
     def is_active_on(self, date: str):
         pass
@@ -43,10 +79,25 @@ class FinancialEntity(ABC):
     def update(self, **kwarg):
         pass
 
+    # Vectorized counterparts, `dates` is an int64 array of date keys
+    def is_active_on_array(self, dates):
+        return (self._start_key <= dates) & (dates <= self._end_key)
+
+    @abstractmethod
+    def calculate_future_value_array(self, dates):
+        pass
+
+    @abstractmethod
+    def calculate_monthly_cash_flow_array(self, dates):
+        pass
+
 
 class EntityFactory:
     @staticmethod
-    def create_entity(entity_type, **kwargs):
+    def create_entity(entity_type, table=None, **kwargs):
+        if table is not None:
+            # Entity and Stock rows of an EntityTable (src.table)
+            return table.add(entity_type, **kwargs)
         if entity_type == "BankAccount":
             return BankAccount(**kwargs)
         elif entity_type == "Stock":
@@ -60,6 +111,12 @@ class EntityFactory:
         else:
             raise ValueError(f"Entity type {entity_type} is not supported.")
 
+    @staticmethod
+    def create_entities(entity_type, table, **columns):
+        # Bulk load, every argument is a scalar or a sequence (see
+        # EntityTable.extend)
+        return table.extend(entity_type, **columns)
+
 
 class Entity(FinancialEntity):
     def __init__(
@@ -79,16 +136,16 @@ class Entity(FinancialEntity):
         return self.annual_inflation_rate / 1200
 
     def is_active_on(self, date: str):
-        return self.start_date <= date <= self.end_date
+        return self._start_key <= date_key(date) <= self._end_key
 
     def calculate_future_value(self, date: str):
         if self.is_active_on(date) is False:
             return 0
         if self.annual_inflation_rate == 0:
             return self.amount
-        total_months = relativedelta_in_months(date, self.start_date)
-        return npf.fv(
-            rate=self.monthly_inflation_rate, nper=total_months, pmt=0, pv=-self.amount
+        total_months = self.months_since_start(date)
+        return GROWTH_CACHE.future_value(
+            self.amount, self.monthly_inflation_rate, total_months
         )
 
     def calculate_monthly_cash_flow(self, date: str):
@@ -96,6 +153,19 @@ class Entity(FinancialEntity):
             return 0
         return self.calculate_future_value(date)
 
+    def calculate_future_value_array(self, dates):
+        active = self.is_active_on_array(dates)
+        if self.annual_inflation_rate == 0:
+            return np.where(active, self.amount, 0.0)
+        total_months = relativedelta_in_months_array(dates, self._start_key)
+        future_value = GROWTH_CACHE.future_value_array(
+            self.amount, self.monthly_inflation_rate, total_months
+        )
+        return np.where(active, future_value, 0.0)
+
+    def calculate_monthly_cash_flow_array(self, dates):
+        return self.calculate_future_value_array(dates)
+
     def update(self, **kwargs):
         name = self.name
         super().__init__(name, **kwargs)
@@ -116,10 +186,11 @@ class Loan(FinancialEntity):
 
         self.monthly_rate = annual_interest_rate / 1200
         self.periods_in_month = term_in_year * 12
+        self._schedule = None
 
     @property
     def calculate_monthly_payment(self):
-        return npf.pmt(self.monthly_rate, self.periods_in_month, -self.amount)
+        return self._amortization()["payment"]
 
     @property
     def monthly_inflation_rate(self):
@@ -127,8 +198,64 @@ class Loan(FinancialEntity):
             return 0
         return self.annual_inflation_rate / 1200
 
+    def _amortization(self):
+        # Full schedule computed once, invalidated by update(). Index k of the
+        # cumulative arrays and of `balance` is the state after k payments.
+        if self._schedule is None:
+            periods = np.arange(1, self.periods_in_month + 1)
+            payment = npf.pmt(self.monthly_rate, self.periods_in_month, -self.amount)
+            interest = npf.ipmt(
+                self.monthly_rate, periods, self.periods_in_month, -self.amount
+            )
+            principal = payment - interest
+            balance = npf.fv(
+                self.monthly_rate,
+                np.arange(self.periods_in_month + 1),
+                payment,
+                -self.amount,
+            )
+            self._schedule = {
+                "payment": payment,
+                "interest": interest,
+                "principal": principal,
+                "balance": balance,
+                "cumulative_interest": np.concatenate(([0.0], np.cumsum(interest))),
+                "cumulative_principal": np.concatenate(([0.0], np.cumsum(principal))),
+            }
+        return self._schedule
+
+    def _balance_after(self, total_months):
+        # Balance after `total_months` payments, past the term the annuity
+        # formula keeps going (and turns negative) like npf.fv does.
+        schedule = self._amortization()
+        if 0 <= total_months <= self.periods_in_month:
+            return schedule["balance"][total_months]
+        return npf.fv(
+            self.monthly_rate, total_months, schedule["payment"], -self.amount
+        )
+
+    def amortization_schedule(self):
+        import pandas as pd
+
+        schedule = self._amortization()
+        periods = np.arange(1, self.periods_in_month + 1)
+        dates = [
+            key_to_date(add_months(self._start_key, int(period))) for period in periods
+        ]
+        df = pd.DataFrame(
+            {
+                "Date": dates,
+                "Payment": np.full(self.periods_in_month, schedule["payment"]),
+                "Interest": schedule["interest"],
+                "Principal": schedule["principal"],
+                "Balance": schedule["balance"][1:],
+            },
+            index=pd.Index(periods, name="Period"),
+        )
+        return df
+
     def is_active_on(self, date: str):
-        return self.start_date <= date <= self.end_date
+        return self._start_key <= date_key(date) <= self._end_key
 
     def calculate_future_value(self, date):
         if self.is_active_on(date) is False:
@@ -141,47 +268,75 @@ class Loan(FinancialEntity):
         return -self.calculate_monthly_payment
 
     def calculate_interest_paid_by(self, date):
-        total_months = relativedelta_in_months(date, self.start_date)
-        interest = 0
-        for month in range(1, total_months + 1):
-            interest += npf.ipmt(
-                self.monthly_rate, month, self.periods_in_month, -self.amount
-            )
-        return interest
+        total_months = self.months_since_start(date)
+        if total_months <= 0:
+            return 0
+        if total_months <= self.periods_in_month:
+            return self._amortization()["cumulative_interest"][total_months]
+        # Every payment is interest + principal
+        principal = self.amount - self._balance_after(total_months)
+        return total_months * self.calculate_monthly_payment - principal
 
     def calculate_principal_paid_by(self, date):
-        total_months = relativedelta_in_months(date, self.start_date)
-        principal = 0
-        for month in range(1, total_months + 1):
-            principal += npf.ppmt(
-                self.monthly_rate, month, self.periods_in_month, -self.amount
-            )
+        total_months = self.months_since_start(date)
+        if total_months <= 0:
+            return 0
+        if total_months <= self.periods_in_month:
+            principal = self._amortization()["cumulative_principal"][total_months]
+        else:
+            principal = self.amount - self._balance_after(total_months)
         if principal > self.amount:
             return self.amount
         return principal
 
     def calculate_remaining_balance_by(self, date):
-        total_months = relativedelta_in_months(date, self.start_date)
-        remaining_balance = npf.fv(
-            self.monthly_rate,
-            total_months,
-            self.calculate_monthly_payment,
-            -self.amount,
-        )
+        total_months = self.months_since_start(date)
+        remaining_balance = self._balance_after(total_months)
         if remaining_balance < 0:
             return 0
         return remaining_balance
 
+    def calculate_remaining_balance_by_array(self, dates):
+        total_months = relativedelta_in_months_array(dates, self._start_key)
+        in_schedule = (total_months >= 0) & (total_months <= self.periods_in_month)
+        remaining_balance = np.where(
+            in_schedule,
+            self._amortization()["balance"][
+                np.clip(total_months, 0, self.periods_in_month)
+            ],
+            0.0,
+        )
+        if not in_schedule.all():
+            outside = ~in_schedule
+            remaining_balance[outside] = npf.fv(
+                self.monthly_rate,
+                total_months[outside],
+                self.calculate_monthly_payment,
+                -self.amount,
+            )
+        return np.where(remaining_balance < 0, 0.0, remaining_balance)
+
+    def calculate_future_value_array(self, dates):
+        active = self.is_active_on_array(dates)
+        return np.where(active, -self.calculate_remaining_balance_by_array(dates), 0.0)
+
+    def calculate_monthly_cash_flow_array(self, dates):
+        active = self.is_active_on_array(dates)
+        return np.where(active, -self.calculate_monthly_payment, 0.0)
+
     def update(self, **kwargs):
         name = self.name
         if "annual_interest_rate" in kwargs:
-            self.monthly_rate = kwargs["annual_interest_rate"] / 1200
+            self.monthly_rate = kwargs.pop("annual_interest_rate") / 1200
         if "term_in_year" in kwargs:
-            self.periods_in_month = kwargs["term_in_year"] * 12
+            self.periods_in_month = kwargs.pop("term_in_year") * 12
+        self._schedule = None
         super().__init__(name, **kwargs)
 
 
 class BankAccount(FinancialEntity):
+    follows_clock = True
+
     def __init__(
         self,
         name,
@@ -199,21 +354,38 @@ class BankAccount(FinancialEntity):
         return self.annual_inflation_rate / 1200
 
     def is_active_on(self, date: str):
-        return self.start_date <= date <= self.end_date
+        return self._start_key <= date_key(date) <= self._end_key
 
     def calculate_future_value(self, date: str):
         if self.is_active_on(date) is False:
             return 0
         if self.annual_inflation_rate == 0:
             return self.amount
-        total_months = relativedelta_in_months(date, self.start_date)
-        return npf.fv(
-            rate=self.monthly_inflation_rate, nper=total_months, pmt=0, pv=-self.amount
+        total_months = self.months_since_start(date)
+        return GROWTH_CACHE.future_value(
+            self.amount, self.monthly_inflation_rate, total_months
         )
 
     def calculate_monthly_cash_flow(self, date: str):
         return 0
 
+    def calculate_future_value_array(self, dates):
+        active = self.is_active_on_array(dates)
+        if self.annual_inflation_rate == 0:
+            return np.where(active, self.amount, 0.0)
+        total_months = relativedelta_in_months_array(dates, self._start_key)
+        future_value = GROWTH_CACHE.future_value_array(
+            self.amount, self.monthly_inflation_rate, total_months
+        )
+        return np.where(active, future_value, 0.0)
+
+    def calculate_monthly_cash_flow_array(self, dates):
+        return np.zeros(len(dates))
+
+    def set_balance(self, amount, date):
+        # Same state as left by update(): `amount` on `date`, without growth
+        super().__init__(self.name, amount=amount, start_date=date)
+
     def update(self, start_date, **kwargs):
         name = self.name
         amount = self.calculate_future_value(start_date)
@@ -243,21 +415,34 @@ class Stock(FinancialEntity):
         return self.annual_expected_return
 
     def is_active_on(self, date: str):
-        return self.start_date <= date <= self.end_date
+        return self._start_key <= date_key(date) <= self._end_key
 
     def calculate_future_value(self, date: str):
         if self.is_active_on(date) is False:
             return 0
         if self.annual_expected_return == 0:
             return self.amount
-        total_months = relativedelta_in_months(date, self.start_date)
-        return npf.fv(
-            rate=self.monthly_inflation_rate, nper=total_months, pmt=0, pv=-self.amount
+        total_months = self.months_since_start(date)
+        return GROWTH_CACHE.future_value(
+            self.amount, self.monthly_inflation_rate, total_months
         )
 
     def calculate_monthly_cash_flow(self, date: str):
         return 0
 
+    def calculate_future_value_array(self, dates):
+        active = self.is_active_on_array(dates)
+        if self.annual_expected_return == 0:
+            return np.where(active, self.amount, 0.0)
+        total_months = relativedelta_in_months_array(dates, self._start_key)
+        future_value = GROWTH_CACHE.future_value_array(
+            self.amount, self.monthly_inflation_rate, total_months
+        )
+        return np.where(active, future_value, 0.0)
+
+    def calculate_monthly_cash_flow_array(self, dates):
+        return np.zeros(len(dates))
+
     def update(self, **kwargs):
         name = self.name
         super().__init__(name, **kwargs)
@@ -292,6 +477,7 @@ class RealEstate(FinancialEntity):
         self.annual_expected_return = annual_expected_return / 1200
         self.loan = loan
         self.entities = {}
+        self.active = ActiveEntities(self.entities)
         if loan:
             self.add_entity(loan)
         if acquisition_entities:
@@ -305,19 +491,20 @@ class RealEstate(FinancialEntity):
         return self.annual_inflation_rate
 
     def is_active_on(self, date: str):
-        return self.start_date <= date <= self.end_date
+        return self._start_key <= date_key(date) <= self._end_key
 
     def add_entity(self, entity: Entity):
         self.entities[entity.name] = entity
+        self.active.add(entity)
 
     def remove_entity(self, entity: Entity):
         self.entities.pop(entity.name)
+        self.active.remove(entity.name)
 
     # Cashflow
     def calculate_monthly_cash_flow(self, date):
         return sum(
-            entity.calculate_monthly_cash_flow(date)
-            for entity in self.entities.values()
+            entity.calculate_monthly_cash_flow(date) for entity in self.active.on(date)
         )
 
     # Future value
@@ -326,13 +513,34 @@ class RealEstate(FinancialEntity):
             return 0
         gain = 0
         if self.annual_expected_return != 0:
-            total_months = relativedelta_in_months(date, self.start_date)
-            gain = npf.fv(self.annual_expected_return, total_months, 0, -self.amount)
+            total_months = self.months_since_start(date)
+            gain = GROWTH_CACHE.future_value(
+                self.amount, self.annual_expected_return, total_months
+            )
         remaining_loan = 0
         if self.loan:
             remaining_loan = self.loan.calculate_future_value(date)
         return gain + remaining_loan
 
+    def calculate_monthly_cash_flow_array(self, dates):
+        cash_flow = np.zeros(len(dates))
+        for entity in self.entities.values():
+            cash_flow = cash_flow + entity.calculate_monthly_cash_flow_array(dates)
+        return cash_flow
+
+    def calculate_future_value_array(self, dates):
+        active = self.is_active_on_array(dates)
+        gain = 0
+        if self.annual_expected_return != 0:
+            total_months = relativedelta_in_months_array(dates, self._start_key)
+            gain = GROWTH_CACHE.future_value_array(
+                self.amount, self.annual_expected_return, total_months
+            )
+        remaining_loan = 0
+        if self.loan:
+            remaining_loan = self.loan.calculate_future_value_array(dates)
+        return np.where(active, gain + remaining_loan, 0.0)
+
     def update(self, **kwargs):
         if "annual_expected_return" in kwargs:
             self.annual_expected_return = kwargs["annual_expected_return"] / 1200
@@ -347,7 +555,5 @@ class RealEstate(FinancialEntity):
         super().__init__(name, **kwargs)
 
     def sell(self, date):
-        loan_balance = 0
-        if self.loan:
-            loan_balance = self.loan.calculate_future_value(date)
-        return self.calculate_future_value(date) + loan_balance
+        # Equity: calculate_future_value already deducts the remaining loan
+        return self.calculate_future_value(date)
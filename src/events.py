@@ -1,7 +1,10 @@
+import heapq
+import itertools
 from datetime import date
 from typing import Callable
 
 from src.entity import EntityFactory
+from src.utils import date_key
 
 
 class FinancialEvent:
@@ -10,8 +13,113 @@ class FinancialEvent:
         self.event_date = event_date
         self.action = action
 
+    @property
+    def event_key(self):
+        return date_key(self.event_date)
+
     def execute(self, context):
         self.action(context)
 
     def create_entity(self, **kwargs):
         return EntityFactory.create_entity(entity_type="Entity", **kwargs)
+
+
+class EventQueue:
+    # Events ordered by date in a heap; events on the same date fire in the
+    # order they were scheduled.
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __getstate__(self):
+        # itertools.count is not picklable on every Python version
+        state = dict(vars(self))
+        state["_counter"] = next(self._counter)
+        return state
+
+    def __setstate__(self, state):
+        vars(self).update(state)
+        self._counter = itertools.count(state["_counter"])
+
+    def schedule(self, event: FinancialEvent):
+        heapq.heappush(self._heap, (event.event_key, next(self._counter), event))
+
+    def next_key(self):
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, date):
+        # Events dated on or before `date`
+        key = date_key(date)
+        due = []
+        while self._heap and self._heap[0][0] <= key:
+            due.append(heapq.heappop(self._heap)[2])
+        return due
+
+
+# Actions for common events. They are callables taking the running
+# Simulation as context, written as classes so that they can be pickled.
+def _find_entity(context, name):
+    if name in context.balance.entities:
+        return context.balance.entities[name]
+    return context.cashflow.entities[name]
+
+
+def _settle(context, amount):
+    # Cash paid (negative) or received by an event on its date, through the
+    # cash allocation if there is one, see CashAllocation.step
+    if context.allocation is not None:
+        context.allocation.step(context.balance, context.date, amount)
+    else:
+        context.balance.entities["Bank Account"].update(
+            start_date=context.date, amount=amount
+        )
+
+
+class BuyStock:
+    def __init__(self, name: str, amount: int):
+        self.name = name
+        self.amount = amount
+
+    def __call__(self, context):
+        _find_entity(context, self.name).buy(self.amount, context.date)
+        _settle(context, -self.amount)
+
+
+class SellStock:
+    def __init__(self, name: str, amount: int):
+        self.name = name
+        self.amount = amount
+
+    def __call__(self, context):
+        _find_entity(context, self.name).sell(self.amount, context.date)
+        _settle(context, self.amount)
+
+
+class SellRealEstate:
+    # The equity goes to the bank account (or the cash allocation) and the
+    # property, with its loan and recurring entities, leaves the plan.
+    def __init__(self, name: str):
+        self.name = name
+
+    def __call__(self, context):
+        real_estate = _find_entity(context, self.name)
+        equity = real_estate.sell(context.date)
+        _settle(context, equity)
+        for collection in (context.cashflow, context.balance):
+            if self.name in collection.entities:
+                collection.remove_entity(self.name)
+
+
+class UpdateEntity:
+    # e.g. a raise: UpdateEntity("Salary 1", amount=9_000, annual_inflation_rate=4)
+    # The new values start on the event date unless start_date is given.
+    def __init__(self, name: str, **kwargs):
+        self.name = name
+        self.kwargs = kwargs
+
+    def __call__(self, context):
+        kwargs = {"start_date": context.date, **self.kwargs}
+        _find_entity(context, self.name).update(**kwargs)
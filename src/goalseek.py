@@ -0,0 +1,609 @@
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import numpy as np
+import numpy_financial as npf
+from loguru import logger
+
+from src.entity import BankAccount, Entity, Loan, RealEstate, Stock
+from src.table import future_values
+from src.utils import (
+    date_key,
+    days_in_month_array,
+    key_to_date,
+    month_ordinal,
+    month_range_keys,
+    months_between_array,
+)
+from src.vectorized import VectorizedSimulation, entity_fingerprint, nested_entities
+
+TABLES = ("cashflow", "net_worth")
+
+# Parameters of each entity type that its values depend on, evaluated per
+# candidate by _Candidates. Dates are the start and end keys.
+CANDIDATE_FIELDS = {
+    Entity: ("amount", "annual_inflation_rate", "_start_key", "_end_key"),
+    BankAccount: ("amount", "annual_inflation_rate", "_start_key", "_end_key"),
+    Stock: ("amount", "annual_expected_return", "_start_key", "_end_key"),
+    Loan: ("amount", "monthly_rate", "periods_in_month", "_start_key", "_end_key"),
+    RealEstate: ("amount", "annual_expected_return", "_start_key", "_end_key"),
+}
+KEY_FIELDS = ("_start_key", "_end_key")
+INTEGER_FIELDS = ("periods_in_month",)
+
+
+class BatchResult(NamedTuple):
+    dates: List[str]
+    # (variants, months) arrays
+    cashflow: np.ndarray
+    bank_balance: np.ndarray
+    net_worth: np.ndarray
+
+
+def _tree_fingerprint(entity):
+    return tuple(entity_fingerprint(e) for e in nested_entities([entity]))
+
+
+class BatchEvaluator:
+    # Evaluates many variants of a plan together. `plan` is a function taking
+    # override keyword arguments and returning a fresh (CashFlow, Balance),
+    # like for ScenarioSweep. The base plan is evaluated once.
+    #
+    # Variants of one parameter are one batched computation: the plan is
+    # probed at three values to learn how the parameter moves the entities
+    # (see _ParameterMap), then the entities it moves are evaluated for all
+    # candidates at once as (candidates, months) arrays. This covers
+    # parameters setting Entity, Stock, BankAccount, Loan and RealEstate
+    # amounts, rates or loan terms as an affine function of a number (a
+    # loan rate, a cashdown, a spending multiplier) and dates moving start
+    # and end dates by whole months (an acquisition date). Every batch checks
+    # the learned map against the plan at one candidate, GoalSeek checks its
+    # answer against the plan (see GoalSeek.solve). Other variants
+    # (several parameters, a parameter that adds or removes entities, edits
+    # an EntityTable or is not affine) build the plan once per variant and
+    # only recompute the top-level entities that differ from the base. The
+    # bank account carry of all variants is one cumsum either way.
+    def __init__(self, plan, start_date, duration, **base_overrides):
+        self.plan = plan
+        self.start_date = start_date
+        self.duration = duration
+        self.base_overrides = base_overrides
+        self.keys = month_range_keys(start_date, duration)
+        self.dates = [key_to_date(key) for key in self.keys]
+        self.evaluations = 0
+
+        cashflow, balance = plan(**base_overrides)
+        self._base = {}
+        self._base_total = {}
+        for table, entities in zip(TABLES, self._tables(cashflow, balance)):
+            self._base[table] = {
+                name: (_tree_fingerprint(entity), self._values(table, entity))
+                for name, entity in entities.items()
+            }
+            total = np.zeros(len(self.keys))
+            for _, values in self._base[table].values():
+                total = total + values
+            self._base_total[table] = total
+        # Parameter -> _ParameterMap, None when it is evaluated variant by
+        # variant
+        self._maps = {}
+
+    @staticmethod
+    def _tables(cashflow, balance):
+        # The bank account net worth is the carry, computed separately
+        net_worth = {
+            name: entity
+            for name, entity in balance.entities.items()
+            if name != "Bank Account"
+        }
+        return cashflow.entities, net_worth
+
+    def _values(self, table, entity):
+        if table == "cashflow":
+            return entity.calculate_monthly_cash_flow_array(self.keys)
+        return entity.calculate_future_value_array(self.keys)
+
+    def _total(self, table, entities):
+        base = self._base[table]
+        total = self._base_total[table].copy()
+        for name in base.keys() - entities.keys():
+            total -= base[name][1]
+        for name, entity in entities.items():
+            if name in base:
+                fingerprint, values = base[name]
+                if fingerprint == _tree_fingerprint(entity):
+                    continue
+                total -= values
+            total += self._values(table, entity)
+        return total
+
+    def evaluate(self, scenarios: List[Dict[str, object]], batched=True):
+        # `batched` False builds the plan of every scenario, without the
+        # parameter maps
+        months = len(self.keys)
+        parameter_map = self._parameter_map(scenarios) if batched else None
+        if parameter_map is not None:
+            values = [overrides[parameter_map.parameter] for overrides in scenarios]
+            cashflow, assets, opening = parameter_map.evaluate(values)
+        else:
+            cashflow, assets, opening = self._evaluate_each(scenarios)
+        self.evaluations += len(scenarios)
+
+        carry = cashflow.copy()
+        if months:
+            carry[:, 0] += opening
+        bank_balance = np.cumsum(carry, axis=1)
+        return BatchResult(self.dates, cashflow, bank_balance, assets + bank_balance)
+
+    def drop_map(self, parameter):
+        # `parameter` is evaluated variant by variant from now on
+        self._maps[parameter] = None
+
+    def _evaluate_each(self, scenarios):
+        months = len(self.keys)
+        cashflow = np.zeros((len(scenarios), months))
+        assets = np.zeros((len(scenarios), months))
+        opening = np.zeros(len(scenarios))
+        for variant, overrides in enumerate(scenarios):
+            plan_cashflow, plan_balance = self.plan(
+                **{**self.base_overrides, **overrides}
+            )
+            tables = self._tables(plan_cashflow, plan_balance)
+            cashflow[variant] = self._total("cashflow", tables[0])
+            assets[variant] = self._total("net_worth", tables[1])
+            if months:
+                bank_account = plan_balance.entities["Bank Account"]
+                opening[variant] = bank_account.calculate_future_value(self.keys[0])
+        return cashflow, assets, opening
+
+    def _parameter_map(self, scenarios):
+        # Map of the one parameter all scenarios override, None when they are
+        # evaluated variant by variant
+        parameters = {tuple(overrides) for overrides in scenarios}
+        if len(parameters) != 1 or len(next(iter(parameters))) != 1:
+            return None
+        (parameter,) = next(iter(parameters))
+        values = list(dict.fromkeys(overrides[parameter] for overrides in scenarios))
+        if parameter not in self._maps:
+            # Learned from the first batch with three different values
+            if len(values) < 3:
+                return None
+            probes = [values[0], values[-1], values[len(values) // 2]]
+            try:
+                self._maps[parameter] = _ParameterMap(self, parameter, probes)
+            except ValueError as error:
+                logger.debug(f"Goal seek {parameter} is evaluated per variant: {error}")
+                self._maps[parameter] = None
+            return self._maps[parameter]
+
+        parameter_map = self._maps[parameter]
+        if parameter_map is not None and not parameter_map.check(
+            values[len(values) // 2]
+        ):
+            logger.debug(f"Goal seek {parameter} is not affine, evaluated per variant")
+            parameter_map = self._maps[parameter] = None
+        return parameter_map
+
+
+def _tree(entity, path=()):
+    # (path, entity) of an entity and of everything nested in it
+    path = path + (entity.name,)
+    yield path, entity
+    for child in getattr(entity, "entities", {}).values():
+        yield from _tree(child, path)
+
+
+class _ParameterMap:
+    # How one parameter of the plan moves its entities, learned from the
+    # plan at three `probes` values. Every parameter in CANDIDATE_FIELDS of
+    # every entity is either constant, affine in a number or, for a date,
+    # the date shifted by a constant number of months. Raises ValueError
+    # otherwise.
+    def __init__(self, evaluator, parameter, probes):
+        self.evaluator = evaluator
+        self.parameter = parameter
+        self.dates = isinstance(probes[0], str)
+        snapshots = [self._snapshot(value) for value in probes]
+        first = snapshots[0]
+        for snapshot in snapshots[1:]:
+            if snapshot.keys() != first.keys() or any(
+                [(p, t) for p, t, _ in snapshot[k]] != [(p, t) for p, t, _ in first[k]]
+                for k in first
+            ):
+                raise ValueError("the entities change with the parameter")
+
+        self.snapshot = first
+        x = [self._position(value) for value in probes]
+        # (table, name) -> {path: {field: rule}} of the entities that move
+        self.rules = {}
+        for key, rows in first.items():
+            moving = {}
+            for row, (path, entity_type, fields) in enumerate(rows):
+                values = [snapshot[key][row][2] for snapshot in snapshots]
+                if values[0] == values[1] == values[2]:
+                    continue
+                if entity_type not in CANDIDATE_FIELDS:
+                    raise ValueError(f"{path[-1]} can not be evaluated per candidate")
+                names = CANDIDATE_FIELDS[entity_type]
+                for field, probed in zip(names, zip(*values)):
+                    rule = self._rule(field, probed, x, probes)
+                    if rule is not None:
+                        moving.setdefault(path, {})[field] = rule
+            if moving:
+                self.rules[key] = moving
+
+        # Entities the parameter does not move are evaluated once
+        plan_cashflow, plan_balance = self._plan(probes[0])
+        tables = evaluator._tables(plan_cashflow, plan_balance)
+        self.templates = {}
+        self.fixed = {}
+        for table, entities in zip(TABLES, tables):
+            fixed = {}
+            for name, entity in entities.items():
+                if (table, name) in self.rules:
+                    self.templates[table, name] = entity
+                else:
+                    fixed[name] = entity
+            self.fixed[table] = evaluator._total(table, fixed)
+        self.bank_account = plan_balance.entities["Bank Account"]
+
+    def _plan(self, value):
+        overrides = {**self.evaluator.base_overrides, self.parameter: value}
+        return self.evaluator.plan(**overrides)
+
+    def _snapshot(self, value):
+        # (table, name) -> [(path, type, fields)] of every top-level entity
+        plan_cashflow, plan_balance = self._plan(value)
+        tables = self.evaluator._tables(plan_cashflow, plan_balance)
+        tables += ({"Bank Account": plan_balance.entities["Bank Account"]},)
+        snapshot = {}
+        for table, entities in zip(TABLES + ("bank",), tables):
+            for name, entity in entities.items():
+                rows = []
+                for path, nested in _tree(entity):
+                    names = CANDIDATE_FIELDS.get(type(nested))
+                    if names is None:
+                        fields = _tree_fingerprint(nested)
+                    else:
+                        fields = tuple(getattr(nested, field) for field in names)
+                    rows.append((path, type(nested), fields))
+                snapshot[table, name] = rows
+        return snapshot
+
+    def _position(self, value):
+        if self.dates:
+            return month_ordinal(value)
+        return float(value)
+
+    def _rule(self, field, probed, x, probes):
+        # None for a constant field, ("affine", value, slope, x) or ("months",
+        # offset, day), day None when the day follows the parameter's
+        if probed[0] == probed[1] == probed[2]:
+            return None
+        if field in KEY_FIELDS:
+            if not self.dates:
+                raise ValueError(f"{field} moves with a number")
+            month, day = np.divmod(np.array(probed), 32)
+            offset = month - np.array(x)
+            if not (offset == offset[0]).all():
+                raise ValueError(f"{field} does not move by whole months")
+            if (day == day[0]).all():
+                return ("months", int(offset[0]), int(day[0]))
+            if all(d == date_key(p) % 32 for d, p in zip(day, probes)):
+                return ("months", int(offset[0]), None)
+            raise ValueError(f"the day of {field} moves")
+        if self.dates:
+            raise ValueError(f"{field} moves with a date")
+        slope = (probed[1] - probed[0]) / (x[1] - x[0])
+        predicted = probed[0] + slope * (x[2] - x[0])
+        if not np.isclose(predicted, probed[2], rtol=1e-9, atol=1e-9):
+            raise ValueError(f"{field} is not affine in the parameter")
+        return ("affine", probed[0], slope, x[0])
+
+    def _fields(self, rules, values):
+        # Rules -> {field: (candidates,) array} for the parameter `values`
+        x = np.array([self._position(value) for value in values])
+        fields = {}
+        for field, rule in rules.items():
+            if rule[0] == "months":
+                _, offset, day = rule
+                month = x.astype(np.int64) + offset
+                if day is None:
+                    day = np.array([date_key(value) % 32 for value in values])
+                day = np.minimum(day, days_in_month_array(month))
+                fields[field] = month * 32 + day
+            else:
+                _, start, slope, origin = rule
+                value = start + slope * (x - origin)
+                if field in INTEGER_FIELDS:
+                    value = np.rint(value).astype(np.int64)
+                fields[field] = value
+        return fields
+
+    def check(self, value):
+        # The plan at `value` has the entities of the probes with the values
+        # the rules predict
+        snapshot = self._snapshot(value)
+        if snapshot.keys() != self.snapshot.keys():
+            return False
+        for key, rows in self.snapshot.items():
+            if len(snapshot[key]) != len(rows):
+                return False
+            moving = self.rules.get(key, {})
+            for (path, entity_type, fields), actual in zip(rows, snapshot[key]):
+                if actual[:2] != (path, entity_type):
+                    return False
+                if path not in moving:
+                    if actual[2] != fields:
+                        return False
+                    continue
+                predicted = self._fields(moving[path], [value])
+                names = CANDIDATE_FIELDS[entity_type]
+                for field, expected, found in zip(names, fields, actual[2]):
+                    if field in predicted:
+                        expected = predicted[field][0]
+                    if not np.isclose(expected, found, rtol=1e-9, atol=1e-9):
+                        return False
+        return True
+
+    def evaluate(self, values):
+        # (cashflow, assets, bank account opening) of the candidates
+        count = len(values)
+        keys = self.evaluator.keys
+        totals = {table: np.tile(self.fixed[table], (count, 1)) for table in TABLES}
+        for (table, name), moving in self.rules.items():
+            fields = {
+                path: self._fields(rules, values) for path, rules in moving.items()
+            }
+            candidates = _Candidates(keys, count, fields)
+            if table == "cashflow":
+                entity = self.templates[table, name]
+                totals[table] += candidates.cash_flow(entity, (name,))
+            elif table == "net_worth":
+                entity = self.templates[table, name]
+                totals[table] += candidates.future_value(entity, (name,))
+
+        opening = np.zeros(count)
+        if len(keys):
+            bank = self.rules.get(("bank", "Bank Account"))
+            if bank is None:
+                opening[:] = self.bank_account.calculate_future_value(keys[0])
+            else:
+                fields = {
+                    path: self._fields(rules, values) for path, rules in bank.items()
+                }
+                candidates = _Candidates(keys[:1], count, fields)
+                path = ("Bank Account",)
+                opening = candidates.future_value(self.bank_account, path)[:, 0]
+        return totals["cashflow"], totals["net_worth"], opening
+
+
+class _Candidates:
+    # Evaluates entities whose parameters differ per candidate, `fields` are
+    # {path: {field: (candidates,) array}}, other parameters are the
+    # entity's own. Values are (candidates, months) arrays with the same
+    # formulas as the entity methods.
+    def __init__(self, keys, count, fields):
+        self.keys = np.asarray(keys, dtype=np.int64)
+        self.count = count
+        self.fields = fields
+
+    def _field(self, entity, path, field):
+        value = self.fields.get(path, {}).get(field)
+        if value is None:
+            value = np.full(self.count, getattr(entity, field))
+        return value
+
+    def _growth(self, entity, path, rate):
+        # amount * (1 + monthly rate) ** months where active
+        return future_values(
+            self._field(entity, path, "amount").astype(np.float64),
+            rate,
+            self._field(entity, path, "_start_key"),
+            self._field(entity, path, "_end_key"),
+            self.keys,
+        )
+
+    def _active(self, entity, path):
+        start = self._field(entity, path, "_start_key")[:, None]
+        end = self._field(entity, path, "_end_key")[:, None]
+        return (start <= self.keys) & (self.keys <= end)
+
+    def cash_flow(self, entity, path):
+        if isinstance(entity, RealEstate):
+            cash_flow = np.zeros((self.count, len(self.keys)))
+            for child in entity.entities.values():
+                cash_flow = cash_flow + self.cash_flow(child, path + (child.name,))
+            return cash_flow
+        if isinstance(entity, Loan):
+            payment = self._payment(entity, path)
+            return np.where(self._active(entity, path), -payment[:, None], 0.0)
+        if type(entity) is Entity:
+            return self.future_value(entity, path)
+        return np.zeros((self.count, len(self.keys)))
+
+    def future_value(self, entity, path):
+        if isinstance(entity, RealEstate):
+            return self._real_estate(entity, path)
+        if isinstance(entity, Loan):
+            return self._loan(entity, path)
+        if isinstance(entity, Stock):
+            rate = self._field(entity, path, "annual_expected_return")
+        else:
+            rate = self._field(entity, path, "annual_inflation_rate") / 1200
+        return self._growth(entity, path, rate.astype(np.float64))
+
+    def _payment(self, entity, path):
+        return npf.pmt(
+            self._field(entity, path, "monthly_rate"),
+            self._field(entity, path, "periods_in_month"),
+            -self._field(entity, path, "amount"),
+        )
+
+    def _loan(self, entity, path):
+        rate = self._field(entity, path, "monthly_rate")[:, None]
+        amount = self._field(entity, path, "amount")[:, None]
+        start = self._field(entity, path, "_start_key")[:, None]
+        payment = self._payment(entity, path)[:, None]
+        total_months = months_between_array(self.keys, start)
+        balance = npf.fv(rate, total_months, payment, -amount)
+        balance = np.where(balance < 0, 0.0, balance)
+        return np.where(self._active(entity, path), -balance, 0.0)
+
+    def _real_estate(self, entity, path):
+        rate = self._field(entity, path, "annual_expected_return").astype(np.float64)
+        gain = np.where(rate[:, None] != 0, self._growth(entity, path, rate), 0.0)
+        remaining_loan = 0
+        if entity.loan:
+            remaining_loan = self.future_value(entity.loan, path + (entity.loan.name,))
+        return np.where(self._active(entity, path), gain + remaining_loan, 0.0)
+
+
+# Objectives map a BatchResult to one value per variant. The goal is met
+# when the objective is at least the target.
+def min_bank_balance(result: BatchResult):
+    return result.bank_balance.min(axis=1, initial=np.inf)
+
+
+def net_worth_on(date):
+    def objective(result: BatchResult):
+        month = result.dates.index(key_to_date(date_key(date)))
+        return result.net_worth[:, month]
+
+    return objective
+
+
+def final_net_worth(result: BatchResult):
+    return result.net_worth[:, -1]
+
+
+class GoalSeekResult(NamedTuple):
+    parameter: str
+    value: object
+    objective: float
+    simulation: VectorizedSimulation
+    iterations: int
+    evaluations: int
+
+
+class GoalSeek:
+    # Finds the boundary value of one plan parameter where the objective
+    # crosses the target, e.g. the largest loan rate or the smallest cashdown
+    # keeping the bank account non-negative. Every iteration evaluates
+    # `batch_size` candidates spread over the current bracket in one batch
+    # and keeps the sub-interval where the objective crosses the target, so
+    # the bracket shrinks by batch_size + 1 per iteration. Dates (ISO
+    # strings) are searched the same way on a monthly grid. The objective is
+    # expected to cross the target once between low and high.
+    #
+    # Candidates may be evaluated with a map learned from three probes of the
+    # plan (see BatchEvaluator). Such an answer is checked against the plan
+    # built at both ends of the final bracket, and searched again variant by
+    # variant if they do not match, e.g. for a plan that is not affine in
+    # the parameter between the probes.
+    def __init__(
+        self,
+        plan: Callable[..., tuple],
+        start_date,
+        duration,
+        batch_size: int = 32,
+        **base_overrides,
+    ):
+        self.evaluator = BatchEvaluator(plan, start_date, duration, **base_overrides)
+        self.batch_size = batch_size
+
+    def solve(
+        self,
+        parameter: str,
+        low,
+        high,
+        objective=min_bank_balance,
+        target: float = 0.0,
+        tolerance: Optional[float] = None,
+        max_iterations: int = 50,
+    ):
+        dates = isinstance(low, str)
+        if dates:
+            # Candidates are indexes into a month grid
+            months = month_ordinal(high) - month_ordinal(low)
+            grid = month_range_keys(low, months + 1)
+            low, high = 0, len(grid) - 1
+            tolerance = 1
+        elif tolerance is None:
+            tolerance = (high - low) * 1e-9
+
+        def values_of(points):
+            if dates:
+                return [key_to_date(grid[int(point)]) for point in points]
+            return [float(point) for point in points]
+
+        def feasible(points, batched=True):
+            scenarios = [{parameter: value} for value in values_of(points)]
+            scores = objective(self.evaluator.evaluate(scenarios, batched))
+            return scores >= target, scores
+
+        (low_ok, high_ok), scores = feasible([low, high])
+        if low_ok == high_ok:
+            raise ValueError(
+                f"Objective does not cross {target} between {values_of([low])[0]} "
+                f"and {values_of([high])[0]} ({scores[0]:,.2f}, {scores[1]:,.2f})."
+            )
+        # Keep the bracket as (feasible end, infeasible end)
+        bracket = (low, high) if low_ok else (high, low)
+        bracket_score = scores[0] if low_ok else scores[1]
+
+        def search(good, bad, good_score):
+            iterations = 0
+            while abs(bad - good) > tolerance and iterations < max_iterations:
+                iterations += 1
+                points = np.linspace(good, bad, self.batch_size + 2)[1:-1]
+                if dates:
+                    points = np.unique(np.round(points).astype(int))
+                    points = points[(points != good) & (points != bad)]
+                    if good > bad:
+                        points = points[::-1]
+                ok, point_scores = feasible(points)
+                # Candidates are ordered from the feasible end to the other one
+                crossed = np.flatnonzero(~ok)
+                last = crossed[0] - 1 if crossed.size else len(points) - 1
+                if crossed.size:
+                    bad = points[crossed[0]]
+                if last >= 0:
+                    good, good_score = points[last], point_scores[last]
+            return good, bad, good_score, iterations
+
+        good, bad, good_score, iterations = search(*bracket, bracket_score)
+        # A map may have narrowed the bracket before a check found it wrong
+        (good_ok, bad_ok), scores = feasible([good, bad], batched=False)
+        matches = np.isclose(scores[0], good_score, rtol=1e-9, atol=1e-6)
+        if not good_ok or bad_ok or not matches:
+            logger.warning(
+                f"Goal seek {parameter}: the batched candidates do not match "
+                "the plan, searching again variant by variant"
+            )
+            self.evaluator.drop_map(parameter)
+            good, bad, good_score, more = search(*bracket, bracket_score)
+            iterations += more
+
+        value = values_of([good])[0]
+        overrides = {**self.evaluator.base_overrides, parameter: value}
+        simulation = VectorizedSimulation(
+            self.evaluator.start_date,
+            self.evaluator.duration,
+            *self.evaluator.plan(**overrides),
+        )
+        try:
+            simulation.run()
+        except ValueError as error:
+            # The objective allowed a negative bank account
+            logger.warning(f"Simulation at {parameter}={value}: {error}")
+        logger.info(
+            f"Goal seek {parameter}: {value} after {iterations} iterations and {self.evaluator.evaluations} evaluations"
+        )
+        return GoalSeekResult(
+            parameter,
+            value,
+            float(good_score),
+            simulation,
+            iterations,
+            self.evaluator.evaluations,
+        )
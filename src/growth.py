@@ -0,0 +1,74 @@
+from collections import OrderedDict
+
+import numpy as np
+
+# Months covered by a new table, tables grow when a longer horizon is asked
+DEFAULT_MONTHS = 1_200
+
+
+class GrowthCache:
+    # Tables of (1 + r) ** n for n = 0, 1, 2, ... keyed by monthly rate r and
+    # shared by every entity growing at that rate. The least recently used
+    # table is evicted past `max_rates` rates, e.g. in stochastic runs where
+    # rates vary per path.
+    def __init__(self, max_rates=1_024, months=DEFAULT_MONTHS):
+        self.max_rates = max_rates
+        self.months = months
+        self._tables = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def table(self, monthly_rate, months=0):
+        # Growth factors for at least `months` + 1 periods
+        table = self._tables.get(monthly_rate)
+        if table is not None and len(table) > months:
+            self.hits += 1
+            self._tables.move_to_end(monthly_rate)
+            return table
+
+        self.misses += 1
+        size = max(self.months, months + 1)
+        if table is not None:
+            size = max(size, 2 * len(table))
+        # Same expression as numpy_financial.fv, so values are identical
+        table = (1 + np.float64(monthly_rate)) ** np.arange(size, dtype=np.float64)
+        self._tables[monthly_rate] = table
+        self._tables.move_to_end(monthly_rate)
+        while len(self._tables) > self.max_rates:
+            self._tables.popitem(last=False)
+            self.evictions += 1
+        return table
+
+    def future_value(self, amount, monthly_rate, months):
+        # npf.fv(monthly_rate, months, 0, -amount) for months >= 0
+        return amount * self.table(monthly_rate, months)[months]
+
+    def future_value_array(self, amount, monthly_rate, months):
+        # Same for an array of months, negative months (before the start
+        # date) give amount
+        months = np.maximum(months, 0)
+        size = int(months.max()) if len(months) else 0
+        return amount * self.table(monthly_rate, size)[months]
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            "rates": len(self._tables),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hit_rate,
+        }
+
+    def clear(self):
+        self._tables.clear()
+        self.hits = self.misses = self.evictions = 0
+
+
+# Shared by all entities
+GROWTH_CACHE = GrowthCache()
@@ -0,0 +1,111 @@
+import heapq
+import itertools
+
+from src.utils import date_key
+
+
+def entity_interval(entity):
+    # [start, end] keys over which an entity can contribute. A RealEstate's
+    # cash flow comes from its children, so its interval covers theirs.
+    start, end = entity._start_key, entity._end_key
+    for child in getattr(entity, "entities", {}).values():
+        child_start, child_end = entity_interval(child)
+        start, end = min(start, child_start), max(end, child_end)
+    return start, end
+
+
+class ActiveEntities:
+    # Interval index over an entity dict for a clock moving forward month by
+    # month. Entities wait in a heap of start dates until the clock reaches
+    # them, then sit in the active set until a heap of end dates retires them,
+    # so each month only visits live entities. Entities that follow the clock
+    # (the bank account) are always active. `entities` stays the complete
+    # dict and the active entities are returned in its order.
+    def __init__(self, entities):
+        self.entities = entities
+        self._counter = itertools.count()
+        self.rebuild()
+
+    def __getstate__(self):
+        # Checkpoints keep the counter as its next value
+        state = dict(vars(self))
+        state["_counter"] = next(self._counter)
+        return state
+
+    def __setstate__(self, state):
+        vars(self).update(state)
+        self._counter = itertools.count(state["_counter"])
+
+    def rebuild(self):
+        self._position = {}
+        self._active = {}
+        self._pending = []
+        self._expiry = []
+        for entity in self.entities.values():
+            self._insert(entity)
+        self._clock = None
+        self._ordered = None
+        self._stale = False
+        self._size = len(self.entities)
+
+    def _insert(self, entity):
+        self._position[entity.name] = next(self._counter)
+        if entity.follows_clock:
+            self._active[entity.name] = entity
+            return
+        start, _ = entity_interval(entity)
+        heapq.heappush(self._pending, (start, next(self._counter), entity.name))
+
+    def add(self, entity):
+        if self._clock is not None and entity_interval(entity)[0] <= self._clock:
+            # Already started, index it from scratch on the next month
+            self._stale = True
+        else:
+            self._insert(entity)
+        self._size = len(self.entities)
+
+    def remove(self, name):
+        if self._active.pop(name, None) is not None:
+            self._ordered = None
+        self._size = len(self.entities)
+
+    def on(self, date):
+        key = date_key(date)
+        moved_back = self._clock is not None and key < self._clock
+        if moved_back or self._stale or self._size != len(self.entities):
+            # Clock moved back or the dict was edited directly
+            self.rebuild()
+        self._clock = key
+
+        while self._pending and self._pending[0][0] <= key:
+            _, _, name = heapq.heappop(self._pending)
+            entity = self.entities.get(name)
+            if entity is None:
+                continue
+            start, end = entity_interval(entity)
+            if start > key:
+                # Start date was moved by update()
+                heapq.heappush(self._pending, (start, next(self._counter), name))
+            elif end >= key:
+                self._active[name] = entity
+                heapq.heappush(self._expiry, (end, next(self._counter), name))
+                self._ordered = None
+
+        while self._expiry and self._expiry[0][0] < key:
+            _, _, name = heapq.heappop(self._expiry)
+            entity = self._active.get(name)
+            if entity is None:
+                continue
+            _, end = entity_interval(entity)
+            if end < key:
+                del self._active[name]
+                self._ordered = None
+            else:
+                # End date was moved by update()
+                heapq.heappush(self._expiry, (end, next(self._counter), name))
+
+        if self._ordered is None:
+            self._ordered = sorted(
+                self._active.values(), key=lambda e: self._position[e.name]
+            )
+        return self._ordered
@@ -0,0 +1,343 @@
+from typing import Dict, Optional
+
+import numpy as np
+import numpy_financial as npf
+import pandas as pd
+from loguru import logger
+
+from src.balance import Balance
+from src.cashflow import CashFlow
+from src.entity import BankAccount, Entity, Loan, RealEstate, Stock
+from src.growth import GROWTH_CACHE
+from src.table import EntityTable
+from src.utils import key_to_date, month_range_keys, relativedelta_in_months_array
+
+# Parameter that can be made stochastic for each entity type
+STOCHASTIC_PARAMETERS = {
+    Entity: "annual_inflation_rate",
+    BankAccount: "annual_inflation_rate",
+    Stock: "annual_expected_return",
+    RealEstate: "annual_expected_return",
+    Loan: "annual_interest_rate",
+}
+
+
+# Distributions return annual rates in percent, like the entity parameters.
+# With per_month=False a single rate is drawn per path and kept for the whole
+# horizon, otherwise a new rate is drawn every month.
+class Constant:
+    def __init__(self, value):
+        self.value = value
+
+    def sample(self, rng, paths, months):
+        return np.full((paths, months), float(self.value))
+
+
+class Normal:
+    def __init__(self, mean, std, per_month=False):
+        self.mean = mean
+        self.std = std
+        self.per_month = per_month
+
+    def sample(self, rng, paths, months):
+        if self.per_month:
+            return rng.normal(self.mean, self.std, size=(paths, months))
+        draws = rng.normal(self.mean, self.std, size=(paths, 1))
+        return np.broadcast_to(draws, (paths, months))
+
+
+class Uniform:
+    def __init__(self, low, high, per_month=False):
+        self.low = low
+        self.high = high
+        self.per_month = per_month
+
+    def sample(self, rng, paths, months):
+        if self.per_month:
+            return rng.uniform(self.low, self.high, size=(paths, months))
+        draws = rng.uniform(self.low, self.high, size=(paths, 1))
+        return np.broadcast_to(draws, (paths, months))
+
+
+class MonteCarloResult:
+    def __init__(self, dates, net_worth, bank_balance):
+        self.dates = dates
+        # (paths, months) arrays
+        self.net_worth = net_worth
+        self.bank_balance = bank_balance
+
+    @property
+    def paths(self):
+        return self.net_worth.shape[0]
+
+    def percentiles(self, q=(5, 50, 95)):
+        bands = np.percentile(self.net_worth, q, axis=0)
+        columns = [f"P{value:g}" for value in q]
+        df = pd.DataFrame(
+            bands.T, index=pd.Index(self.dates, name="Date"), columns=columns
+        )
+        return df
+
+    def to_dataframe(self, start=0, stop=None):
+        # Long format: one row per (path, month)
+        net_worth = self.net_worth[start:stop]
+        bank_balance = self.bank_balance[start:stop]
+        paths, months = net_worth.shape
+        return pd.DataFrame(
+            {
+                "path": np.repeat(np.arange(start, start + paths), months),
+                "Date": np.tile(np.array(self.dates, dtype=object), paths),
+                "net_worth": net_worth.ravel(),
+                "bank_balance": bank_balance.ravel(),
+            }
+        )
+
+    def save(self, writer, batch_size=1_000, table="monte_carlo"):
+        # One `batch=<k>` partition per `batch_size` paths
+        paths = []
+        for batch, start in enumerate(range(0, self.paths, batch_size)):
+            df = self.to_dataframe(start, start + batch_size)
+            paths.append(writer.write_table(table, df, partition={"batch": batch}))
+        return paths
+
+    @property
+    def probability_of_negative_bank(self):
+        return float((self.bank_balance < 0).any(axis=1).mean())
+
+    def probability_of_negative_bank_by_month(self):
+        # Share of paths that went negative on or before each month
+        went_negative = np.maximum.accumulate(self.bank_balance < 0, axis=1)
+        return pd.Series(
+            went_negative.mean(axis=0), index=pd.Index(self.dates, name="Date")
+        )
+
+
+class MonteCarloSimulation:
+    # `distributions` maps an entity name to {parameter: distribution}, e.g.
+    # {"Salary 1": {"annual_inflation_rate": Normal(4, 1)}}. Passing the same
+    # distribution object to several entities makes them share one rate path.
+    # Rates before `start_date` are the plan's deterministic rates.
+    def __init__(
+        self,
+        start_date,
+        duration,
+        cashflow: CashFlow,
+        balance: Balance,
+        distributions: Dict[str, Dict[str, object]],
+        paths: int = 10_000,
+        seed: Optional[int] = None,
+        batch_size: int = 2_000,
+    ):
+        self.start_date = start_date
+        self.duration = duration
+        self.cashflow = cashflow
+        self.balance = balance
+        self.paths = paths
+        self.seed = seed
+        self.batch_size = batch_size
+        self.distributions = self._validate_distributions(distributions)
+
+    def _all_entities(self):
+        entities = {}
+        stack = list(self.cashflow.entities.values()) + list(
+            self.balance.entities.values()
+        )
+        while stack:
+            entity = stack.pop()
+            entities[entity.name] = entity
+            if isinstance(entity, RealEstate):
+                stack.extend(entity.entities.values())
+        return entities
+
+    def _validate_distributions(self, distributions):
+        entities = self._all_entities()
+        validated = {}
+        for name, parameters in distributions.items():
+            if name not in entities:
+                raise ValueError(f"Entity {name} is not part of the simulation.")
+            entity = entities[name]
+            if isinstance(entity, EntityTable):
+                raise ValueError(
+                    f"{name} is an EntityTable, table rows can not be made "
+                    "stochastic. Keep the stochastic items as entities."
+                )
+            if entity is self.balance.entities.get("Bank Account"):
+                raise ValueError(
+                    "The Bank Account carries the cash flow without earning its "
+                    "rate during the simulation, its rate can not be stochastic."
+                )
+            for parameter, distribution in parameters.items():
+                if parameter != STOCHASTIC_PARAMETERS[type(entity)]:
+                    raise ValueError(
+                        f"Parameter {parameter} of {name} can not be stochastic."
+                    )
+                validated[id(entity)] = distribution
+        return validated
+
+    def run(self):
+        grid = month_range_keys(self.start_date, self.duration)
+        dates = [key_to_date(key) for key in grid]
+
+        # One RNG stream per distinct distribution, in order of appearance
+        unique = {}
+        for distribution in self.distributions.values():
+            unique.setdefault(id(distribution), distribution)
+        seeds = np.random.SeedSequence(self.seed).spawn(len(unique))
+        rngs = {key: np.random.default_rng(s) for key, s in zip(unique, seeds)}
+
+        net_worth = np.empty((self.paths, self.duration))
+        bank_balance = np.empty((self.paths, self.duration))
+        for start in range(0, self.paths, self.batch_size):
+            stop = min(start + self.batch_size, self.paths)
+            rates = {
+                key: distribution.sample(rngs[key], stop - start, self.duration) / 1200
+                for key, distribution in unique.items()
+            }
+            batch = _Batch(grid, stop - start, rates, self.distributions)
+            net_worth[start:stop], bank_balance[start:stop] = self._run_batch(
+                batch, dates
+            )
+
+        result = MonteCarloResult(dates, net_worth, bank_balance)
+        logger.info(
+            f"Monte Carlo: {self.paths} paths, probability of negative bank account: {result.probability_of_negative_bank:.1%}"
+        )
+        return result
+
+    def _run_batch(self, batch, dates):
+        cashflow = np.zeros((batch.paths, self.duration))
+        for entity in self.cashflow.entities.values():
+            cashflow = cashflow + batch.cash_flow(entity)
+
+        bank_account = self.balance.entities["Bank Account"]
+        if self.duration:
+            cashflow[:, 0] += bank_account.calculate_future_value(dates[0])
+        bank_balance = np.cumsum(cashflow, axis=1)
+
+        net_worth = np.zeros((batch.paths, self.duration))
+        for entity in self.balance.entities.values():
+            if entity is bank_account:
+                net_worth = net_worth + bank_balance
+            else:
+                net_worth = net_worth + batch.future_value(entity)
+        return net_worth, bank_balance
+
+
+class _Batch:
+    # Evaluates entities for a batch of paths. Deterministic entities return
+    # (months,) arrays that broadcast against the (paths, months) ones.
+    def __init__(self, dates, paths, rates, distributions):
+        self.dates = dates
+        self.paths = paths
+        self.rates = rates
+        self.distributions = distributions
+        self._loans = {}
+
+    def _monthly_rates(self, entity):
+        distribution = self.distributions.get(id(entity))
+        if distribution is None:
+            return None
+        return self.rates[id(distribution)]
+
+    def _growth_factor(self, monthly_rates, base_monthly_rate, total_months):
+        # prod(1 + r_k) over the last `total_months` months of the grid;
+        # months before the grid start grow at the deterministic rate.
+        log_growth = np.log1p(monthly_rates)
+        cumulative = np.zeros(log_growth.shape)
+        cumulative[:, 1:] = np.cumsum(log_growth[:, 1:], axis=1)
+        months = np.arange(len(self.dates))
+        origin = months - total_months
+        before = np.minimum(origin, 0) * np.log1p(base_monthly_rate)
+        at_origin = cumulative[:, np.clip(origin, 0, len(months) - 1)]
+        at_origin = np.where(origin >= 0, at_origin, before)
+        return np.exp(cumulative - at_origin)
+
+    def cash_flow(self, entity):
+        if isinstance(entity, RealEstate):
+            cash_flow = 0
+            for child in entity.entities.values():
+                cash_flow = cash_flow + self.cash_flow(child)
+            return cash_flow
+        if isinstance(entity, Loan) and self._monthly_rates(entity) is not None:
+            return self._loan(entity)[0]
+        if isinstance(entity, Entity):
+            return self.future_value(entity)
+        return entity.calculate_monthly_cash_flow_array(self.dates)
+
+    def future_value(self, entity):
+        monthly_rates = self._monthly_rates(entity)
+        if isinstance(entity, RealEstate):
+            return self._real_estate(entity, monthly_rates)
+        if monthly_rates is None:
+            return entity.calculate_future_value_array(self.dates)
+        if isinstance(entity, Loan):
+            return self._loan(entity)[1]
+
+        if isinstance(entity, Stock):
+            base_monthly_rate = entity.annual_expected_return
+        else:
+            base_monthly_rate = entity.monthly_inflation_rate
+        active = entity.is_active_on_array(self.dates)
+        total_months = relativedelta_in_months_array(self.dates, entity._start_key)
+        growth = self._growth_factor(monthly_rates, base_monthly_rate, total_months)
+        return np.where(active, entity.amount * growth, 0.0)
+
+    def _real_estate(self, entity, monthly_rates):
+        active = entity.is_active_on_array(self.dates)
+        if monthly_rates is None:
+            gain = 0
+            if entity.annual_expected_return != 0:
+                total_months = relativedelta_in_months_array(
+                    self.dates, entity._start_key
+                )
+                gain = GROWTH_CACHE.future_value_array(
+                    entity.amount, entity.annual_expected_return, total_months
+                )
+        else:
+            total_months = relativedelta_in_months_array(self.dates, entity._start_key)
+            gain = entity.amount * self._growth_factor(
+                monthly_rates, entity.annual_expected_return, total_months
+            )
+        remaining_loan = 0
+        if entity.loan:
+            remaining_loan = self.future_value(entity.loan)
+        return np.where(active, gain + remaining_loan, 0.0)
+
+    def _loan(self, loan):
+        # Variable-rate amortization: the payment is recomputed on the
+        # remaining balance and term whenever the rate changes. Payments
+        # before the grid start are at the plan rate, the payment of the
+        # first active month at the path rate.
+        if id(loan) in self._loans:
+            return self._loans[id(loan)]
+        monthly_rates = self._monthly_rates(loan)
+        active = loan.is_active_on_array(self.dates)
+        total_months = relativedelta_in_months_array(self.dates, loan._start_key)
+
+        cash_flow = np.zeros((self.paths, len(self.dates)))
+        future_value = np.zeros((self.paths, len(self.dates)))
+        balance = payment = None
+        payments_made = 0
+        for month in np.flatnonzero(active):
+            rate = monthly_rates[:, month]
+            if balance is None:
+                payments_made = max(total_months[month] - 1, 0)
+                balance = np.full(
+                    self.paths, max(loan._balance_after(payments_made), 0.0)
+                )
+                remaining_periods = loan.periods_in_month - payments_made
+                if remaining_periods > 0:
+                    payment = npf.pmt(rate, remaining_periods, -balance)
+                else:
+                    payment = np.full(self.paths, loan.calculate_monthly_payment)
+            while payments_made < total_months[month]:
+                remaining_periods = loan.periods_in_month - payments_made
+                if remaining_periods > 0:
+                    payment = npf.pmt(rate, remaining_periods, -balance)
+                    balance = np.maximum(balance * (1 + rate) - payment, 0)
+                payments_made += 1
+            cash_flow[:, month] = -payment
+            future_value[:, month] = -balance
+
+        self._loans[id(loan)] = cash_flow, future_value
+        return self._loans[id(loan)]
@@ -0,0 +1,567 @@
+import datetime as dt
+import json
+import os
+from collections.abc import Hashable
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+from src.allocation import CashAllocation
+from src.entity import EntityFactory
+from src.sweep import plan_from_entities
+from src.table import EntityTable
+from src.vectorized import VectorizedSimulation
+
+# Plan file layout (JSON or YAML):
+#
+#   simulation:
+#     start_date: "2023-10-01"
+#     duration: 120
+#     allocation:              # optional, cash accounts (see CashAllocation)
+#       surplus: [{account: Bank Account, cap: 10000}, Savings]
+#       deficit: [Bank Account, Savings]
+#   entities:                  # budget, cash flow only (ENTITIES)
+#     - {type: Entity, name: Salary 1, amount: 8000, annual_inflation_rate: 4}
+#   assets_liabilities:        # cash flow and net worth (ASSETS_LIAIBILITIES)
+#     - {type: BankAccount, name: Bank Account, amount: 650000}
+#     - type: RealEstate
+#       name: Triplex
+#       ...
+#       loan: {name: Triplex Loan, amount: 800000, ...}
+#       acquisition_entities: [{name: Cashdown_Triple, amount: -200000}]
+#
+# The Parquet form is the same plan flattened to one row per entity, with
+# `section` and `parent` columns and the simulation settings in the file
+# metadata.
+SECTIONS = ("entities", "assets_liabilities")
+
+# Arguments of each EntityFactory type: (required, optional)
+FIELDS = {
+    "Entity": (
+        ("name", "amount"),
+        ("annual_inflation_rate", "start_date", "end_date"),
+    ),
+    "BankAccount": (
+        ("name", "amount"),
+        ("annual_inflation_rate", "start_date", "end_date"),
+    ),
+    "Stock": (
+        ("name", "amount", "annual_expected_return"),
+        ("annual_inflation_rate", "start_date", "end_date"),
+    ),
+    "Loan": (
+        ("name", "amount", "annual_interest_rate", "term_in_year"),
+        ("annual_inflation_rate", "start_date", "end_date"),
+    ),
+    "RealEstate": (
+        ("name", "amount", "cashdown", "annual_expected_return"),
+        ("annual_inflation_rate", "start_date", "end_date"),
+    ),
+}
+NUMERIC_FIELDS = (
+    "amount",
+    "annual_inflation_rate",
+    "annual_expected_return",
+    "annual_interest_rate",
+    "term_in_year",
+    "cashdown",
+)
+DATE_FIELDS = ("start_date", "end_date")
+COLUMNS = ("section", "parent", "type", "name") + tuple(
+    sorted(
+        {field for fields in FIELDS.values() for group in fields for field in group}
+        - {"name"}
+    )
+)
+
+# Entity and Stock rows loaded into an EntityTable with as_table=True
+TABLE_NAMES = {"entities": "Entities", "assets_liabilities": "Assets"}
+
+
+class Plan(NamedTuple):
+    start_date: str
+    duration: int
+    entities: list
+    assets_liabilities: list
+    allocation: Optional[dict] = None
+
+    def cashflow_balance(self):
+        return plan_from_entities(self.entities, self.assets_liabilities)
+
+    def simulation(self, engine=VectorizedSimulation, duration=None):
+        cashflow, balance = self.cashflow_balance()
+        simulation = engine(
+            self.start_date, duration or self.duration, cashflow, balance
+        )
+        if self.allocation:
+            simulation.set_allocation(CashAllocation.from_dict(self.allocation))
+        return simulation
+
+
+def flatten(data):
+    # Plan dict -> columns (name -> object array) with one row per entity
+    check_layout(data)
+    return _to_columns(_rows(data))
+
+
+def flatten_plans(plans):
+    # Several plan dicts -> (columns, plan number of each row), the rows of a
+    # plan are contiguous
+    rows, numbers = [], []
+    for number, data in enumerate(plans):
+        check_layout(data)
+        plan_rows = _rows(data)
+        rows += plan_rows
+        numbers += [number] * len(plan_rows)
+    return _to_columns(rows), np.array(numbers, dtype=np.int64)
+
+
+def layout_errors(data):
+    # Problems with the shape of a plan dict, which keep it from being
+    # flattened into rows: the plan and the simulation settings are objects,
+    # sections and acquisition_entities lists of objects, a loan an object
+    if not isinstance(data, dict):
+        return ["the plan is not an object"]
+    errors = []
+    if not isinstance(data.get("simulation") or {}, dict):
+        errors.append("simulation is not an object")
+    for section in SECTIONS:
+        entities = data.get(section) or []
+        if not isinstance(entities, list):
+            errors.append(f"{section} is not a list")
+            continue
+        for number, entity in enumerate(entities):
+            label = f"{section} {number}"
+            if not isinstance(entity, dict):
+                errors.append(f"{label} is not an object")
+                continue
+            if not isinstance(entity.get("loan") or {}, dict):
+                errors.append(f"{label}: loan is not an object")
+            children = entity.get("acquisition_entities") or []
+            if not isinstance(children, list) or not all(
+                isinstance(child, dict) for child in children
+            ):
+                errors.append(f"{label}: acquisition_entities is not a list of objects")
+    return errors
+
+
+def check_layout(data):
+    errors = layout_errors(data)
+    if errors:
+        raise ValueError(error_message(None, [(None, error) for error in errors]))
+
+
+def _rows(data):
+    rows = []
+
+    def add(entity, section, parent):
+        entity = dict(entity)
+        loan = entity.pop("loan", None)
+        children = entity.pop("acquisition_entities", None) or []
+        entity.setdefault("type", "Entity")
+        rows.append({**entity, "section": section, "parent": parent})
+        if loan:
+            add({"type": "Loan", **loan}, section, entity.get("name"))
+        for child in children:
+            add(child, section, entity.get("name"))
+
+    for section in SECTIONS:
+        for entity in data.get(section) or []:
+            add(entity, section, None)
+    return rows
+
+
+def _to_columns(rows):
+    return _columns(
+        {
+            column: [row.get(column) for row in rows]
+            for column in list(COLUMNS) + _extra_columns(rows)
+        }
+    )
+
+
+def _extra_columns(rows):
+    known = set(COLUMNS)
+    return sorted({key for row in rows for key in row} - known)
+
+
+def _columns(lists):
+    # Missing values (None or NaN) are stored as None
+    columns = {}
+    for column, values in lists.items():
+        array = np.empty(len(values), dtype=object)
+        array[:] = [None if _missing(value) else value for value in values]
+        columns[column] = array
+    return columns
+
+
+def concat_columns(parts):
+    # Rows of several column dicts, missing columns filled with None
+    names = list(COLUMNS)
+    names += sorted({column for part in parts for column in part} - set(COLUMNS))
+    columns = {}
+    for column in names:
+        arrays = []
+        for part in parts:
+            size = len(part["type"])
+            arrays.append(part.get(column, np.full(size, None, dtype=object)))
+        columns[column] = np.concatenate(arrays) if arrays else np.empty(0, object)
+    return columns
+
+
+def _missing(value):
+    return value is None or (isinstance(value, float) and value != value)
+
+
+def _hashable(value):
+    # Also False for tuples holding a list, see _within
+    if not isinstance(value, Hashable):
+        return False
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+def _isin(values, allowed):
+    allowed = set(allowed)
+    return np.array(
+        [_hashable(value) and value in allowed for value in values], dtype=bool
+    )
+
+
+def _is_number(value):
+    # Numbers only, strings such as "100" and booleans are not coerced
+    return isinstance(value, (int, float, np.number)) and not isinstance(
+        value, (bool, np.bool_)
+    )
+
+
+def _numbers(values, present):
+    # Float values, NaN where missing or not a number
+    numbers = np.full(len(values), np.nan)
+    numeric = present & np.array([_is_number(value) for value in values], dtype=bool)
+    numbers[numeric] = values[numeric].astype(np.float64)
+    return numbers
+
+
+def _days(values, present):
+    # ISO dates (or date objects) -> datetime64[D], NaT if missing or invalid.
+    # Only full YYYY-MM-DD dates are valid, numpy also reads 5 or "2023-10"
+    # as dates.
+    days = np.full(len(values), np.datetime64("NaT"), dtype="datetime64[D]")
+    text = np.array([str(value)[:10] for value in values[present]], dtype=object)
+    try:
+        days[present] = np.array(text, dtype="datetime64[D]")
+    except ValueError:
+        for row, value in zip(np.flatnonzero(present), text):
+            try:
+                days[row] = np.datetime64(value, "D")
+            except ValueError:
+                pass
+    rows = np.flatnonzero(present)
+    parsed = days[rows]
+    full = np.datetime_as_string(parsed) == text.astype(str)
+    full &= np.array(
+        [isinstance(value, (str, dt.date)) for value in values[present]], dtype=bool
+    )
+    days[rows[~full]] = np.datetime64("NaT")
+    return days
+
+
+def _duplicated(values, rows):
+    # Rows in `rows` whose value already appeared in an earlier one
+    seen = set()
+    duplicated = np.zeros(len(values), dtype=bool)
+    for row in np.flatnonzero(rows):
+        if not _hashable(values[row]):
+            continue
+        duplicated[row] = values[row] in seen
+        seen.add(values[row])
+    return duplicated
+
+
+def _within(values, plans):
+    # Values made unique per plan, so several plans can be checked together
+    if plans is None:
+        return values
+    return list(zip(plans.tolist(), values))
+
+
+def validate(columns):
+    errors = plan_errors(columns)
+    if errors:
+        raise ValueError(error_message(columns, errors))
+
+
+def plan_errors(columns, plans=None):
+    # Checks every row at once and returns all problems together, as
+    # (row, message) with row None for the plan as a whole. With `plans`
+    # (the plan of each row, see flatten_plans) names, parents and the bank
+    # account are checked within each plan and problems of a whole plan are
+    # reported on its first row.
+    errors = []
+
+    def report(mask, message):
+        for row in np.flatnonzero(mask):
+            errors.append((row, message))
+
+    unknown = [column for column in columns if column not in COLUMNS]
+    if plans is None and unknown:
+        errors.append((None, f"unknown fields {', '.join(unknown)}"))
+    for column in unknown if plans is not None else []:
+        report(columns[column] != None, f"unknown field {column}")  # noqa: E711
+    present = {column: columns[column] != None for column in COLUMNS}  # noqa: E711
+    types = columns["type"]
+    names = _within(columns["name"], plans)
+    parents = _within(columns["parent"], plans)
+    report(~_isin(types, FIELDS), "unknown type")
+    report(~_isin(columns["section"], SECTIONS), "unknown section")
+
+    for entity_type, (required, optional) in FIELDS.items():
+        rows = types == entity_type
+        for field in required:
+            report(rows & ~present[field], f"{field} is required")
+        for field in set(COLUMNS[4:]) - set(required) - set(optional):
+            report(rows & present[field], f"{field} is not a {entity_type} field")
+
+    for column in ("type", "name", "parent"):
+        is_text = np.array(
+            [isinstance(value, str) for value in columns[column]], dtype=bool
+        )
+        report(present[column] & ~is_text, f"{column} is not a text")
+    for field in NUMERIC_FIELDS:
+        values = _numbers(columns[field], present[field])
+        report(present[field] & ~np.isfinite(values), f"{field} is not a number")
+        if field == "term_in_year":
+            fraction = np.isfinite(values) & (values % 1 != 0)
+            report(fraction, f"{field} is not a whole number of years")
+    dates = {}
+    for field in DATE_FIELDS:
+        dates[field] = _days(columns[field], present[field])
+        report(present[field] & np.isnat(dates[field]), f"{field} is not a date")
+    report(dates["end_date"] < dates["start_date"], "end_date is before start_date")
+
+    report(_duplicated(names, present["name"]), "duplicate name")
+    real_estate = [name for name, kind in zip(names, types) if kind == "RealEstate"]
+    report(present["parent"] & ~_isin(parents, real_estate), "unknown parent")
+    nested = present["parent"]
+    report(nested & ~_isin(types, ["Entity", "Loan"]), "can not be nested")
+    report(_duplicated(parents, nested & (types == "Loan")), "second loan")
+
+    message = (
+        "the plan needs one BankAccount named 'Bank Account' in assets_liabilities"
+    )
+    bank = columns["name"] == "Bank Account"
+    report(bank & (columns["section"] != "assets_liabilities"), message)
+    if plans is None:
+        if bank.sum() != 1 or not (bank & (types == "BankAccount")).any():
+            errors.append((None, message))
+    else:
+        numbers, first = np.unique(plans, return_index=True)
+        index = np.searchsorted(numbers, plans)
+        banks = np.bincount(index, weights=bank, minlength=len(numbers))
+        typed = np.bincount(
+            index, weights=bank & (types == "BankAccount"), minlength=len(numbers)
+        )
+        for row in first[(banks != 1) | (typed == 0)]:
+            errors.append((row, message))
+    return errors
+
+
+def error_message(columns, errors, first=0):
+    # Message of plan_errors(), rows numbered from the plan's `first` row
+    lines = [
+        message if row is None else f"{_label(columns, row, first)}: {message}"
+        for row, message in errors
+    ]
+    shown = "\n".join(lines[:20])
+    more = f"\n... and {len(lines) - 20} more" if len(lines) > 20 else ""
+    return f"Invalid plan, {len(lines)} error(s):\n{shown}{more}"
+
+
+def _label(columns, row, first=0):
+    name = columns["name"][row]
+    label = f"row {row - first}"
+    return f"{label} ({name})" if isinstance(name, str) else label
+
+
+def _records(columns, rows):
+    return [{column: values[row] for column, values in columns.items()} for row in rows]
+
+
+def build(columns, as_table=False):
+    # Validated rows -> (entities, assets_liabilities)
+    nested = columns["parent"] != None  # noqa: E711
+    children = {}
+    for record in _records(columns, np.flatnonzero(nested)):
+        children.setdefault(record["parent"], []).append(record)
+
+    sections = {section: [] for section in SECTIONS}
+    top = ~nested
+    if as_table:
+        bulk = top & _isin(columns["type"], ["Entity", "Stock"])
+        for section in SECTIONS:
+            rows = np.flatnonzero(bulk & (columns["section"] == section))
+            if len(rows):
+                sections[section].append(_table(TABLE_NAMES[section], columns, rows))
+        top = top & ~bulk
+
+    for record in _records(columns, np.flatnonzero(top)):
+        kwargs = _kwargs(record)
+        if record["type"] == "RealEstate":
+            nested = children.get(record["name"], [])
+            loans = [child for child in nested if child["type"] == "Loan"]
+            kwargs["loan"] = _create(loans[0]) if loans else None
+            kwargs["acquisition_entities"] = [
+                _create(child) for child in nested if child["type"] != "Loan"
+            ]
+        sections[record["section"]].append(
+            EntityFactory.create_entity(record["type"], **kwargs)
+        )
+    return sections["entities"], sections["assets_liabilities"]
+
+
+def _kwargs(record):
+    required, optional = FIELDS[record["type"]]
+    kwargs = {field: record[field] for field in required}
+    for field in optional:
+        if record.get(field) is not None:
+            kwargs[field] = record[field]
+    for field in DATE_FIELDS:
+        if field in kwargs:
+            kwargs[field] = str(kwargs[field])[:10]
+    if "term_in_year" in kwargs:
+        # Validated as a whole number, Parquet stores it as a float
+        kwargs["term_in_year"] = int(kwargs["term_in_year"])
+    return kwargs
+
+
+def _create(record):
+    return EntityFactory.create_entity(record["type"], **_kwargs(record))
+
+
+def _table(name, columns, rows):
+    table = EntityTable(name, capacity=len(rows))
+    types = columns["type"][rows]
+    for entity_type in dict.fromkeys(types):
+        group = rows[types == entity_type]
+        rate = "annual_expected_return" if entity_type == "Stock" else None
+        rate = rate or "annual_inflation_rate"
+        rates = columns[rate][group]
+        missing = rates == None  # noqa: E711
+        EntityFactory.create_entities(
+            entity_type,
+            table,
+            name=columns["name"][group].tolist(),
+            amount=columns["amount"][group].astype(np.float64),
+            start_date=_dates(columns["start_date"][group]),
+            end_date=_dates(columns["end_date"][group]),
+            **{rate: np.where(missing, 0, rates).astype(np.float64)},
+        )
+    return table
+
+
+def _dates(column):
+    return [None if value is None else str(value)[:10] for value in column]
+
+
+def plan_from_dict(data, as_table=False, start_date=None, duration=None):
+    columns = flatten(data)
+    settings = data.get("simulation") or {}
+    validate(columns)
+    entities, assets_liabilities = build(columns, as_table)
+    return _plan(settings, entities, assets_liabilities, start_date, duration)
+
+
+def simulation_error(settings, start_date=None, duration=None):
+    # Problem with the simulation settings, start_date and duration override
+    # the plan's, None if they are valid
+    start_date = start_date or settings.get("start_date")
+    duration = duration or settings.get("duration")
+    if start_date is None or duration is None:
+        return "The plan needs simulation start_date and duration."
+    if np.isnat(_days(np.array([start_date], dtype=object), np.array([True]))[0]):
+        return "The plan start_date is not a date."
+    if not _is_number(duration) or duration % 1 != 0:
+        return "The plan duration is not a whole number of months."
+    if duration < 1:
+        return "The plan duration must be at least one month."
+    return None
+
+
+def _plan(settings, entities, assets_liabilities, start_date, duration):
+    error = simulation_error(settings, start_date, duration)
+    if error is not None:
+        raise ValueError(error)
+    start_date = start_date or settings.get("start_date")
+    duration = duration or settings.get("duration")
+    return Plan(
+        str(start_date)[:10],
+        int(duration),
+        entities,
+        assets_liabilities,
+        settings.get("allocation"),
+    )
+
+
+def load_plan(
+    path,
+    as_table: Optional[bool] = None,
+    start_date=None,
+    duration: Optional[int] = None,
+):
+    # JSON, YAML or Parquet. With as_table (default for Parquet) top-level
+    # Entity and Stock rows are bulk-loaded into one EntityTable per section.
+    columns, settings = read_plan(path)
+    validate(columns)
+    if as_table is None:
+        as_table = path.lower().endswith(".parquet")
+    entities, assets_liabilities = build(columns, as_table)
+    return _plan(settings, entities, assets_liabilities, start_date, duration)
+
+
+def read_plan(path):
+    # (columns, simulation settings) of a plan file, not validated
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".parquet":
+        return read_parquet(path)
+    with open(path) as file:
+        if extension == ".json":
+            data = json.load(file)
+        elif extension in (".yaml", ".yml"):
+            import yaml
+
+            data = yaml.safe_load(file)
+        else:
+            raise ValueError(f"Plan format {extension} is not supported.")
+    return flatten(data), data.get("simulation") or {}
+
+
+def read_parquet(path):
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path)
+    metadata = table.schema.metadata or {}
+    settings = json.loads(metadata.get(b"simulation", b"{}"))
+    lists = table.to_pydict()
+    for column in COLUMNS:
+        lists.setdefault(column, [None] * table.num_rows)
+    order = list(COLUMNS) + [c for c in lists if c not in COLUMNS]
+    return _columns({column: lists[column] for column in order}), settings
+
+
+def save_parquet(data, path):
+    # Columnar form of a plan dict
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns = flatten(data)
+    for field in DATE_FIELDS:
+        columns[field] = _dates(columns[field])
+    table = pa.table({column: list(values) for column, values in columns.items()})
+    settings = json.dumps(data.get("simulation") or {}, default=str)
+    table = table.replace_schema_metadata({"simulation": settings})
+    pq.write_table(table, path)
+    return path
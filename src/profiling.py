@@ -0,0 +1,90 @@
+import cProfile
+import time
+
+
+class _Phase:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class SimulationMetrics:
+    # Wall time and call counts per simulation phase and per entity class.
+    # With cprofile=True the whole run is also recorded by cProfile.
+    def __init__(self, cprofile=False):
+        self.phases = {}
+        self.entities = {}
+        self.profiler = cProfile.Profile() if cprofile else None
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def add(self, name, seconds, calls=1):
+        total = self.phases.setdefault(name, [0, 0.0])
+        total[0] += calls
+        total[1] += seconds
+
+    def call_entity(self, table, entity, method, dates):
+        # Times one entity method call, grouped by (table, entity class)
+        start = time.perf_counter()
+        value = method(dates)
+        total = self.entities.setdefault((table, type(entity).__name__), [0, 0.0])
+        total[0] += 1
+        total[1] += time.perf_counter() - start
+        return value
+
+    def start(self):
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+
+    def summary(self):
+        import pandas as pd
+
+        rows = [
+            (name, calls, seconds) for name, (calls, seconds) in self.phases.items()
+        ]
+        df = pd.DataFrame(rows, columns=["phase", "calls", "seconds"])
+        df["share"] = df["seconds"] / df["seconds"].sum()
+        return df.set_index("phase")
+
+    def entity_summary(self):
+        import pandas as pd
+
+        rows = [
+            (table, name, calls, seconds)
+            for (table, name), (calls, seconds) in self.entities.items()
+        ]
+        df = pd.DataFrame(rows, columns=["table", "entity_class", "calls", "seconds"])
+        return df.set_index(["table", "entity_class"]).sort_index()
+
+    def report(self):
+        lines = [f"{'phase':25} {'calls':>8} {'seconds':>10}"]
+        for name, (calls, seconds) in self.phases.items():
+            lines.append(f"{name:25} {calls:8} {seconds:10.4f}")
+        for (table, name), (calls, seconds) in sorted(self.entities.items()):
+            lines.append(f"{table + '/' + name:25} {calls:8} {seconds:10.4f}")
+        return "\n".join(lines)
+
+    def stats(self, sort="cumulative"):
+        if self.profiler is None:
+            raise ValueError("Run with SimulationMetrics(cprofile=True) to get stats.")
+        import pstats
+
+        return pstats.Stats(self.profiler).sort_stats(sort)
+
+    def dump_stats(self, path):
+        # Readable with pstats or snakeviz
+        self.stats().dump_stats(path)
+        return path
@@ -0,0 +1,157 @@
+from typing import NamedTuple
+
+import numpy as np
+
+TABLES = ("cashflow", "net_worth")
+
+
+class MonthResult(NamedTuple):
+    date: str
+    cashflow: float
+    net_worth: float
+    bank_balance: float
+    cashflow_results: dict
+    net_worth_results: dict
+
+
+class SimulationResult:
+    # Cashflow and net worth stored as preallocated (months, entities) arrays.
+    # Rows are written in place, one per simulated month. An entity missing
+    # from a month (not yet added, retired or removed) is recorded as 0.
+    def __init__(self, dates, cashflow_names, net_worth_names):
+        self.dates = list(dates)
+        self.month_index = {date: month for month, date in enumerate(self.dates)}
+        self.names = {
+            "cashflow": list(cashflow_names),
+            "net_worth": list(net_worth_names),
+        }
+        self.entity_index = {
+            table: {name: column for column, name in enumerate(names)}
+            for table, names in self.names.items()
+        }
+        self.values = {
+            table: np.zeros((len(self.dates), len(names)))
+            for table, names in self.names.items()
+        }
+        self.months = 0
+
+    @classmethod
+    def from_arrays(cls, dates, cashflow_results, net_worth_results):
+        # `*_results` map entity names to arrays covering every date
+        result = cls(dates, cashflow_results, net_worth_results)
+        for table, results in zip(TABLES, (cashflow_results, net_worth_results)):
+            if results:
+                result.values[table] = np.column_stack(list(results.values()))
+        result.months = len(result.dates)
+        return result
+
+    def copy(self):
+        result = SimulationResult(self.dates, [], [])
+        result.names = {table: list(names) for table, names in self.names.items()}
+        result.entity_index = {
+            table: dict(index) for table, index in self.entity_index.items()
+        }
+        result.values = {table: values.copy() for table, values in self.values.items()}
+        result.months = self.months
+        return result
+
+    def head(self, months):
+        # Copy of the first `months` months
+        result = SimulationResult(
+            self.dates[:months], self.names["cashflow"], self.names["net_worth"]
+        )
+        for table, values in self.values.items():
+            result.values[table][:] = values[: len(result.dates)]
+        result.months = min(months, self.months)
+        return result
+
+    @property
+    def cashflow(self):
+        return self.values["cashflow"][: self.months]
+
+    @property
+    def net_worth(self):
+        return self.values["net_worth"][: self.months]
+
+    def extend(self, dates):
+        # Grow the month axis, used when a simulation is run again
+        dates = list(dates)
+        for date in dates:
+            self.month_index[date] = len(self.dates)
+            self.dates.append(date)
+        for table, values in self.values.items():
+            extra = np.zeros((len(dates), values.shape[1]))
+            self.values[table] = np.concatenate((values[: self.months], extra))
+
+    def _add_columns(self, table, names):
+        for name in names:
+            self.entity_index[table][name] = len(self.names[table])
+            self.names[table].append(name)
+        values = self.values[table]
+        columns = np.zeros((values.shape[0], len(names)))
+        self.values[table] = np.concatenate((values, columns), axis=1)
+
+    def _write_row(self, table, month, results):
+        names = self.names[table]
+        row = self.values[table][month]
+        if len(results) == len(names) and all(a == b for a, b in zip(results, names)):
+            row[:] = list(results.values())
+            return
+        # The set of entities changed: write by name
+        new_names = [name for name in results if name not in self.entity_index[table]]
+        if new_names:
+            self._add_columns(table, new_names)
+        row = self.values[table][month]
+        row[:] = 0.0
+        for name, value in results.items():
+            row[self.entity_index[table][name]] = value
+
+    def record(self, date, cashflow_results, net_worth_results):
+        month = self.month_index[date]
+        self._write_row("cashflow", month, cashflow_results)
+        self._write_row("net_worth", month, net_worth_results)
+        self.months = max(self.months, month + 1)
+
+    def record_block(self, start, cashflow_results, net_worth_results):
+        # Write consecutive months starting at row `start` from entity arrays
+        for table, results in zip(TABLES, (cashflow_results, net_worth_results)):
+            new_names = [
+                name for name in results if name not in self.entity_index[table]
+            ]
+            if new_names:
+                self._add_columns(table, new_names)
+            for name, values in results.items():
+                column = self.entity_index[table][name]
+                end = start + len(values)
+                self.values[table][start:end, column] = values
+            if results:
+                self.months = max(self.months, start + len(values))
+
+    def column(self, table, name):
+        return self.values[table][: self.months, self.entity_index[table][name]]
+
+    def to_dataframes(self):
+        # Views over the result arrays, no copy. pandas is only imported
+        # when DataFrames are asked for.
+        import pandas as pd
+
+        index = pd.Index(self.dates[: self.months], name="Date")
+        cashflow_df = pd.DataFrame(
+            self.cashflow, index=index, columns=self.names["cashflow"], copy=False
+        )
+        net_worth_df = pd.DataFrame(
+            self.net_worth, index=index, columns=self.names["net_worth"], copy=False
+        )
+        return cashflow_df, net_worth_df
+
+    def to_json(self):
+        results = {}
+        for month, date in enumerate(self.dates[: self.months]):
+            results[date] = {
+                table: {
+                    name: float(value)
+                    for name, value in zip(self.names[table], self.values[table][month])
+                }
+                for table in TABLES
+            }
+        return results
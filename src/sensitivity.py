@@ -0,0 +1,277 @@
+import copy
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from src.balance import Balance
+from src.cashflow import CashFlow
+from src.entity import BankAccount, Entity, Loan, RealEstate
+from src.montecarlo import STOCHASTIC_PARAMETERS, MonteCarloSimulation, _Batch
+from src.table import EntityTable
+from src.utils import add_months, key_to_date, month_range_keys
+from src.vectorized import nested_entities
+
+
+class Parameter(NamedTuple):
+    entity: str
+    parameter: str
+    # Plan value: annual rate in percent like the entity arguments, amount,
+    # term in years or start date
+    value: object
+    # Move up and down, in the parameter's unit (percentage points, currency,
+    # years or months)
+    step: float
+
+
+def _monthly_rate(entity):
+    if isinstance(entity, (Entity, BankAccount)):
+        return entity.monthly_inflation_rate
+    if isinstance(entity, Loan):
+        return entity.monthly_rate
+    return entity.annual_expected_return
+
+
+class SensitivityResult:
+    def __init__(self, dates, parameters: List[Parameter], delta, net_worth):
+        self.dates = dates
+        self.parameters = parameters
+        self.delta = delta
+        # (1 + 2 * parameters, months): base plan, then each parameter
+        # moved up and down by `delta`
+        self.net_worth = net_worth
+
+    @property
+    def base(self):
+        return pd.Series(self.net_worth[0], index=pd.Index(self.dates, name="Date"))
+
+    def _month(self, date):
+        return -1 if date is None else self.dates.index(date)
+
+    def tornado(self, date: Optional[str] = None):
+        # Net worth on `date` (the last month by default) with each parameter
+        # moved down and up, ranked by swing
+        month = self._month(date)
+        base = self.net_worth[0, month]
+        up = self.net_worth[1::2, month]
+        down = self.net_worth[2::2, month]
+        df = pd.DataFrame(
+            {
+                "entity": [p.entity for p in self.parameters],
+                "parameter": [p.parameter for p in self.parameters],
+                "value": [p.value for p in self.parameters],
+                "net_worth_down": down,
+                "net_worth_up": up,
+                "impact_down": down - base,
+                "impact_up": up - base,
+                "swing": np.abs(up - down),
+            }
+        )
+        df = df.sort_values("swing", ascending=False, ignore_index=True)
+        df.index.name = "rank"
+        return df
+
+    def curves(self):
+        # d(net worth) / d(parameter) per month, per unit of the parameter
+        # (percentage point, currency unit, year or month), by central
+        # difference
+        steps = np.array([p.step for p in self.parameters], dtype=np.float64)
+        slopes = (self.net_worth[1::2] - self.net_worth[2::2]) / (2 * steps[:, None])
+        return pd.DataFrame(
+            slopes.T,
+            index=pd.Index(self.dates, name="Date"),
+            columns=[f"{p.entity}.{p.parameter}" for p in self.parameters],
+        )
+
+
+class SensitivityAnalysis(MonteCarloSimulation):
+    # Moves every numeric parameter of every entity (entity tables excluded)
+    # up and down:
+    #
+    # - rates (STOCHASTIC_PARAMETERS, the Bank Account's excluded as it earns
+    #   no rate once the simulation runs) by `delta` percentage points. All
+    #   rate moves are the paths of one Monte Carlo batch where a single
+    #   entity's rate differs from the plan and, as in Monte Carlo, apply
+    #   from `start_date` on.
+    # - amounts by `amount_delta` percent of the amount, loan terms by
+    #   `term_delta` years and dates by `date_delta` months (the entity and
+    #   everything nested in it move together, the Bank Account follows the
+    #   simulation clock and is not moved). Each move only re-evaluates the
+    #   moved entity, its difference to the plan is added to the base cash
+    #   flow and net worth and all bank account carries are one cumsum.
+    #
+    # RealEstate cashdown is not a parameter of the calculations (the cash
+    # paid is an acquisition entity), its acquisition entities are moved
+    # instead.
+    def __init__(
+        self,
+        start_date,
+        duration,
+        cashflow: CashFlow,
+        balance: Balance,
+        delta: float = 1.0,
+        amount_delta: float = 10.0,
+        term_delta: int = 1,
+        date_delta: int = 1,
+    ):
+        super().__init__(start_date, duration, cashflow, balance, {}, paths=1)
+        self.delta = delta
+        self.amount_delta = amount_delta
+        self.term_delta = term_delta
+        self.date_delta = date_delta
+
+    def _perturbed_entities(self):
+        bank_account = self.balance.entities.get("Bank Account")
+        return [
+            entity
+            for entity in self._all_entities().values()
+            if type(entity) in STOCHASTIC_PARAMETERS and entity is not bank_account
+        ]
+
+    def run(self):
+        grid = month_range_keys(self.start_date, self.duration)
+        dates = [key_to_date(key) for key in grid]
+        entities = self._perturbed_entities()
+        paths = 1 + 2 * len(entities)
+
+        # The entity object stands for its own "distribution"
+        rates, distributions, parameters = {}, {}, []
+        for index, entity in enumerate(entities):
+            monthly_rate = _monthly_rate(entity)
+            entity_rates = np.full((paths, self.duration), float(monthly_rate))
+            entity_rates[1 + 2 * index] += self.delta / 1200
+            entity_rates[2 + 2 * index] -= self.delta / 1200
+            rates[id(entity)] = entity_rates
+            distributions[id(entity)] = entity
+            parameters.append(
+                Parameter(
+                    entity.name,
+                    STOCHASTIC_PARAMETERS[type(entity)],
+                    monthly_rate * 1200,
+                    self.delta,
+                )
+            )
+
+        batch = _Batch(grid, paths, rates, distributions)
+        net_worth, _ = self._run_batch(batch, dates)
+
+        moves = list(self._moves())
+        if moves:
+            moved = self._run_moves(moves, grid, net_worth[0])
+            net_worth = np.concatenate([net_worth, moved])
+            parameters += [parameter for parameter, _, _ in moves]
+        logger.info(
+            f"Sensitivity: {len(parameters)} parameters, "
+            f"{1 + 2 * len(parameters)} plans"
+        )
+        return SensitivityResult(dates, parameters, self.delta, net_worth)
+
+    def _top_level(self):
+        # Top-level entities with the path of names to every nested one
+        top = {}
+        for entity in list(self.cashflow.entities.values()) + list(
+            self.balance.entities.values()
+        ):
+            top[id(entity)] = entity
+        for entity in top.values():
+            if isinstance(entity, EntityTable):
+                continue
+            stack = [(entity, ())]
+            while stack:
+                nested, path = stack.pop()
+                yield entity, path, nested
+                for child in getattr(nested, "entities", {}).values():
+                    stack.append((child, path + (child.name,)))
+
+    def _moves(self):
+        # (Parameter, top-level entity, path to the moved entity) for every
+        # amount, loan term and date
+        bank_account = self.balance.entities.get("Bank Account")
+        for top, path, entity in self._top_level():
+            step = abs(entity.amount) * self.amount_delta / 100
+            if step:
+                parameter = Parameter(entity.name, "amount", entity.amount, step)
+                yield parameter, top, path
+            if isinstance(entity, Loan) and self.term_delta:
+                term = entity.periods_in_month / 12
+                if entity.periods_in_month > 12 * self.term_delta:
+                    parameter = Parameter(
+                        entity.name, "term_in_year", term, self.term_delta
+                    )
+                    yield parameter, top, path
+            if entity is not bank_account and self.date_delta:
+                parameter = Parameter(
+                    entity.name, "start_date", entity.start_date, self.date_delta
+                )
+                yield parameter, top, path
+
+    def _run_moves(self, moves, grid, base_net_worth):
+        # Net worth of the plan with each move up then down, as (2 * moves,
+        # months): the moved entity's difference to the plan is added to the
+        # base and the bank account carries it. A nested entity adds its cash
+        # flow to its RealEstate's and, for the loan, its value to the
+        # RealEstate's net worth while the RealEstate is active.
+        bank_account = self.balance.entities.get("Bank Account")
+        rows = 2 * len(moves)
+        cashflow = np.zeros((rows, len(grid)))
+        net_worth = np.tile(base_net_worth, (rows, 1))
+        for index, (parameter, top, path) in enumerate(moves):
+            entity = top
+            for name in path:
+                entity = entity.entities[name]
+            in_cashflow = self.cashflow.entities.get(top.name) is top
+            in_balance = (
+                self.balance.entities.get(top.name) is top
+                and top is not bank_account
+                and (not path or entity is top.loan)
+            )
+            if in_cashflow:
+                base_cashflow = entity.calculate_monthly_cash_flow_array(grid)
+            if in_balance:
+                active = top.is_active_on_array(grid) if path else True
+                base_value = entity.calculate_future_value_array(grid)
+            for row, sign in ((2 * index, 1), (2 * index + 1, -1)):
+                moved = _copy_tree(entity)
+                _move(moved, parameter, sign)
+                if in_cashflow:
+                    moved_cashflow = moved.calculate_monthly_cash_flow_array(grid)
+                    cashflow[row] = moved_cashflow - base_cashflow
+                if top is bank_account and len(grid):
+                    opening = moved.calculate_future_value(grid[0])
+                    cashflow[row, 0] += opening - top.calculate_future_value(grid[0])
+                elif in_balance:
+                    moved_value = moved.calculate_future_value_array(grid)
+                    net_worth[row] += np.where(active, moved_value - base_value, 0.0)
+        return net_worth + np.cumsum(cashflow, axis=1)
+
+
+def _copy_tree(entity):
+    # Copy of an entity and of the entities nested in it to move a parameter
+    # of, only evaluated with the array methods (the date index of a
+    # RealEstate is shared with the plan)
+    moved = copy.copy(entity)
+    if isinstance(entity, RealEstate):
+        moved.entities = {
+            name: _copy_tree(child) for name, child in entity.entities.items()
+        }
+        moved.loan = moved.entities[entity.loan.name] if entity.loan else None
+    return moved
+
+
+def _move(entity, parameter: Parameter, sign):
+    # Moves `parameter` of an entity copy up (sign 1) or down (sign -1)
+    step = sign * parameter.step
+    moved = [entity]
+    if parameter.parameter == "amount":
+        entity.amount = entity.amount + step
+    elif parameter.parameter == "term_in_year":
+        entity.periods_in_month = entity.periods_in_month + round(12 * step)
+    else:
+        moved = list(nested_entities([entity]))
+        for nested in moved:
+            nested.start_date = key_to_date(add_months(nested._start_key, int(step)))
+            nested.end_date = key_to_date(add_months(nested._end_key, int(step)))
+    for nested in moved:
+        if isinstance(nested, Loan):
+            nested._schedule = None
@@ -0,0 +1,457 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import NamedTuple, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+from loguru import logger
+
+from src.batch import evaluate_plans
+from src.plan import plan_from_dict
+
+# Local simulation service for interactive front ends:
+#
+#   python -m src.cli serve --port 8765
+#   curl -d @plan.json localhost:8765/simulate
+#
+# Plans are the JSON form of the plan files (see src.plan). Requests
+# arriving within `window` seconds of each other are evaluated together as
+# one batch (src.batch), in a pool of worker processes so the event loop
+# only parses requests and writes responses. At most `max_pending` requests
+# wait for a worker, the others are answered 503 right away.
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class Overloaded(RuntimeError):
+    # More than max_pending requests are waiting, retry later
+    pass
+
+
+class _Request(NamedTuple):
+    plan: dict
+    entities: bool
+    future: asyncio.Future
+    received: float
+
+
+def _json(data):
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def _error(message):
+    return _json({"error": message})
+
+
+def _plan_response(result, plan, entities):
+    # Totals (and entity values) of one plan over its own months
+    months = np.flatnonzero(result.mask[plan])
+    response = {
+        "dates": [result.dates[month] for month in months],
+        "cashflow": result.cashflow[plan, months].tolist(),
+        "bank_balance": result.bank_balance[plan, months].tolist(),
+        "net_worth": result.net_worth[plan, months].tolist(),
+    }
+    if entities:
+        response["entities"] = {
+            table: {
+                name: values[plan, column, months].tolist()
+                for column, name in enumerate(result.names[table][plan])
+            }
+            for table, values in result.values.items()
+        }
+    return _json(response)
+
+
+def _plan_error(plan):
+    # Message of a plan that src.plan can not load, None if it loads
+    try:
+        plan_from_dict(plan)
+    except (ValueError, TypeError) as error:
+        return str(error)
+    return None
+
+
+def _simulate(requests):
+    # Runs in a worker: [(plan, entities)] -> [(status, JSON body)]
+    try:
+        results, failures = evaluate_plans(
+            enumerate(plan for plan, _ in requests),
+            entities=any(entities for _, entities in requests),
+        )
+    except Exception:
+        if len(requests) == 1:
+            # A malformed plan is the client's error, anything else a fault
+            # of the engine
+            error = _plan_error(requests[0][0])
+            if error is not None:
+                return [(400, _error(error))]
+            logger.exception("Simulation failed")
+            return [(500, _error("The simulation failed."))]
+        # One malformed plan should not fail the others
+        return [response for request in requests for response in _simulate([request])]
+
+    responses = [None] * len(requests)
+    for number, error in failures.items():
+        responses[number] = (400, _error(error))
+    for result in results:
+        for plan, number in enumerate(result.plan_ids):
+            if responses[number] is None:
+                body = _plan_response(result, plan, requests[number][1])
+                responses[number] = (200, body)
+    return responses
+
+
+def _warm_up():
+    # Starts a worker process
+    return os.getpid()
+
+
+class LatencyMetrics:
+    # Per-request timings in seconds over the last `size` requests: time
+    # waiting for a worker, time of the batch evaluation and total time
+    # from reading the request to the response being ready.
+    def __init__(self, size=10_000):
+        self.queue = deque(maxlen=size)
+        self.compute = deque(maxlen=size)
+        self.total = deque(maxlen=size)
+        self.requests = 0
+        self.rejected = 0
+        self.failed = 0
+        self.batches = 0
+        self.batched = 0
+
+    def record(self, queue, compute, total, status):
+        self.queue.append(queue)
+        self.compute.append(compute)
+        self.total.append(total)
+        self.requests += 1
+        if status != 200:
+            self.failed += 1
+
+    @staticmethod
+    def _percentiles(samples):
+        if not samples:
+            return {}
+        values = np.percentile(np.fromiter(samples, float), [50, 90, 99]) * 1000
+        return {
+            "p50": float(values[0]),
+            "p90": float(values[1]),
+            "p99": float(values[2]),
+            "max": max(samples) * 1000,
+        }
+
+    def summary(self):
+        return {
+            "requests": self.requests,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "batches": self.batches,
+            "mean_batch_size": self.batched / self.batches if self.batches else 0.0,
+            "latency_ms": self._percentiles(self.total),
+            "queue_ms": self._percentiles(self.queue),
+            "compute_ms": self._percentiles(self.compute),
+        }
+
+
+class SimulationService:
+    # HTTP/1.1 with keep-alive, on TCP (`host`, `port`, 0 picks a free port)
+    # or on a Unix socket (`path`):
+    #
+    #   POST /simulate[?entities=1]   plan JSON -> dates, cashflow,
+    #                                 bank_balance and net_worth lists
+    #   GET  /metrics                 LatencyMetrics.summary()
+    #   GET  /health
+    #
+    # Invalid plans and negative bank accounts are answered 400 with an
+    # "error" message.
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8765,
+        path: Optional[str] = None,
+        window: float = 0.005,
+        max_batch: int = 256,
+        max_pending: int = 2_000,
+        max_workers: Optional[int] = None,
+        executor: str = "process",
+        max_body: int = 2**20,
+    ):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.window = window
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.executor = executor
+        self.max_body = max_body
+        self.metrics = LatencyMetrics()
+        self._queue: Optional[asyncio.Queue] = None
+        self._pool = None
+        self._server = None
+        self._dispatchers = []
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        if self.executor == "process":
+            from concurrent.futures import ProcessPoolExecutor
+
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        elif self.executor == "thread":
+            from concurrent.futures import ThreadPoolExecutor
+
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        else:
+            raise ValueError(f"Unknown executor: {self.executor}")
+        await asyncio.gather(
+            *(
+                loop.run_in_executor(self._pool, _warm_up)
+                for _ in range(self.max_workers)
+            )
+        )
+
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        # One dispatcher per worker: a worker that is free takes everything
+        # waiting, so batches grow with the load
+        self._dispatchers = [
+            asyncio.create_task(self._dispatch()) for _ in range(self.max_workers)
+        ]
+        if self.path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, self.path)
+            address = self.path
+        else:
+            self._server = await asyncio.start_server(
+                self._handle, self.host, self.port
+            )
+            self.port = self._server.sockets[0].getsockname()[1]
+            address = f"http://{self.host}:{self.port}"
+        logger.info(f"Simulation service on {address}, {self.max_workers} workers")
+        return self
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.close()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            if self.path is not None and os.path.exists(self.path):
+                os.remove(self.path)
+        for task in self._dispatchers:
+            task.cancel()
+        await asyncio.gather(*self._dispatchers, return_exceptions=True)
+        self._dispatchers = []
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def simulate(self, plan, entities=False):
+        # (status, JSON body) of one plan, evaluated with the requests that
+        # arrive within `window`. Raises Overloaded when max_pending requests
+        # are already waiting.
+        received = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait(_Request(plan, entities, future, received))
+        except asyncio.QueueFull:
+            self.metrics.rejected += 1
+            raise Overloaded("Too many pending requests.") from None
+        status, body, dispatched, compute = await future
+        self.metrics.record(
+            dispatched - received, compute, time.perf_counter() - received, status
+        )
+        return status, body
+
+    async def _batch(self):
+        # Waits for a request, then takes the ones arriving within `window`
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.window
+        while len(batch) < self.max_batch:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Requests whose client went away are dropped
+        return [request for request in batch if not request.future.done()]
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._batch()
+            if not batch:
+                continue
+            dispatched = time.perf_counter()
+            try:
+                responses = await loop.run_in_executor(
+                    self._pool,
+                    _simulate,
+                    [(request.plan, request.entities) for request in batch],
+                )
+            except Exception:
+                logger.exception("Batch failed")
+                responses = [(500, _error("The simulation failed."))] * len(batch)
+            compute = time.perf_counter() - dispatched
+            self.metrics.batches += 1
+            self.metrics.batched += len(batch)
+            for request, (status, body) in zip(batch, responses):
+                if not request.future.done():
+                    request.future.set_result((status, body, dispatched, compute))
+
+    async def _route(self, method, target, body):
+        url = urlsplit(target)
+        if url.path == "/simulate" and method == "POST":
+            try:
+                plan = json.loads(body)
+            except ValueError:
+                return 400, _error("The body is not JSON."), {}
+            if not isinstance(plan, dict):
+                return 400, _error("The plan must be a JSON object."), {}
+            entities = parse_qs(url.query).get("entities", ["0"])[0] not in ("", "0")
+            try:
+                return (*await self.simulate(plan, entities), {})
+            except Overloaded as error:
+                return 503, _error(str(error)), {"Retry-After": "1"}
+        if url.path == "/metrics" and method == "GET":
+            return 200, _json(self.metrics.summary()), {}
+        if url.path == "/health" and method == "GET":
+            return 200, _json({"status": "ok"}), {}
+        return 404, _error(f"No route for {method} {url.path}"), {}
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = await _read_headers(reader)
+                length = int(headers.get("content-length", 0))
+                keep_alive = headers.get("connection", "").lower() != "close"
+                if length > self.max_body:
+                    status, body, extra = 413, _error("The plan is too large."), {}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length)
+                    status, body, extra = await self._route(method, target, body)
+                writer.write(_response(status, body, extra, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            # Malformed request or client gone
+            pass
+        finally:
+            writer.close()
+
+
+async def _read_headers(reader):
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            return headers
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+
+def _response(status, body, extra=None, keep_alive=True):
+    lines = [
+        f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+        "Content-Type: application/json",
+        f"Content-Length: {len(body)}",
+        f"Connection: {'keep-alive' if keep_alive else 'close'}",
+    ]
+    lines += [f"{name}: {value}" for name, value in (extra or {}).items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+class SimulationClient:
+    # Keep-alive client of SimulationService, one request at a time:
+    #
+    #   async with SimulationClient(port=8765) as client:
+    #       result = await client.simulate(plan)
+    def __init__(self, host="127.0.0.1", port=8765, path=None):
+        self.host = host
+        self.port = port
+        self.path = path
+        self._reader = None
+        self._writer = None
+
+    async def connect(self):
+        if self.path is not None:
+            connection = await asyncio.open_unix_connection(self.path)
+        else:
+            connection = await asyncio.open_connection(self.host, self.port)
+        self._reader, self._writer = connection
+        return self
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+            self._writer = None
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def request(self, method, target, body=b""):
+        # -> (status, JSON body)
+        if self._writer is None:
+            await self.connect()
+        head = (
+            f"{method} {target} HTTP/1.1\r\nHost: {self.host}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+        )
+        self._writer.write(head.encode("latin-1") + body)
+        await self._writer.drain()
+        status = int((await self._reader.readline()).split()[1])
+        headers = await _read_headers(self._reader)
+        data = await self._reader.readexactly(int(headers["content-length"]))
+        if headers.get("connection", "").lower() == "close":
+            await self.close()
+        return status, json.loads(data)
+
+    async def simulate(self, plan, entities=False):
+        target = "/simulate?entities=1" if entities else "/simulate"
+        status, data = await self.request("POST", target, _json(plan))
+        if status == 503:
+            raise Overloaded(data["error"])
+        if status != 200:
+            raise ValueError(data["error"])
+        return data
+
+    async def metrics(self):
+        return (await self.request("GET", "/metrics"))[1]
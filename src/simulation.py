@@ -1,87 +1,337 @@
+import contextlib
 import datetime as dt
+import os
+import pickle
+import tempfile
 from typing import List, Optional
 
-import matplotlib.pyplot as plt
-import pandas as pd
-from dateutil.relativedelta import relativedelta
 from loguru import logger
 
+from src.allocation import CashAllocation
 from src.balance import Balance
 from src.cashflow import CashFlow
+from src.entity import RealEstate
+from src.events import EventQueue, FinancialEvent
+from src.profiling import SimulationMetrics
+from src.result import MonthResult, SimulationResult
+from src.tracing import TraceWriter
+from src.utils import add_months, date_key, key_to_date, month_range
+from src.writers import ExcelWriter, ResultWriter
+
+# Phase context used when the simulation is not profiled
+_NOT_PROFILED = contextlib.nullcontext()
+
+# Bump when the attributes of a simulation change, old checkpoints are refused
+CHECKPOINT_VERSION = 3
 
 
 class Simulation:
-    def __init__(self, start_date, duration, cashflow: CashFlow, balance: Balance):
+    def __init__(
+        self,
+        start_date,
+        duration,
+        cashflow: CashFlow,
+        balance: Balance,
+        trace: Optional[TraceWriter] = None,
+    ):
         self.start_date = start_date
         self.date = self.start_date
         self.duration = duration
 
         self.cashflow = cashflow
         self.balance = balance
-        self.simulation_result = {}
+        self.trace = trace
+        self.events = EventQueue()
+        self.result: Optional[SimulationResult] = None
+        self.metrics: Optional[SimulationMetrics] = None
+        # Set by set_allocation, None for a single "Bank Account"
+        self.allocation: Optional[CashAllocation] = None
+        # Set by auto_checkpoint
+        self.checkpoint_path = None
+        self.checkpoint_every = None
+        self.checkpoint_key = None
+        # Months left in the run a checkpoint was taken in
+        self._resume: Optional[int] = None
 
-    def run(self):
-        # Main loop for the simulation
-        for _ in range(self.duration):
-            self.process_month()
-            date = dt.date.fromisoformat(self.date) + relativedelta(months=1)
-            self.date = date.isoformat()
+    def schedule_event(self, event: FinancialEvent):
+        self.events.schedule(event)
 
-    def process_month(self):
-        cashflow, cashflow_results = self.cashflow.calculate_monthly_cash_flow(
-            self.date
-        )
-        self.balance.entities["Bank Account"].update(
-            start_date=self.date, amount=cashflow
+    def set_allocation(self, allocation: Optional[CashAllocation]):
+        # Several cash accounts and the rules routing each month's cash flow
+        # between them, see src.allocation
+        if allocation is not None:
+            allocation.entities(self.balance)
+        self.allocation = allocation
+
+    def fire_events(self):
+        # Cost scales with the events due this month, not with the plan size
+        due = self.events.pop_due(self.date)
+        for event in due:
+            logger.info("Event {} on {}", event.name, self.date)
+            event.execute(self)
+        if due:
+            # Events can move entity dates or add and remove entities
+            for collection in (self.cashflow, self.balance):
+                collection.active.rebuild()
+                for entity in collection.entities.values():
+                    if isinstance(entity, RealEstate):
+                        entity.active.rebuild()
+        return due
+
+    def run(self, profile=False):
+        # Main loop for the simulation. `profile` is True or a
+        # SimulationMetrics, the timings end up in self.metrics.
+        self.start_profiling(profile)
+        try:
+            months = self.duration if self._resume is None else self._resume
+            self._resume = None
+            dates = month_range(self.date, months + 1)
+            self.prepare_result(dates[:-1])
+            checkpointed = 0
+            for month, date in enumerate(dates[:-1]):
+                self.date = date
+                self.process_month()
+                if self._checkpoint_due(month + 1 - checkpointed, months - month - 1):
+                    self.date = dates[month + 1]
+                    self._write_checkpoint(self.checkpoint_path, months - month - 1)
+                    checkpointed = month + 1
+            self.date = dates[-1]
+            if self.trace is not None:
+                self.trace.flush()
+        finally:
+            self.stop_profiling()
+
+    # Checkpoints
+    def auto_checkpoint(self, path, every=12, key=None):
+        # run() writes a checkpoint to `path` every `every` months. `key`
+        # identifies the run (e.g. a hash of the plan and its settings), see
+        # resume.
+        if every < 1:
+            raise ValueError("Checkpoints are taken every one month or more.")
+        self.checkpoint_path = path
+        self.checkpoint_every = every
+        self.checkpoint_key = key
+
+    def checkpoint(self, path):
+        # Clock, entities, pending events and the results so far in one file
+        self._write_checkpoint(path, None)
+
+    @classmethod
+    def resume(cls, path, duration=None, trace: Optional[TraceWriter] = None, key=None):
+        # Simulation saved in `path`. If the checkpoint was taken by
+        # auto_checkpoint, run() finishes the interrupted run. `duration`
+        # (months from start_date) runs it to another horizon instead. With
+        # `key`, a checkpoint taken with another auto_checkpoint key raises
+        # ValueError.
+        with open(path, "rb") as file:
+            simulation = cls._restore(file.read(), duration, trace)
+        if key is not None and simulation.checkpoint_key != key:
+            raise ValueError(
+                f"The checkpoint {path} was taken for another plan or settings."
+            )
+        return simulation
+
+    def fork(self, duration=None):
+        # Independent copy at the current month, e.g. one per scenario after
+        # a common prefix, see resume for `duration`
+        return self._restore(self._snapshot(None), duration, self.trace)
+
+    def _checkpoint_due(self, months, remaining):
+        # `months` simulated since the last checkpoint, `remaining` in the run
+        return (
+            self.checkpoint_path is not None
+            and remaining > 0
+            and months >= self.checkpoint_every
         )
-        if self.balance.entities["Bank Account"].amount < 0:
-            logger.error(
-                f"Bank Account has a negative balance. Date: {self.date}, Amount: {self.balance.entities['Bank Account'].amount}"
+
+    def _snapshot(self, remaining):
+        # The trace, profiling metrics and run caches are left out, results
+        # are cut to the months simulated so far
+        if self.trace is not None:
+            self.trace.flush()
+        state = dict(vars(self))
+        state.update(trace=None, metrics=None, _resume=remaining)
+        state.pop("_state", None)
+        if self.result is not None:
+            state["result"] = self.result.head(self.result.months)
+        collections = (self.cashflow, self.balance)
+        metrics = [collection.metrics for collection in collections]
+        for collection in collections:
+            collection.metrics = None
+        try:
+            return pickle.dumps(
+                {"version": CHECKPOINT_VERSION, "engine": type(self), "state": state},
+                protocol=pickle.HIGHEST_PROTOCOL,
             )
-            raise ValueError("Bank Account has a negative balance")
+        except (pickle.PicklingError, AttributeError, TypeError) as error:
+            raise ValueError(
+                f"The simulation can not be checkpointed ({error}). Event "
+                "actions must be classes such as src.events.UpdateEntity."
+            ) from error
+        finally:
+            for collection, value in zip(collections, metrics):
+                collection.metrics = value
 
-        net_worth, net_worth_results = self.balance.calculate_net_worth(self.date)
+    def _write_checkpoint(self, path, remaining):
+        data = self._snapshot(remaining)
+        # Written next to the checkpoint then renamed, a crash while writing
+        # leaves the previous one
+        directory = os.path.dirname(path) or "."
+        descriptor, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(data)
+        os.replace(temporary, path)
+        logger.debug("Checkpoint {} on {}", path, self.date)
 
-        self.simulation_result[self.date] = {
-            "cashflow": cashflow_results,
-            "net_worth": net_worth_results,
-        }
+    @classmethod
+    def _restore(cls, data, duration=None, trace=None):
+        snapshot = pickle.loads(data)
+        if snapshot.get("version") != CHECKPOINT_VERSION:
+            raise ValueError("The checkpoint was written by another version.")
+        engine = snapshot["engine"]
+        if not issubclass(engine, cls):
+            raise ValueError(f"The checkpoint is a {engine.__name__}.")
+        simulation = engine.__new__(engine)
+        vars(simulation).update(snapshot["state"])
+        simulation.trace = trace
+        if duration is not None:
+            done = 0 if simulation.result is None else simulation.result.months
+            if duration < done:
+                raise ValueError(
+                    f"The checkpoint is {done} months in, past the duration."
+                )
+            simulation.duration = duration
+            simulation._resume = duration - done
+        return simulation
 
-    def get_results_json(self):
-        return self.simulation_result
+    # Profiling
+    def start_profiling(self, profile):
+        if not profile:
+            self.metrics = None
+            return
+        if not isinstance(profile, SimulationMetrics):
+            profile = SimulationMetrics()
+        self.metrics = profile
+        self.cashflow.metrics = self.balance.metrics = profile
+        profile.start()
 
-    def get_results_dataframe(self, save_to_excel=False):
-        # Your JSON data
-        data = self.get_results_json()
+    def stop_profiling(self):
+        if self.metrics is None:
+            return
+        self.metrics.stop()
+        self.cashflow.metrics = self.balance.metrics = None
+        logger.info("Simulation profile:\n{}", self.metrics.report())
 
-        # Convert to DataFrame
-        cashflow_data = {}
-        net_worth_data = {}
+    def phase(self, name):
+        if self.metrics is None:
+            return _NOT_PROFILED
+        return self.metrics.phase(name)
 
-        for date, info in data.items():
-            cashflow_data[date] = info["cashflow"]
-            net_worth_data[date] = info["net_worth"]
+    def prepare_result(self, dates):
+        if self.result is None:
+            self.result = SimulationResult(
+                dates, self.cashflow.entities, self.balance.entities
+            )
+        else:
+            self.result.extend(dates)
 
-        cashflow_df = pd.DataFrame(cashflow_data).T
-        net_worth_df = pd.DataFrame(net_worth_data).T
+    def iter_months(self, raise_on_negative=True):
+        # Yields a MonthResult per month without keeping the results, so
+        # memory does not grow with the duration. Stop iterating to stop the
+        # simulation early.
+        key = date_key(self.date)
+        for _ in range(self.duration):
+            self.date = key_to_date(key)
+            month = self.simulate_month(raise_on_negative)
+            if self.trace is not None:
+                self.trace.record(
+                    self.date, month.cashflow_results, month.net_worth_results
+                )
+            yield month
+            key = add_months(key, 1)
+        self.date = key_to_date(key)
+        if self.trace is not None:
+            self.trace.flush()
 
-        # Convert index to datetime
-        cashflow_df.index.name = "Date"
-        net_worth_df.index.name = "Date"
+    def simulate_month(self, raise_on_negative=True):
+        with self.phase("events"):
+            self.fire_events()
+        with self.phase("cashflow"):
+            cashflow, cashflow_results = self.cashflow.calculate_monthly_cash_flow(
+                self.date
+            )
+        if self.allocation is not None:
+            with self.phase("bank_update"):
+                bank_balance = self.allocation.step(self.balance, self.date, cashflow)
+        else:
+            with self.phase("bank_update"):
+                self.balance.entities["Bank Account"].update(
+                    start_date=self.date, amount=cashflow
+                )
+            bank_balance = self.balance.entities["Bank Account"].amount
+        if bank_balance < 0 and raise_on_negative:
+            logger.error(
+                f"Bank Account has a negative balance. Date: {self.date}, Amount: {bank_balance}"
+            )
+            raise ValueError("Bank Account has a negative balance")
 
-        if save_to_excel:
-            # Save the DataFrames to an Excel files
-            cashflow_output_file = "results/cashflow_results.xlsx"
-            cashflow_df.to_excel(cashflow_output_file)
-            print(f"Results saved to {cashflow_output_file}")
+        with self.phase("net_worth"):
+            net_worth, net_worth_results = self.balance.calculate_net_worth(self.date)
+        return MonthResult(
+            self.date,
+            cashflow,
+            net_worth,
+            bank_balance,
+            cashflow_results,
+            net_worth_results,
+        )
+
+    def process_month(self):
+        if self.result is None or self.date not in self.result.month_index:
+            self.prepare_result([self.date])
+        month = self.simulate_month()
+
+        with self.phase("record"):
+            self.result.record(
+                self.date, month.cashflow_results, month.net_worth_results
+            )
+            if self.trace is not None:
+                self.trace.record(
+                    self.date, month.cashflow_results, month.net_worth_results
+                )
 
-            net_worth_output_file = "results/networth_results.xlsx"
-            net_worth_df.to_excel(net_worth_output_file)
-            print(f"Results saved to {net_worth_output_file}")
+    @property
+    def simulation_result(self):
+        return self.get_results_json()
+
+    def get_results_json(self):
+        if self.result is None:
+            return {}
+        return self.result.to_json()
+
+    def get_results_dataframe(self, save_to_excel=False):
+        with self.phase("export"):
+            cashflow_df, net_worth_df = self.build_results_dataframe()
+
+        if save_to_excel:
+            with self.phase("excel"):
+                ExcelWriter("results").write((cashflow_df, net_worth_df))
 
         return cashflow_df, net_worth_df
 
+    def save_results(self, writer: ResultWriter, partition=None):
+        with self.phase("export"):
+            return writer.write(self, partition)
+
+    def build_results_dataframe(self):
+        if self.result is None:
+            self.prepare_result([])
+        return self.result.to_dataframes()
+
     def plot_results(self):
+        # matplotlib is only imported when plotting
+        import matplotlib.pyplot as plt
+
         cashflow_df, net_worth_df = self.get_results_dataframe()
 
         cashflow_df["Total Cash Flow"] = cashflow_df.sum(axis=1)
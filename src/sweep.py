@@ -0,0 +1,133 @@
+import itertools
+import math
+import os
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+
+from src.balance import Balance
+from src.cashflow import CashFlow
+from src.vectorized import VectorizedSimulation
+from src.writers import ResultWriter
+
+
+def plan_from_entities(entities, assets_liabilities):
+    # Same wiring as main.py
+    cashflow = CashFlow()
+    for entity in entities + assets_liabilities:
+        cashflow.add_entity(entity)
+
+    balance = Balance()
+    for entity in assets_liabilities:
+        balance.add_entity(entity)
+    return cashflow, balance
+
+
+def _run_scenario(task):
+    scenario_id, plan, overrides, start_date, duration, engine = task
+    # The plan is built inside the worker, so every scenario gets its own
+    # entities and update() calls never leak between scenarios.
+    cashflow, balance = plan(**overrides)
+    simulation = engine(start_date, duration, cashflow, balance)
+    try:
+        simulation.run()
+    except ValueError as error:
+        return scenario_id, None, str(error)
+    cashflow_df, net_worth_df = simulation.build_results_dataframe()
+    return scenario_id, (cashflow_df, net_worth_df), None
+
+
+class ScenarioSweep:
+    # `plan` is a picklable function (defined at module level) taking the
+    # override keyword arguments and returning a fresh (CashFlow, Balance).
+    def __init__(
+        self,
+        plan: Callable[..., tuple],
+        scenarios: List[Dict[str, object]],
+        start_date: str,
+        duration: int,
+        engine=VectorizedSimulation,
+        max_workers: Optional[int] = None,
+        chunksize: Optional[int] = None,
+        writer: Optional[ResultWriter] = None,
+    ):
+        self.plan = plan
+        self.scenarios = list(scenarios)
+        self.start_date = start_date
+        self.duration = duration
+        self.engine = engine
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunksize = chunksize
+        # Optional writer receiving each scenario as a `scenario=<id>` partition
+        self.writer = writer
+        self.failures = {}
+
+    @staticmethod
+    def grid(**parameters):
+        # grid(rate=[5, 6], cashdown=[100_000, 200_000]) -> 4 scenarios
+        names = list(parameters)
+        return [
+            dict(zip(names, values))
+            for values in itertools.product(*parameters.values())
+        ]
+
+    def scenario_table(self):
+        import pandas as pd
+
+        df = pd.DataFrame(self.scenarios)
+        df.index.name = "scenario"
+        return df
+
+    def _tasks(self):
+        for scenario_id, overrides in enumerate(self.scenarios):
+            yield (
+                scenario_id,
+                self.plan,
+                overrides,
+                self.start_date,
+                self.duration,
+                self.engine,
+            )
+
+    def run(self):
+        if self.max_workers == 1:
+            outputs = map(_run_scenario, self._tasks())
+            return self._combine(outputs)
+
+        from concurrent.futures import ProcessPoolExecutor
+
+        chunksize = self.chunksize or max(
+            1, math.ceil(len(self.scenarios) / (self.max_workers * 4))
+        )
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            outputs = executor.map(_run_scenario, self._tasks(), chunksize=chunksize)
+            return self._combine(outputs)
+
+    def _combine(self, outputs):
+        # Long format: one row per (scenario, date, table, entity)
+        import pandas as pd
+
+        self.failures = {}
+        columns = {"scenario": [], "Date": [], "table": [], "entity": [], "value": []}
+        for scenario_id, frames, error in outputs:
+            if error is not None:
+                logger.warning(f"Scenario {scenario_id} failed: {error}")
+                self.failures[scenario_id] = error
+                continue
+            if self.writer is not None:
+                self.writer.write(frames, partition={"scenario": scenario_id})
+            for table, df in zip(("cashflow", "net_worth"), frames):
+                values = df.to_numpy(dtype=float)
+                size = values.size
+                columns["scenario"].append(np.full(size, scenario_id))
+                columns["Date"].append(np.repeat(df.index.to_numpy(), df.shape[1]))
+                columns["table"].append(np.full(size, table, dtype=object))
+                columns["entity"].append(np.tile(df.columns.to_numpy(), df.shape[0]))
+                columns["value"].append(values.ravel())
+
+        if not columns["value"]:
+            return pd.DataFrame(columns=list(columns))
+        return pd.DataFrame(
+            {name: np.concatenate(parts) for name, parts in columns.items()}
+        )
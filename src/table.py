@@ -0,0 +1,322 @@
+import datetime as dt
+
+import numpy as np
+
+from src.entity import Entity, Stock
+from src.growth import GROWTH_CACHE
+from src.utils import date_key, key_to_date, months_between_array
+
+# Entity types a table can hold, both grow as amount * (1 + r) ** months
+KINDS = {"Entity": 0, "Stock": 1}
+KIND_NAMES = {code: name for name, code in KINDS.items()}
+
+# Rows evaluated at once by the *_array methods
+CHUNK_ROWS = 1_024
+
+
+class EntityTable:
+    # Struct of arrays for plans with many line items: one typed NumPy column
+    # per field instead of one Python object per entity. The table is used
+    # like a single entity: add it to a CashFlow, a Balance or a RealEstate
+    # and its rows are summed under the table name. Rows are read and
+    # edited through EntityView, `parent` groups rows under a parent name
+    # (e.g. the RealEstate they belong to). Values match Entity and Stock
+    # objects with the same parameters.
+    #
+    # Trade-offs: only Entity and Stock rows (KINDS) can be stored, and the
+    # results hold one cashflow and one net worth column for the whole table,
+    # so the per-item columns of the outputs and writers are lost for the
+    # rows moved into it (per-item values are still available through
+    # EntityView.calculate_future_value or to_entities()). Tables are opt-in;
+    # the entity classes keep their __dict__ (the result cache and the
+    # incremental rerun read their parameters with vars()), and rows can not
+    # be made stochastic in MonteCarloSimulation.
+    follows_clock = False
+
+    def __init__(self, name, capacity=16):
+        self.name = name
+        self.names = []
+        self.parents = []
+        self.kind = np.empty(capacity, dtype=np.int8)
+        self.amount = np.empty(capacity, dtype=np.float64)
+        # annual_inflation_rate of an Entity, annual_expected_return of a Stock
+        self.annual_rate = np.empty(capacity, dtype=np.float64)
+        self.start = np.empty(capacity, dtype=np.int64)
+        self.end = np.empty(capacity, dtype=np.int64)
+        self.parent = np.empty(capacity, dtype=np.int32)
+        self.size = 0
+        # Bumped by every edit, used to detect changes
+        self.version = 0
+        self._cache = None
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, row):
+        if not -self.size <= row < self.size:
+            raise IndexError(f"Row {row} is out of range.")
+        return EntityView(self, row % self.size)
+
+    def __iter__(self):
+        return (EntityView(self, row) for row in range(self.size))
+
+    def _columns(self):
+        return ("kind", "amount", "annual_rate", "start", "end", "parent")
+
+    def _reserve(self, rows):
+        capacity = len(self.amount)
+        if self.size + rows <= capacity:
+            return
+        capacity = max(self.size + rows, 2 * capacity)
+        for column in self._columns():
+            values = getattr(self, column)
+            grown = np.empty(capacity, dtype=values.dtype)
+            grown[: self.size] = values[: self.size]
+            setattr(self, column, grown)
+
+    def _parent_index(self, parent):
+        if parent is None:
+            return -1
+        if parent not in self.parents:
+            self.parents.append(parent)
+        return self.parents.index(parent)
+
+    def touch(self):
+        self.version += 1
+        self._cache = None
+
+    def add(self, entity_type, name, amount, **kwargs):
+        # One row, same arguments as the Entity/Stock constructors
+        row = self.extend(entity_type, [name], [amount], **kwargs)[0]
+        return EntityView(self, row)
+
+    def extend(
+        self,
+        entity_type,
+        name,
+        amount,
+        annual_inflation_rate=None,
+        annual_expected_return=None,
+        start_date=None,
+        end_date=None,
+        parent=None,
+    ):
+        # Bulk load rows of one type with the Entity/Stock argument names.
+        # `name` is a sequence, every other argument a scalar or a sequence
+        # as long as `name`; dates are ISO strings or keys.
+        if entity_type not in KINDS:
+            raise ValueError(f"Entity type {entity_type} can not be stored in a table.")
+        annual_rate = (
+            annual_expected_return if entity_type == "Stock" else annual_inflation_rate
+        )
+        rows = len(name)
+        start = _keys(start_date, rows, date_key(dt.date.today().isoformat()))
+        end = _keys(end_date, rows, date_key("2999-12-31"))
+        if np.any(end < start):
+            raise ValueError("Some rows end before they start.")
+        amount = np.broadcast_to(np.asarray(amount, dtype=np.float64), (rows,))
+        if annual_rate is None:
+            annual_rate = 0
+        rate = np.broadcast_to(np.asarray(annual_rate, dtype=np.float64), (rows,))
+        if isinstance(parent, str) or parent is None:
+            parent = np.full(rows, self._parent_index(parent), dtype=np.int32)
+        else:
+            parent = np.array([self._parent_index(p) for p in parent], dtype=np.int32)
+
+        self._reserve(rows)
+        new = slice(self.size, self.size + rows)
+        self.kind[new] = KINDS[entity_type]
+        self.amount[new] = amount
+        self.annual_rate[new] = rate
+        self.start[new] = start
+        self.end[new] = end
+        self.parent[new] = parent
+        self.names.extend(name)
+        self.size += rows
+        self.touch()
+        return range(new.start, new.stop)
+
+    def subtable(self, parent, name=None):
+        # New table with the rows of one parent
+        rows = np.flatnonzero(self.parent[: self.size] == self.parents.index(parent))
+        table = EntityTable(name or parent, capacity=max(len(rows), 1))
+        for column in self._columns():
+            getattr(table, column)[: len(rows)] = getattr(self, column)[rows]
+        table.parent[: len(rows)] = table._parent_index(parent)
+        table.names = [self.names[row] for row in rows]
+        table.size = len(rows)
+        return table
+
+    def to_entities(self):
+        return [view.to_entity() for view in self]
+
+    # Date range of the rows, used by ActiveEntities
+    def _bounds(self):
+        if self._cache is None:
+            if self.size:
+                bounds = self.start[: self.size].min(), self.end[: self.size].max()
+            else:
+                bounds = date_key("2999-12-31"), date_key("2999-12-31")
+            self._cache = tuple(int(key) for key in bounds)
+        return self._cache
+
+    @property
+    def _start_key(self):
+        return self._bounds()[0]
+
+    @property
+    def _end_key(self):
+        return self._bounds()[1]
+
+    @property
+    def start_date(self):
+        return key_to_date(self._start_key)
+
+    @property
+    def end_date(self):
+        return key_to_date(self._end_key)
+
+    def is_active_on(self, date):
+        return self._start_key <= date_key(date) <= self._end_key
+
+    def _values(self, dates, rows):
+        return future_values(
+            self.amount[rows],
+            self.annual_rate[rows] / 1200,
+            self.start[rows],
+            self.end[rows],
+            dates,
+        )
+
+    def _total(self, dates, kinds):
+        dates = np.asarray(dates, dtype=np.int64)
+        total = np.zeros(len(dates))
+        rows = np.flatnonzero(np.isin(self.kind[: self.size], kinds))
+        for chunk in range(0, len(rows), CHUNK_ROWS):
+            last = chunk + CHUNK_ROWS
+            values = self._values(dates, rows[chunk:last])
+            total = total + values.sum(axis=0)
+        return total
+
+    def calculate_future_value(self, date):
+        return float(self._total([date_key(date)], list(KINDS.values()))[0])
+
+    def calculate_monthly_cash_flow(self, date):
+        # Stocks have no cash flow
+        return float(self._total([date_key(date)], [KINDS["Entity"]])[0])
+
+    def calculate_future_value_array(self, dates):
+        return self._total(dates, list(KINDS.values()))
+
+    def calculate_monthly_cash_flow_array(self, dates):
+        return self._total(dates, [KINDS["Entity"]])
+
+    def update(self, **kwargs):
+        raise ValueError(
+            f"Table {self.name} is edited row by row, e.g. table[0].amount = 100."
+        )
+
+
+class EntityView:
+    # One row of an EntityTable, reads and writes go to the table columns
+    __slots__ = ("table", "row")
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    def _set(self, column, value):
+        getattr(self.table, column)[self.row] = value
+        self.table.touch()
+
+    @property
+    def name(self):
+        return self.table.names[self.row]
+
+    @property
+    def entity_type(self):
+        return KIND_NAMES[int(self.table.kind[self.row])]
+
+    @property
+    def parent(self):
+        index = self.table.parent[self.row]
+        return None if index < 0 else self.table.parents[index]
+
+    @property
+    def amount(self):
+        return float(self.table.amount[self.row])
+
+    @amount.setter
+    def amount(self, value):
+        self._set("amount", value)
+
+    @property
+    def annual_rate(self):
+        return float(self.table.annual_rate[self.row])
+
+    @annual_rate.setter
+    def annual_rate(self, value):
+        self._set("annual_rate", value)
+
+    @property
+    def start_date(self):
+        return key_to_date(self.table.start[self.row])
+
+    @start_date.setter
+    def start_date(self, value):
+        self._set("start", date_key(value))
+
+    @property
+    def end_date(self):
+        return key_to_date(self.table.end[self.row])
+
+    @end_date.setter
+    def end_date(self, value):
+        self._set("end", date_key(value))
+
+    def calculate_future_value(self, date):
+        values = self.table._values(np.array([date_key(date)]), np.array([self.row]))
+        return float(values[0, 0])
+
+    def to_entity(self):
+        if self.entity_type == "Stock":
+            return Stock(
+                name=self.name,
+                amount=self.amount,
+                annual_expected_return=self.annual_rate,
+                start_date=self.start_date,
+                end_date=self.end_date,
+            )
+        return Entity(
+            name=self.name,
+            amount=self.amount,
+            annual_inflation_rate=self.annual_rate,
+            start_date=self.start_date,
+            end_date=self.end_date,
+        )
+
+
+def future_values(amount, monthly_rate, start, end, dates):
+    # (rows, dates) amount * (1 + monthly_rate) ** months since start, zero
+    # outside [start, end]. Same values as Entity.calculate_future_value_array.
+    start = start[:, None]
+    active = (start <= dates) & (dates <= end[:, None])
+    months = np.maximum(months_between_array(dates, start), 0)
+    rates, index = np.unique(monthly_rate, return_inverse=True)
+    longest = int(months.max()) if months.size else 0
+    growth = np.stack(
+        [GROWTH_CACHE.table(rate, longest)[: longest + 1] for rate in rates]
+    )
+    factors = growth[index.reshape(-1, 1), months]
+    return np.where(active, amount[:, None] * factors, 0.0)
+
+
+def _keys(dates, rows, default):
+    if dates is None:
+        return np.full(rows, default, dtype=np.int64)
+    if isinstance(dates, (str, int, np.integer)):
+        return np.full(rows, date_key(dates), dtype=np.int64)
+    return np.array(
+        [default if date is None else date_key(date) for date in dates],
+        dtype=np.int64,
+    )
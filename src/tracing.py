@@ -0,0 +1,40 @@
+import json
+import os
+
+
+def format_entity_values(results):
+    # Per-entity debug lines, only built when a DEBUG sink is listening
+    return "".join(f"\n{name:15} : ${value:,.0f}" for name, value in results.items())
+
+
+class TraceWriter:
+    # Structured per-month trace written as JSON lines. Records are buffered
+    # and written `batch_size` at a time, the file is overwritten on the first
+    # write.
+    def __init__(self, path, batch_size=120):
+        self.path = path
+        self.batch_size = batch_size
+        self._records = []
+        self._started = False
+
+    def record(self, date, cashflow_results, net_worth_results):
+        self._records.append(
+            {
+                "date": date,
+                "cashflow": {name: float(v) for name, v in cashflow_results.items()},
+                "net_worth": {name: float(v) for name, v in net_worth_results.items()},
+            }
+        )
+        if len(self._records) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._records and self._started:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a" if self._started else "w") as file:
+            file.writelines(json.dumps(record) + "\n" for record in self._records)
+        self._records = []
+        self._started = True
@@ -1,10 +1,104 @@
 import datetime as dt
+from functools import lru_cache
 
-from dateutil.relativedelta import relativedelta
+import numpy as np
+
+# Dates are handled internally as integer keys: month_ordinal * 32 + day, with
+# month_ordinal = year * 12 + (month - 1). Keys sort like the dates, and
+# month arithmetic is plain integer arithmetic. ISO strings are only used at
+# the API edges.
+DAYS_PER_MONTH = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+
+@lru_cache(maxsize=65536)
+def _parse_date(date: str):
+    date = dt.date.fromisoformat(date)
+    return (date.year * 12 + date.month - 1) * 32 + date.day
+
+
+def date_key(date):
+    if isinstance(date, (int, np.integer)):
+        return int(date)
+    if isinstance(date, dt.date):
+        date = date.isoformat()
+    return _parse_date(date)
+
+
+def key_to_date(key):
+    month_ordinal, day = divmod(int(key), 32)
+    year, month = divmod(month_ordinal, 12)
+    return f"{year:04d}-{month + 1:02d}-{day:02d}"
+
+
+def month_ordinal(date):
+    return date_key(date) // 32
+
+
+def days_in_month(month_ordinal):
+    year, month = divmod(month_ordinal, 12)
+    if month == 1 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
+        return 29
+    return int(DAYS_PER_MONTH[month])
+
+
+def days_in_month_array(month_ordinals):
+    year, month = np.divmod(month_ordinals, 12)
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    return DAYS_PER_MONTH[month] + ((month == 1) & leap)
+
+
+def months_between(key1, key2):
+    # Whole months from key2 to key1, like relativedelta(date1, date2)
+    # including its end-of-month clamping.
+    month1, day1 = divmod(key1, 32)
+    month2, day2 = divmod(key2, 32)
+    total_months = month1 - month2
+    if total_months > 0 and day1 < day2 and day1 < days_in_month(month1):
+        return total_months - 1
+    if total_months < 0 and day1 > day2:
+        return total_months + 1
+    return total_months
+
+
+def add_months(date, months):
+    # Key of date + relativedelta(months=months)
+    month, day = divmod(date_key(date), 32)
+    month += months
+    return month * 32 + min(day, days_in_month(month))
 
 
 def relativedelta_in_months(date1, date2):
-    difference = relativedelta(
-        dt.date.fromisoformat(date1), dt.date.fromisoformat(date2)
-    )
-    return difference.years * 12 + difference.months
+    return months_between(date_key(date1), date_key(date2))
+
+
+def relativedelta_in_months_array(dates, date2):
+    # `dates` is an int64 array of date keys
+    return months_between_array(dates, date_key(date2))
+
+
+def months_between_array(keys1, keys2):
+    # months_between for broadcasting arrays of keys
+    month1, day1 = np.divmod(keys1, 32)
+    month2, day2 = np.divmod(keys2, 32)
+    total_months = month1 - month2
+    clamped = (day1 < day2) & (day1 < days_in_month_array(month1))
+    total_months = total_months - ((total_months > 0) & clamped)
+    total_months = total_months + ((total_months < 0) & (day1 > day2))
+    return total_months
+
+
+def month_range_keys(start_date, duration):
+    # Keys visited by Simulation.run, stepping one month at a time. The day is
+    # clamped to the month length and the clamp carries over, like
+    # date + relativedelta(months=1).
+    month, day = divmod(date_key(start_date), 32)
+    keys = np.empty(duration, dtype=np.int64)
+    for index in range(duration):
+        day = min(day, days_in_month(month))
+        keys[index] = month * 32 + day
+        month += 1
+    return keys
+
+
+def month_range(start_date, duration):
+    return [key_to_date(key) for key in month_range_keys(start_date, duration)]
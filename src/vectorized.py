@@ -0,0 +1,419 @@
+from typing import Optional
+
+import numpy as np
+from loguru import logger
+
+from src.balance import Balance
+from src.cashflow import CashFlow
+from src.result import MonthResult, SimulationResult
+from src.simulation import Simulation
+from src.tracing import TraceWriter
+from src.utils import add_months, date_key, key_to_date, month_range_keys
+
+
+# Evaluates every entity once over the whole month grid instead of month by
+# month. Produces the same tables as Simulation. Without scheduled events the
+# entities are not mutated, so the same plan can be run many times.
+class VectorizedSimulation(Simulation):
+    def __init__(
+        self,
+        start_date,
+        duration,
+        cashflow: CashFlow,
+        balance: Balance,
+        trace: Optional[TraceWriter] = None,
+    ):
+        super().__init__(start_date, duration, cashflow, balance, trace)
+
+    def run(self, incremental=True, profile=False):
+        # After editing entities (e.g. with update()), running again only
+        # recomputes the entities that changed and the bank account carry
+        # from the first month whose cashflow moved.
+        self.start_profiling(profile)
+        try:
+            if incremental and self._can_rerun():
+                self._rerun()
+            else:
+                self._run()
+        finally:
+            self.stop_profiling()
+
+    def _run(self):
+        keys = month_range_keys(self.start_date, self.duration + 1)
+        iso_dates = [key_to_date(key) for key in keys[:-1]]
+        has_events = len(self.events) > 0
+        self._state = None
+        # A resumed checkpoint continues after the months in its result, the
+        # bank account carrying on from its last balance
+        resumed = self._resume is not None and self.result is not None
+        self._resume = None
+        start, opening_balance, previous_key = 0, None, None
+        if resumed and self.result.months:
+            start = self.result.months
+            opening_balance = self._result_carry(self.result)
+            previous_key = keys[start - 1]
+            self.result.extend(iso_dates[start:])
+        else:
+            resumed = False
+            self.result = None
+        checkpointed = start
+        chunk_months = None if self.checkpoint_path is None else self.checkpoint_every
+        cashflow_total, bank_total = [], []
+        segments = self._segments(
+            keys[start],
+            self.duration - start,
+            chunk_months,
+            opening_balance,
+            previous_key,
+        )
+        for segment in segments:
+            (
+                segment_keys,
+                cashflow_results,
+                net_worth_results,
+                cashflow,
+                bank_balance,
+            ) = segment
+            negative = np.flatnonzero(bank_balance < 0)
+            if negative.size:
+                month = start + negative[0]
+                self._negative_bank_balance(iso_dates[month], bank_balance[negative[0]])
+            if self.result is None:
+                self.result = SimulationResult(
+                    iso_dates, cashflow_results, net_worth_results
+                )
+            with self.phase("record"):
+                self.result.record_block(start, cashflow_results, net_worth_results)
+            cashflow_total.append(cashflow)
+            bank_total.append(bank_balance)
+            start += len(segment_keys)
+            if self._checkpoint_due(start - checkpointed, self.duration - start):
+                # Events of the next month fire after the checkpoint
+                self.date = iso_dates[start]
+                self._write_checkpoint(self.checkpoint_path, self.duration - start)
+                checkpointed = start
+        if self.result is None:
+            self.prepare_result([])
+        self.date = key_to_date(keys[-1])
+
+        # Allocations are evaluated as a whole, they are not rerun incrementally
+        rerunnable = not has_events and self.allocation is None
+        if rerunnable and self.duration and not resumed:
+            self._state = {
+                "keys": keys[:-1],
+                "cashflow": np.concatenate(cashflow_total),
+                "bank_balance": np.concatenate(bank_total),
+                "structure": self._structure(),
+                "fingerprints": self._fingerprints(),
+            }
+
+        if self.trace is not None:
+            for date, results in self.get_results_json().items():
+                self.trace.record(date, results["cashflow"], results["net_worth"])
+            self.trace.flush()
+
+    def run_from(self, result: SimulationResult, profile=False):
+        # Continues `result`, the first months of this same plan (e.g. a
+        # shorter run), and only evaluates the months after it. The bank
+        # account carries on from its last balance, so values are identical
+        # to a full run.
+        self.start_profiling(profile)
+        try:
+            return self._run_from(result)
+        finally:
+            self.stop_profiling()
+
+    def _run_from(self, result):
+        if len(self.events):
+            raise ValueError("Simulations with events can not be continued.")
+        keys = month_range_keys(self.start_date, self.duration + 1)
+        iso_dates = [key_to_date(key) for key in keys[:-1]]
+        months = result.months
+        if months > self.duration or result.dates[:months] != iso_dates[:months]:
+            raise ValueError("The result does not cover the start of this run.")
+
+        self._state = None
+        self.result = SimulationResult(
+            iso_dates, result.names["cashflow"], result.names["net_worth"]
+        )
+        for table, values in result.values.items():
+            self.result.values[table][:months] = values[:months]
+        self.result.months = months
+        if months < self.duration:
+            opening_balance = None
+            if months:
+                opening_balance = self._result_carry(result)
+            (
+                cashflow_results,
+                net_worth_results,
+                _,
+                bank_balance,
+            ) = self._evaluate(keys[months:-1], opening_balance)
+            negative = np.flatnonzero(bank_balance < 0)
+            if negative.size:
+                self._negative_bank_balance(
+                    iso_dates[months + negative[0]], bank_balance[negative[0]]
+                )
+            self.result.record_block(months, cashflow_results, net_worth_results)
+        self.result.months = self.duration
+        self.date = key_to_date(keys[-1])
+        return self.result
+
+    # Incremental re-run
+    def _top_level(self):
+        return list(self.cashflow.entities.values()) + list(
+            self.balance.entities.values()
+        )
+
+    def _structure(self):
+        # Which entity objects make up the plan, nested ones included
+        return (
+            self.start_date,
+            self.duration,
+            tuple((name, id(e)) for name, e in self.cashflow.entities.items()),
+            tuple((name, id(e)) for name, e in self.balance.entities.items()),
+            tuple(id(e) for e in nested_entities(self._top_level())),
+        )
+
+    def _fingerprints(self):
+        return {
+            id(e): entity_fingerprint(e) for e in nested_entities(self._top_level())
+        }
+
+    def _can_rerun(self):
+        state = getattr(self, "_state", None)
+        return (
+            state is not None
+            and self.result is not None
+            and len(self.events) == 0
+            and self.allocation is None
+            and state["structure"] == self._structure()
+        )
+
+    def _rerun(self):
+        state = self._state
+        keys = state["keys"]
+        fingerprints = self._fingerprints()
+        changed = {
+            key
+            for key, value in fingerprints.items()
+            if state["fingerprints"][key] != value
+        }
+        if not changed:
+            return
+
+        # A top-level entity depends on itself and, for RealEstate, on its
+        # loan and acquisition entities
+        bank_account = self.balance.entities["Bank Account"]
+        result = self.result.copy()
+        for table, entities in (
+            ("cashflow", self.cashflow.entities),
+            ("net_worth", self.balance.entities),
+        ):
+            for name, entity in entities.items():
+                if not changed.intersection(map(id, nested_entities([entity]))):
+                    continue
+                if table == "cashflow":
+                    values = entity.calculate_monthly_cash_flow_array(keys)
+                elif entity is bank_account:
+                    continue
+                else:
+                    values = entity.calculate_future_value_array(keys)
+                result.values[table][:, result.entity_index[table][name]] = values
+
+        # Same summation order as _evaluate, so totals stay bit identical
+        cashflow = np.zeros(len(keys))
+        for column in result.values["cashflow"].T:
+            cashflow = cashflow + column
+
+        if id(bank_account) in changed:
+            first = 0
+        else:
+            moved = np.flatnonzero(cashflow != state["cashflow"])
+            first = moved[0] if moved.size else len(keys)
+        bank_balance = state["bank_balance"].copy()
+        if first < len(keys):
+            carry = cashflow[first:].copy()
+            if first == 0:
+                carry[0] += bank_account.calculate_future_value(keys[0])
+            else:
+                carry[0] += bank_balance[first - 1]
+            bank_balance[first:] = np.cumsum(carry)
+
+        negative = np.flatnonzero(bank_balance < 0)
+        if negative.size:
+            self._negative_bank_balance(
+                key_to_date(keys[negative[0]]), bank_balance[negative[0]]
+            )
+        column = result.entity_index["net_worth"][bank_account.name]
+        result.values["net_worth"][:, column] = bank_balance
+
+        self.result = result
+        state["cashflow"] = cashflow
+        state["bank_balance"] = bank_balance
+        state["fingerprints"] = fingerprints
+        logger.debug(
+            "Incremental run: {} changed entities, bank account from month {}",
+            len(changed),
+            first,
+        )
+
+    def iter_months(self, raise_on_negative=True, chunk_months=120):
+        # Evaluates `chunk_months` months at a time and yields them one by one
+        key = date_key(self.date)
+        for segment in self._segments(key, self.duration, chunk_months):
+            keys, cashflow_results, net_worth_results, cashflow, bank_balance = segment
+            net_worth = np.zeros(len(keys))
+            for values in net_worth_results.values():
+                net_worth = net_worth + values
+            for month in range(len(keys)):
+                self.date = key_to_date(keys[month])
+                if bank_balance[month] < 0 and raise_on_negative:
+                    self._negative_bank_balance(self.date, bank_balance[month])
+                yield MonthResult(
+                    self.date,
+                    cashflow[month],
+                    net_worth[month],
+                    bank_balance[month],
+                    {name: v[month] for name, v in cashflow_results.items()},
+                    {name: v[month] for name, v in net_worth_results.items()},
+                )
+            key = add_months(keys[-1], 1)
+        self.date = key_to_date(key)
+
+    def _segments(
+        self,
+        key,
+        duration,
+        chunk_months=None,
+        opening_balance=None,
+        previous_key=None,
+    ):
+        # Splits the horizon into runs of months without events, at most
+        # `chunk_months` long. The bank account carry continues from one
+        # segment to the next. Before the events of a month fire, the bank
+        # account is brought to the state the month-by-month engine would
+        # have left it in, then the events mutate the entities as they do
+        # in Simulation. `opening_balance` is the bank account balance at
+        # `previous_key` when continuing a run (the cash account values of
+        # the next month with an allocation, see _carry).
+        remaining = duration
+        while remaining:
+            self.date = key_to_date(key)
+            if self.events.next_key() is not None and self.events.next_key() <= key:
+                if previous_key is not None and self.allocation is not None:
+                    self.allocation.sync(self.balance, opening_balance, self.date)
+                elif previous_key is not None:
+                    self.balance.entities["Bank Account"].set_balance(
+                        opening_balance, key_to_date(previous_key)
+                    )
+                with self.phase("events"):
+                    self.fire_events()
+                opening_balance = None
+
+            months = remaining if chunk_months is None else min(chunk_months, remaining)
+            keys = month_range_keys(key, months + 1)
+            next_event = self.events.next_key()
+            if next_event is not None:
+                months = min(months, int(np.searchsorted(keys[:-1], next_event)))
+                keys = keys[: months + 1]
+
+            (
+                cashflow_results,
+                net_worth_results,
+                cashflow,
+                bank_balance,
+            ) = self._evaluate(keys[:-1], opening_balance)
+            yield keys[:-1], cashflow_results, net_worth_results, cashflow, bank_balance
+
+            key = keys[-1]
+            previous_key = keys[-2]
+            remaining -= months
+            opening_balance = self._carry(net_worth_results, bank_balance, previous_key)
+
+    def _carry(self, net_worth_results, bank_balance, last_key):
+        # Opening balance of the month after `last_key`: the bank account
+        # balance, or every cash account grown one month (see CashAllocation)
+        if self.allocation is None:
+            return bank_balance[-1]
+        return self.allocation.carry(
+            self.balance, net_worth_results, key_to_date(last_key)
+        )
+
+    def _result_carry(self, result):
+        columns = {
+            name: result.column("net_worth", name) for name in result.names["net_worth"]
+        }
+        last_key = date_key(result.dates[result.months - 1])
+        return self._carry(columns, columns.get("Bank Account"), last_key)
+
+    def _call_entity(self, table, entity, method, dates):
+        if self.metrics is None:
+            return method(dates)
+        return self.metrics.call_entity(table, entity, method, dates)
+
+    def _negative_bank_balance(self, date, amount):
+        logger.error(
+            f"Bank Account has a negative balance. Date: {date}, Amount: {amount}"
+        )
+        raise ValueError("Bank Account has a negative balance")
+
+    def _evaluate(self, dates, opening_balance=None):
+        # Cashflow
+        with self.phase("cashflow"):
+            cashflow = np.zeros(len(dates))
+            cashflow_results = {}
+            for entity in self.cashflow.entities.values():
+                entity_cashflow = self._call_entity(
+                    "cashflow", entity, entity.calculate_monthly_cash_flow_array, dates
+                )
+                cashflow_results[entity.name] = entity_cashflow
+                cashflow = cashflow + entity_cashflow
+
+        # Bank account carry: B[0] = fv(start) + cf[0], B[t] = B[t-1] + cf[t]
+        bank_account = self.balance.entities.get("Bank Account")
+        accounts = {}
+        with self.phase("bank_update"):
+            if self.allocation is not None:
+                accounts, bank_balance = self.allocation.evaluate(
+                    self.balance, dates, cashflow, opening_balance
+                )
+            else:
+                carry = cashflow.copy()
+                if len(dates):
+                    if opening_balance is None:
+                        opening_balance = bank_account.calculate_future_value(dates[0])
+                    carry[0] = opening_balance + cashflow[0]
+                bank_balance = np.cumsum(carry)
+
+        # Net worth
+        with self.phase("net_worth"):
+            net_worth_results = {}
+            for entity in self.balance.entities.values():
+                if entity.name in accounts:
+                    net_worth_results[entity.name] = accounts[entity.name]
+                elif entity is bank_account and self.allocation is None:
+                    net_worth_results[entity.name] = bank_balance
+                else:
+                    net_worth_results[entity.name] = self._call_entity(
+                        "net_worth", entity, entity.calculate_future_value_array, dates
+                    )
+        return cashflow_results, net_worth_results, cashflow, bank_balance
+
+
+def nested_entities(entities):
+    # Entities and everything nested in them (RealEstate loan and children)
+    stack = list(entities)
+    while stack:
+        entity = stack.pop()
+        yield entity
+        stack.extend(getattr(entity, "entities", {}).values())
+
+
+def entity_fingerprint(entity):
+    # Scalar parameters of an entity, compared to detect edits
+    return tuple(
+        (name, value)
+        for name, value in vars(entity).items()
+        if value is None or isinstance(value, (int, float, str))
+    )
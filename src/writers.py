@@ -0,0 +1,149 @@
+import os
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+
+import numpy as np
+from loguru import logger
+
+from src.result import SimulationResult
+
+# File names of the two result tables
+TABLE_NAMES = {"cashflow": "cashflow_results", "net_worth": "networth_results"}
+
+# File suffix of each CSV compression
+_SUFFIXES = {"gzip": "gz", "bz2": "bz2", "zip": "zip", "xz": "xz", "zstd": "zst"}
+
+
+class ResultWriter(ABC):
+    # Writes result tables under `directory`. Without a partition a table is a
+    # single file, e.g. results/cashflow_results.parquet. With a partition
+    # such as {"scenario": 3} it becomes one file of a hive-style dataset,
+    # e.g. results/cashflow_results/scenario=3/part-0.parquet, so many
+    # scenarios or Monte Carlo batches can be appended to the same dataset.
+    extension = ""
+
+    def __init__(self, directory="results"):
+        self.directory = directory
+
+    def path(self, table, partition: Optional[Dict[str, object]] = None):
+        if not partition:
+            return os.path.join(self.directory, f"{table}{self.extension}")
+        parts = [f"{key}={value}" for key, value in partition.items()]
+        return os.path.join(self.directory, table, *parts, f"part-0{self.extension}")
+
+    def write_table(self, table, df, partition=None):
+        path = self.path(table, partition)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._write(df, path)
+        logger.info("Results saved to {}", path)
+        return path
+
+    def write(self, results, partition=None):
+        # `results` is a Simulation, a SimulationResult or a
+        # (cashflow_df, net_worth_df) pair
+        if hasattr(results, "build_results_dataframe"):
+            results = results.build_results_dataframe()
+        elif isinstance(results, SimulationResult):
+            results = results.to_dataframes()
+        cashflow_df, net_worth_df = results
+        return [
+            self.write_table(TABLE_NAMES["cashflow"], cashflow_df, partition),
+            self.write_table(TABLE_NAMES["net_worth"], net_worth_df, partition),
+        ]
+
+    @abstractmethod
+    def _write(self, df, path):
+        pass
+
+
+class ParquetWriter(ResultWriter):
+    extension = ".parquet"
+
+    def __init__(self, directory="results", compression="snappy"):
+        super().__init__(directory)
+        self.compression = compression
+
+    def _write(self, df, path):
+        df.to_parquet(path, compression=self.compression)
+
+
+class FeatherWriter(ResultWriter):
+    extension = ".feather"
+
+    def _write(self, df, path):
+        # Feather needs a default index
+        df.reset_index().to_feather(path)
+
+
+class CSVWriter(ResultWriter):
+    def __init__(self, directory="results", compression="gzip"):
+        super().__init__(directory)
+        self.compression = compression
+        self.extension = (
+            ".csv" if compression is None else f".csv.{_SUFFIXES[compression]}"
+        )
+
+    def _write(self, df, path):
+        df.to_csv(path, compression=self.compression)
+
+
+class ExcelWriter(ResultWriter):
+    extension = ".xlsx"
+
+    def _write(self, df, path):
+        df.to_excel(path)
+
+
+class NumpyWriter(ResultWriter):
+    # One .npz archive per table with `dates`, `names` and the (months,
+    # entities) `values` array. Written straight from the result arrays,
+    # without pandas.
+    extension = ".npz"
+
+    def __init__(self, directory="results", compressed=False):
+        super().__init__(directory)
+        self.compressed = compressed
+
+    def write(self, results, partition=None):
+        if hasattr(results, "build_results_dataframe"):
+            if results.result is None:
+                results.prepare_result([])
+            results = results.result
+        if isinstance(results, SimulationResult):
+            dates = results.dates[: results.months]
+            tables = {
+                table: (dates, results.names[table], values)
+                for table, values in (
+                    ("cashflow", results.cashflow),
+                    ("net_worth", results.net_worth),
+                )
+            }
+        else:
+            tables = {
+                table: (list(df.index), list(df.columns), df.to_numpy())
+                for table, df in zip(TABLE_NAMES, results)
+            }
+        return [
+            self.write_table(TABLE_NAMES[table], arrays, partition)
+            for table, arrays in tables.items()
+        ]
+
+    def _write(self, arrays, path):
+        dates, names, values = arrays
+        save = np.savez_compressed if self.compressed else np.savez
+        save(path, dates=np.array(dates), names=np.array(names), values=values)
+
+
+def create_writer(format, directory="results", **kwargs):
+    if format == "parquet":
+        return ParquetWriter(directory, **kwargs)
+    elif format == "feather":
+        return FeatherWriter(directory, **kwargs)
+    elif format == "csv":
+        return CSVWriter(directory, **kwargs)
+    elif format == "excel":
+        return ExcelWriter(directory, **kwargs)
+    elif format == "npz":
+        return NumpyWriter(directory, **kwargs)
+    else:
+        raise ValueError(f"Result format {format} is not supported.")
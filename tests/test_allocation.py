@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+import pytest
+
+from src.allocation import CashAllocation
+from src.entity import BankAccount, Entity, Stock
+from src.events import FinancialEvent, SellStock
+from src.plan import load_plan
+from src.simulation import Simulation
+from src.sweep import plan_from_entities
+from src.vectorized import VectorizedSimulation
+
+PLAN = os.path.join(os.path.dirname(__file__), "..", "plans", "example.yaml")
+START = "2023-10-01"
+
+
+@pytest.mark.parametrize("engine", [Simulation, VectorizedSimulation])
+def test_bank_account_alone_matches_no_allocation(engine):
+    # Plans share their entities, each run loads its own
+    default = load_plan(PLAN).simulation(engine=engine)
+    default.run()
+    allocated = load_plan(PLAN).simulation(engine=engine)
+    allocated.set_allocation(CashAllocation(["Bank Account"], ["Bank Account"]))
+    allocated.run()
+
+    assert allocated.result.names == default.result.names
+    for table in ("cashflow", "net_worth"):
+        np.testing.assert_array_equal(
+            getattr(allocated.result, table), getattr(default.result, table)
+        )
+
+
+def savings_simulation(engine, events=()):
+    # Salary beyond the Bank Account cap goes to a savings account at 3%
+    entities = [Entity(name="Salary", amount=2_000, start_date=START)]
+    assets = [
+        BankAccount(name="Bank Account", amount=1_000, start_date=START),
+        BankAccount(
+            name="Savings", amount=50_000, annual_inflation_rate=3, start_date=START
+        ),
+        Stock(name="ETF", amount=20_000, annual_expected_return=6, start_date=START),
+    ]
+    simulation = engine(START, 24, *plan_from_entities(entities, assets))
+    simulation.set_allocation(
+        CashAllocation([("Bank Account", 5_000), "Savings"], ["Bank Account"])
+    )
+    for event in events:
+        simulation.schedule_event(event)
+    simulation.run()
+    return simulation.result
+
+
+def account(result, name):
+    return result.column("net_worth", name)
+
+
+@pytest.mark.parametrize("engine", [Simulation, VectorizedSimulation])
+def test_savings_keep_earning_their_rate(engine):
+    result = savings_simulation(engine)
+
+    # The first two salaries fill the Bank Account to its cap, the next ones
+    # go to the savings, which grow 0.25% a month
+    expected = [50_000.0]
+    for month in range(1, 24):
+        deposit = 2_000 if month > 1 else 0
+        expected.append(expected[-1] * 1.0025 + deposit)
+    np.testing.assert_allclose(account(result, "Savings"), expected, rtol=1e-12)
+    np.testing.assert_allclose(account(result, "Bank Account")[1:], 5_000)
+
+
+@pytest.mark.parametrize("engine", [Simulation, VectorizedSimulation])
+def test_event_cash_goes_through_the_allocation(engine):
+    sale = FinancialEvent("Sale", "2024-06-01", SellStock("ETF", 10_000))
+    base = savings_simulation(engine)
+    sold = savings_simulation(engine, [sale])
+
+    # The Bank Account is full, the proceeds go to the savings
+    month = sold.month_index["2024-06-01"]
+    np.testing.assert_allclose(
+        account(sold, "Bank Account"), account(base, "Bank Account")
+    )
+    np.testing.assert_allclose(
+        account(sold, "Savings")[month:] - account(base, "Savings")[month:],
+        10_000 * 1.0025 ** np.arange(24 - month),
+    )
+
+
+def test_engines_agree_with_events_and_growing_accounts():
+    sale = FinancialEvent("Sale", "2024-06-01", SellStock("ETF", 10_000))
+    loop = savings_simulation(Simulation, [sale])
+    vectorized = savings_simulation(VectorizedSimulation, [sale])
+
+    for table in ("cashflow", "net_worth"):
+        np.testing.assert_allclose(
+            getattr(vectorized, table), getattr(loop, table), rtol=1e-12
+        )
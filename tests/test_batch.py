@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from src.batch import BatchRunner, evaluate_plans
+from src.plan import plan_from_dict
+from src.writers import ParquetWriter
+
+PLAN = os.path.join(os.path.dirname(__file__), "..", "plans", "example.yaml")
+
+
+def multi_account_plan():
+    # The example plan with a savings account earning interest and a
+    # BankAccount in the budget, next to the carried "Bank Account"
+    with open(PLAN) as file:
+        data = yaml.safe_load(file)
+    data["assets_liabilities"].insert(
+        1,
+        {
+            "type": "BankAccount",
+            "name": "Savings",
+            "amount": 100_000,
+            "annual_inflation_rate": 3,
+            "start_date": "2023-10-01",
+        },
+    )
+    data["entities"].append(
+        {
+            "type": "BankAccount",
+            "name": "Wallet",
+            "amount": 500,
+            "start_date": "2023-10-01",
+        }
+    )
+    return data
+
+
+def vectorized_totals(data):
+    simulation = plan_from_dict(data).simulation()
+    simulation.run()
+    result = simulation.result
+    return result.cashflow.sum(axis=1), result.net_worth.sum(axis=1)
+
+
+def test_batch_matches_vectorized_with_several_bank_accounts():
+    data = multi_account_plan()
+    cashflow, net_worth = vectorized_totals(data)
+
+    results, failures = evaluate_plans([("plan", data)])
+
+    assert failures == {}
+    np.testing.assert_allclose(results[0].cashflow[0], cashflow, rtol=1e-12)
+    np.testing.assert_allclose(results[0].net_worth[0], net_worth, rtol=1e-12)
+
+
+def test_batch_runner_writes_the_vectorized_totals(tmp_path):
+    data = multi_account_plan()
+    cashflow, net_worth = vectorized_totals(data)
+
+    runner = BatchRunner(
+        {"plan": data}, writer=ParquetWriter(str(tmp_path)), max_workers=1
+    )
+    (path,) = runner.run()
+
+    assert runner.failures == {}
+    df = pd.read_parquet(path)
+    np.testing.assert_allclose(df["cashflow"], cashflow, rtol=1e-12)
+    np.testing.assert_allclose(df["net_worth"], net_worth, rtol=1e-12)
@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+
+from src.cache import ResultCache
+from src.plan import load_plan
+
+PLAN = os.path.join(os.path.dirname(__file__), "..", "plans", "example.yaml")
+
+
+def run(cache, months):
+    simulation = load_plan(PLAN, duration=months).simulation()
+    return simulation, cache.run(simulation)
+
+
+def fresh(months):
+    simulation = load_plan(PLAN, duration=months).simulation()
+    simulation.run()
+    return simulation
+
+
+def assert_same_results(actual, expected):
+    assert actual.names == expected.names
+    assert actual.dates[: actual.months] == expected.dates[: expected.months]
+    for table in ("cashflow", "net_worth"):
+        np.testing.assert_array_equal(getattr(actual, table), getattr(expected, table))
+
+
+def test_cache_hits_reproduce_the_run(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    run(cache, 120)
+
+    simulation, result = run(cache, 120)
+    shorter, shorter_result = run(cache, 60)
+
+    assert cache.stats()["hits"] == 2
+    for served, served_result, expected in (
+        (simulation, result, fresh(120)),
+        (shorter, shorter_result, fresh(60)),
+    ):
+        assert_same_results(served_result, expected.result)
+        assert served.date == expected.date
+
+
+def test_partial_hits_extend_the_stored_run(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    run(cache, 60)
+
+    _, result = run(cache, 120)
+
+    assert cache.stats()["partial_hits"] == 1
+    expected = fresh(120).result
+    np.testing.assert_allclose(result.cashflow, expected.cashflow, rtol=1e-12)
+    np.testing.assert_allclose(result.net_worth, expected.net_worth, rtol=1e-12)
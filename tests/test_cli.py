@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+import pytest
+
+from src.cache import plan_key
+from src.cli import main
+from src.plan import load_plan
+
+PLAN = os.path.join(os.path.dirname(__file__), "..", "plans", "example.yaml")
+
+
+def interrupted_run(path, months):
+    # A checkpoint of a `run PLAN --months months` interrupted 12 months
+    # before its end, with the key the command gives it
+    simulation = load_plan(PLAN, duration=months).simulation()
+    simulation.auto_checkpoint(
+        path, 12, f"{plan_key(simulation)}:{simulation.duration}"
+    )
+    simulation.run()
+    return simulation.result
+
+
+def load_results(directory):
+    return {
+        name: np.load(os.path.join(directory, name))["values"]
+        for name in sorted(os.listdir(directory))
+    }
+
+
+def test_run_resumes_its_own_checkpoint(tmp_path):
+    checkpoint = str(tmp_path / "run.ckpt")
+    result = interrupted_run(checkpoint, 36)
+
+    out = str(tmp_path / "resumed")
+    main(["run", PLAN, "--months", "36", "--checkpoint", checkpoint, "--out", out])
+
+    assert not os.path.exists(checkpoint)
+    cashflow, net_worth = load_results(out).values()
+    np.testing.assert_allclose(cashflow, result.cashflow)
+    np.testing.assert_allclose(net_worth, result.net_worth)
+
+
+@pytest.mark.parametrize(
+    "arguments",
+    [
+        ["--months", "48"],
+        ["--months", "36", "--engine", "loop"],
+        ["--months", "36", "--start-date", "2024-01-01"],
+    ],
+)
+def test_run_refuses_the_checkpoint_of_another_run(tmp_path, arguments):
+    checkpoint = str(tmp_path / "run.ckpt")
+    interrupted_run(checkpoint, 36)
+
+    with pytest.raises(SystemExit, match="another plan or settings"):
+        main(["run", PLAN, "--checkpoint", checkpoint, *arguments])
+
+    assert os.path.exists(checkpoint)
@@ -0,0 +1,82 @@
+import pytest
+
+from src.entity import BankAccount, Entity, Loan, RealEstate
+from src.goalseek import GoalSeek
+from src.sweep import plan_from_entities
+from src.vectorized import VectorizedSimulation
+
+START = "2023-10-01"
+
+
+def house_plan(rate=5.0, cashdown=200_000):
+    house = RealEstate(
+        name="House",
+        amount=800_000,
+        cashdown=cashdown,
+        annual_expected_return=4,
+        acquisition_entities=[
+            Entity(name="Cashdown", amount=-cashdown, start_date=START, end_date=START),
+            Entity(
+                name="Taxes", amount=-450, annual_inflation_rate=4, start_date=START
+            ),
+        ],
+        loan=Loan(
+            name="House Loan",
+            amount=800_000 - cashdown,
+            annual_interest_rate=rate,
+            term_in_year=25,
+            start_date=START,
+        ),
+        start_date=START,
+    )
+    entities = [
+        Entity(name="Salary", amount=8_000, annual_inflation_rate=3, start_date=START),
+        Entity(name="Food", amount=-2_000, annual_inflation_rate=4, start_date=START),
+    ]
+    bank = BankAccount(name="Bank Account", amount=250_000, start_date=START)
+    return plan_from_entities(entities, [bank, house])
+
+
+def threshold_plan(spending=1.0):
+    # Not affine in `spending`: a penalty between 10.7 and 12, where the
+    # probes of the first batch do not see it
+    penalty = -5_000 if 10.7 <= spending <= 12 else 0
+    entities = [
+        Entity(name="Salary", amount=10_000, start_date=START),
+        Entity(name="Spending", amount=-1_000 * spending, start_date=START),
+        Entity(name="Penalty", amount=penalty, start_date=START),
+    ]
+    bank = BankAccount(name="Bank Account", amount=100_000, start_date=START)
+    return plan_from_entities(entities, [bank])
+
+
+def solvent(plan, duration, **overrides):
+    simulation = VectorizedSimulation(START, duration, *plan(**overrides))
+    try:
+        simulation.run()
+    except ValueError:
+        return False
+    return True
+
+
+def test_affine_parameters_are_solved_with_the_batched_candidates():
+    seek = GoalSeek(house_plan, START, 360)
+
+    result = seek.solve("rate", 1.0, 15.0)
+
+    assert seek.evaluator._maps["rate"] is not None
+    assert solvent(house_plan, 360, rate=result.value)
+    assert not solvent(house_plan, 360, rate=result.value + 1e-6)
+    simulated = result.simulation.result
+    bank = simulated.net_worth[:, simulated.entity_index["net_worth"]["Bank Account"]]
+    assert result.objective == pytest.approx(bank.min(), abs=1e-6)
+
+
+def test_plans_that_are_not_affine_are_searched_again_per_variant():
+    seek = GoalSeek(threshold_plan, START, 120)
+
+    result = seek.solve("spending", 0.0, 20.0)
+
+    assert result.value == pytest.approx(10.7, abs=1e-6)
+    assert solvent(threshold_plan, 120, spending=result.value)
+    assert not solvent(threshold_plan, 120, spending=10.7)
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+from src.entity import BankAccount, Entity, Loan, RealEstate
+from src.montecarlo import Constant, MonteCarloSimulation
+from src.sweep import plan_from_entities
+from src.vectorized import VectorizedSimulation
+
+START = "2023-10-01"
+MONTHS = 120
+
+
+def plan(loan_rate=5.0, loan_start="2024-03-01"):
+    loan = Loan(
+        name="Loan",
+        amount=300_000,
+        annual_interest_rate=loan_rate,
+        term_in_year=25,
+        start_date=loan_start,
+    )
+    house = RealEstate(
+        name="House",
+        amount=400_000,
+        cashdown=100_000,
+        annual_expected_return=3,
+        acquisition_entities=[
+            Entity(
+                name="Taxes",
+                amount=-300,
+                annual_inflation_rate=2,
+                start_date=loan_start,
+            )
+        ],
+        loan=loan,
+        start_date=loan_start,
+    )
+    return plan_from_entities(
+        [
+            Entity(
+                name="Salary", amount=9_000, annual_inflation_rate=2, start_date=START
+            )
+        ],
+        [
+            BankAccount(name="Bank Account", amount=50_000, start_date=START),
+            BankAccount(
+                name="Savings", amount=20_000, annual_inflation_rate=4, start_date=START
+            ),
+            house,
+        ],
+    )
+
+
+def deterministic(**kwargs):
+    simulation = VectorizedSimulation(START, MONTHS, *plan(**kwargs))
+    simulation.run()
+    result = simulation.result
+    return result.net_worth.sum(axis=1), result.column("net_worth", "Bank Account")
+
+
+def monte_carlo(distributions, **kwargs):
+    simulation = MonteCarloSimulation(
+        START, MONTHS, *plan(**kwargs), distributions, paths=3, seed=1
+    )
+    return simulation.run()
+
+
+@pytest.mark.parametrize("loan_start", ["2024-03-01", "2021-03-01"])
+def test_constant_plan_rates_match_the_deterministic_run(loan_start):
+    net_worth, bank_balance = deterministic(loan_start=loan_start)
+    result = monte_carlo(
+        {
+            "Salary": {"annual_inflation_rate": Constant(2)},
+            "Savings": {"annual_inflation_rate": Constant(4)},
+            "House": {"annual_expected_return": Constant(3)},
+            "Loan": {"annual_interest_rate": Constant(5)},
+        },
+        loan_start=loan_start,
+    )
+
+    np.testing.assert_allclose(result.net_worth, np.tile(net_worth, (3, 1)), atol=1e-6)
+    np.testing.assert_allclose(
+        result.bank_balance, np.tile(bank_balance, (3, 1)), atol=1e-6
+    )
+
+
+def test_loan_starting_in_the_horizon_pays_the_path_rate_from_its_first_month():
+    net_worth, bank_balance = deterministic(loan_rate=7.5)
+    result = monte_carlo({"Loan": {"annual_interest_rate": Constant(7.5)}})
+
+    np.testing.assert_allclose(result.net_worth, np.tile(net_worth, (3, 1)), atol=1e-6)
+    np.testing.assert_allclose(
+        result.bank_balance, np.tile(bank_balance, (3, 1)), atol=1e-6
+    )
+
+
+def test_bank_account_rate_can_not_be_stochastic():
+    with pytest.raises(ValueError, match="Bank Account"):
+        monte_carlo({"Bank Account": {"annual_inflation_rate": Constant(5)}})
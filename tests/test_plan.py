@@ -0,0 +1,111 @@
+import json
+
+import pytest
+
+from src.batch import evaluate_plans
+from src.plan import load_plan, plan_from_dict
+
+SIMULATION = {"start_date": "2023-10-01", "duration": 12}
+BANK = {"type": "BankAccount", "name": "Bank Account", "amount": 10_000}
+
+
+def plan(*assets_liabilities, **sections):
+    return {
+        "simulation": SIMULATION,
+        "assets_liabilities": [BANK, *assets_liabilities],
+        **sections,
+    }
+
+
+LOAN = {
+    "type": "Loan",
+    "name": "Loan",
+    "amount": 100_000,
+    "annual_interest_rate": 5,
+    "term_in_year": 25,
+}
+
+INVALID = {
+    "numeric string": (
+        plan({"type": "Entity", "name": "Salary", "amount": "100"}),
+        "amount is not a number",
+    ),
+    "boolean amount": (
+        plan({"type": "Entity", "name": "Salary", "amount": True}),
+        "amount is not a number",
+    ),
+    "fractional term": (plan({**LOAN, "term_in_year": 25.7}), "whole number"),
+    "missing field": (
+        plan({"type": "Stock", "name": "ETF", "amount": 1}),
+        "annual_expected_return is required",
+    ),
+    "unknown type": (
+        plan({"type": "Bond", "name": "Bond", "amount": 1}),
+        "unknown type",
+    ),
+    "end before start": (
+        plan(
+            {
+                "type": "Entity",
+                "name": "Rent",
+                "amount": -1,
+                "start_date": "2024-01-01",
+                "end_date": "2023-01-01",
+            }
+        ),
+        "end_date is before start_date",
+    ),
+    "number as a date": (
+        plan({"type": "Entity", "name": "Rent", "amount": -1, "start_date": 5}),
+        "start_date is not a date",
+    ),
+    "month as a date": (
+        plan({"type": "Entity", "name": "Rent", "amount": -1, "end_date": "2024-01"}),
+        "end_date is not a date",
+    ),
+    "name not a text": (
+        plan({"type": "Entity", "name": ["Rent"], "amount": -1}),
+        "name is not a text",
+    ),
+    "duplicate name": (plan({**BANK, "name": "Bank Account"}), "duplicate name"),
+    "section not a list": (plan(entities={"Salary": 1}), "entities is not a list"),
+    "entity not an object": (plan(entities=["Salary"]), "is not an object"),
+    "no bank account": ({"simulation": SIMULATION, "entities": [BANK]}, "Bank Account"),
+    "plan not an object": ([BANK], "the plan is not an object"),
+    "duration not a number": (
+        {**plan(), "simulation": {**SIMULATION, "duration": "ten"}},
+        "duration",
+    ),
+}
+
+
+@pytest.mark.parametrize("data, message", INVALID.values(), ids=list(INVALID))
+def test_invalid_plans_are_rejected(data, message):
+    with pytest.raises(ValueError, match=message):
+        plan_from_dict(data)
+
+
+def test_batches_list_invalid_plans_as_failures():
+    items = [(name, data) for name, (data, _) in INVALID.items()]
+    results, failures = evaluate_plans(items + [("valid", plan(LOAN))])
+
+    assert set(failures) == set(INVALID)
+    for name, (_, message) in INVALID.items():
+        assert message in failures[name]
+    assert [result.plan_ids for result in results] == [["valid"]]
+
+
+def test_every_problem_is_reported_at_once(tmp_path):
+    path = tmp_path / "plan.json"
+    path.write_text(
+        json.dumps(
+            plan(
+                {"type": "Entity", "name": "Salary", "amount": "100"},
+                {**LOAN, "term_in_year": 2.5},
+            )
+        )
+    )
+    with pytest.raises(ValueError, match="2 error") as error:
+        load_plan(str(path))
+    assert "row 1 (Salary)" in str(error.value)
+    assert "row 2 (Loan)" in str(error.value)
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+from src.entity import BankAccount, Entity, Loan, RealEstate
+from src.sensitivity import SensitivityAnalysis, _move
+from src.sweep import plan_from_entities
+from src.utils import month_range_keys
+from src.vectorized import VectorizedSimulation, nested_entities
+
+START = "2023-10-01"
+MONTHS = 120
+
+
+def plan():
+    house = RealEstate(
+        name="House",
+        amount=400_000,
+        cashdown=100_000,
+        annual_expected_return=3,
+        acquisition_entities=[
+            Entity(
+                name="Cashdown",
+                amount=-100_000,
+                start_date="2024-03-01",
+                end_date="2024-03-01",
+            ),
+            Entity(
+                name="Taxes",
+                amount=-300,
+                annual_inflation_rate=2,
+                start_date="2024-03-01",
+            ),
+        ],
+        loan=Loan(
+            name="Loan",
+            amount=300_000,
+            annual_interest_rate=5,
+            term_in_year=25,
+            start_date="2024-03-01",
+        ),
+        start_date="2024-03-01",
+    )
+    return plan_from_entities(
+        [
+            Entity(
+                name="Salary", amount=9_000, annual_inflation_rate=2, start_date=START
+            ),
+            Entity(name="Rent", amount=-1_500, start_date=START, end_date="2024-02-01"),
+        ],
+        [
+            BankAccount(name="Bank Account", amount=150_000, start_date=START),
+            BankAccount(
+                name="Savings", amount=20_000, annual_inflation_rate=4, start_date=START
+            ),
+            house,
+        ],
+    )
+
+
+def net_worth(cashflow, balance):
+    # Total net worth of a full run, without the negative bank account check
+    simulation = VectorizedSimulation(START, MONTHS, cashflow, balance)
+    _, results, _, _ = simulation._evaluate(month_range_keys(START, MONTHS))
+    return sum(results.values())
+
+
+@pytest.fixture(scope="module")
+def result():
+    return SensitivityAnalysis(START, MONTHS, *plan()).run()
+
+
+def test_every_numeric_parameter_is_moved(result):
+    moved = {(p.entity, p.parameter) for p in result.parameters}
+    assert ("Salary", "annual_inflation_rate") in moved
+    assert ("Savings", "annual_inflation_rate") in moved
+    assert ("Bank Account", "annual_inflation_rate") not in moved
+    assert ("Bank Account", "amount") in moved
+    assert ("Loan", "term_in_year") in moved
+    assert ("House", "start_date") in moved
+    assert ("Taxes", "amount") in moved
+    np.testing.assert_allclose(result.net_worth[0], net_worth(*plan()), atol=1e-6)
+
+
+def test_moves_match_full_runs_of_the_moved_plan(result):
+    for index, parameter in enumerate(result.parameters):
+        if parameter.parameter not in ("amount", "term_in_year", "start_date"):
+            continue
+        for row, sign in ((1 + 2 * index, 1), (2 + 2 * index, -1)):
+            cashflow, balance = plan()
+            entities = nested_entities(
+                list(cashflow.entities.values()) + list(balance.entities.values())
+            )
+            entity = next(e for e in entities if e.name == parameter.entity)
+            _move(entity, parameter, sign)
+            np.testing.assert_allclose(
+                result.net_worth[row],
+                net_worth(cashflow, balance),
+                atol=1e-6,
+                err_msg=f"{parameter} moved {sign}",
+            )
+
+
+def test_curves_are_per_unit_of_each_parameter(result):
+    curves = result.curves()
+    index = next(
+        i
+        for i, p in enumerate(result.parameters)
+        if (p.entity, p.parameter) == ("Salary", "amount")
+    )
+    step = result.parameters[index].step
+    swing = result.net_worth[1 + 2 * index] - result.net_worth[2 + 2 * index]
+    np.testing.assert_allclose(curves["Salary.amount"], swing / (2 * step))
@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+import src.service
+from src.service import _simulate
+
+SIMULATION = {"start_date": "2023-10-01", "duration": 12}
+BANK = {"type": "BankAccount", "name": "Bank Account", "amount": 10_000}
+PLAN = {"simulation": SIMULATION, "assets_liabilities": [BANK]}
+
+MALFORMED = [
+    {**PLAN, "entities": {"Salary": 1}},
+    {**PLAN, "simulation": [SIMULATION]},
+    {**PLAN, "entities": [{"name": "Rent", "amount": -1, "start_date": 5}]},
+    {**PLAN, "entities": [{"name": ["Rent"], "amount": -1}]},
+    {**PLAN, "entities": [{"name": "Rent", "amount": "-1"}]},
+]
+
+
+@pytest.mark.parametrize("plan", MALFORMED)
+def test_malformed_plans_are_bad_requests(plan):
+    ((status, body),) = _simulate([(plan, False)])
+
+    assert status == 400
+    assert json.loads(body)["error"].startswith("Invalid plan")
+
+
+def test_plan_errors_raised_by_the_engine_are_bad_requests(monkeypatch):
+    def evaluate_plans(*args, **kwargs):
+        raise TypeError("unsupported operand")
+
+    monkeypatch.setattr(src.service, "evaluate_plans", evaluate_plans)
+    malformed = {**PLAN, "entities": [{"name": "Rent", "amount": "-1"}]}
+
+    (bad,) = _simulate([(malformed, False)])
+    (fault,) = _simulate([(PLAN, False)])
+
+    assert bad[0] == 400 and "amount is not a number" in json.loads(bad[1])["error"]
+    assert fault == (500, b'{"error":"The simulation failed."}')
@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+import pytest
+import yaml
+
+from src.events import BuyStock, FinancialEvent, SellRealEstate, SellStock, UpdateEntity
+from src.plan import plan_from_dict
+from src.simulation import Simulation
+from src.vectorized import VectorizedSimulation
+
+PLAN = os.path.join(os.path.dirname(__file__), "..", "plans", "example.yaml")
+
+EVENTS = [
+    ("Raise", "2025-01-01", UpdateEntity("Salary 1", amount=9_000)),
+    ("Buy", "2026-03-01", BuyStock("ETF", 20_000)),
+    ("Sell", "2030-06-01", SellStock("ETF", 5_000)),
+    ("Triplex sale", "2031-01-01", SellRealEstate("Triplex")),
+]
+
+
+def example_plan():
+    # The example plan (loans, real estate) with a stock
+    with open(PLAN) as file:
+        data = yaml.safe_load(file)
+    data["assets_liabilities"].append(
+        {
+            "type": "Stock",
+            "name": "ETF",
+            "amount": 50_000,
+            "annual_expected_return": 6,
+            "start_date": "2023-10-01",
+        }
+    )
+    return plan_from_dict(data)
+
+
+def simulation(engine, events=True):
+    simulation = example_plan().simulation(engine=engine)
+    for name, date, action in EVENTS if events else []:
+        simulation.schedule_event(FinancialEvent(name, date, action))
+    return simulation
+
+
+def assert_same_results(actual, expected):
+    assert actual.names == expected.names
+    assert actual.dates[: actual.months] == expected.dates[: expected.months]
+    for table in ("cashflow", "net_worth"):
+        np.testing.assert_allclose(
+            getattr(actual, table), getattr(expected, table), rtol=0, atol=0.005
+        )
+
+
+@pytest.mark.parametrize("events", [False, True])
+def test_vectorized_matches_the_month_by_month_engine(events):
+    loop = simulation(Simulation, events)
+    loop.run()
+    vectorized = simulation(VectorizedSimulation, events)
+    vectorized.run()
+
+    assert_same_results(vectorized.result, loop.result)
+
+
+@pytest.mark.parametrize("engine", [Simulation, VectorizedSimulation])
+def test_resumed_checkpoint_matches_the_full_run(engine, tmp_path):
+    full = simulation(engine)
+    full.run()
+
+    path = str(tmp_path / "run.ckpt")
+    interrupted = simulation(engine)
+    interrupted.auto_checkpoint(path, every=60)
+    interrupted.run()
+    # The last checkpoint is 60 months or less before the end, with events
+    # still to fire
+    resumed = engine.resume(path)
+    assert resumed.result.months < full.result.months
+    resumed.run()
+
+    assert_same_results(resumed.result, full.result)